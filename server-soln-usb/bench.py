@@ -0,0 +1,300 @@
+"""
+    python3 bench.py [-g graph-file] [--size N] [--seed S] benchmark
+
+Timing harness for the routing code.  Each benchmark runs on the graph
+given with -g or, if none is given, on a synthetic grid of roughly
+--size vertices so that it can be run without the Edmonton data.
+
+Benchmarks:
+    mapmatch   map matching throughput, in trace points per second
+    traversal  traversal.bfs/dfs/topological_order/scc on a Digraph and a
+               CompactGraph, against digraph.shortest_path and
+               digraph.spanning_tree
+    sharded    partition.ShardedRouter over --shards x --shards worker
+               processes, checked against dijkstra.least_cost_path
+    ordering   dijkstra.bounded_search, bfs and scc with vertices numbered
+               in file order, along a Hilbert curve and along a Morton
+               curve (see ordering.py).  The synthetic grid first gets
+               scattered ids, like OpenStreetMap ids.  Cache misses cannot
+               be counted from Python; run the benchmark under
+               perf stat -e cache-misses to see them.
+"""
+import argparse
+import random
+import sys
+import time
+
+import digraph
+import dijkstra
+import readModule
+
+
+def grid_map(rows, cols, spacing=100):
+    """
+    Returns (G, V_coord) for a rows x cols grid of two-way streets with
+    vertices spacing V_coord units apart.
+
+    >>> (G, V_coord) = grid_map(2, 3)
+    >>> (G.num_vertices(), G.num_edges())
+    (6, 14)
+    >>> V_coord[5]
+    (100, 200)
+    """
+    V_coord = {}
+    E = []
+    for r in range(rows):
+        for c in range(cols):
+            v = r * cols + c
+            V_coord[v] = (r * spacing, c * spacing)
+            if c + 1 < cols:
+                E.append((v, v + 1))
+                E.append((v + 1, v))
+            if r + 1 < rows:
+                E.append((v, v + cols))
+                E.append((v + cols, v))
+    G = digraph.Digraph(E)
+    for v in V_coord:
+        G.add_vertex(v)
+    return (G, V_coord)
+
+
+def load(args):
+    """
+    Returns (G, V_coord) for the graph the benchmarks should run on.
+    """
+    if args.graphname:
+        (E, E_name, V, V_coord) = readModule.read_graph(args.graphname)
+        G = digraph.Digraph(E)
+        for v in V:
+            G.add_vertex(v)
+        return (G, V_coord)
+    side = max(2, int(args.size ** .5))
+    return grid_map(side, side)
+
+
+def report(name, count, unit, seconds):
+    print("{:<24} {:>10} {} in {:8.3f}s  {:12.1f} {}/s".format(
+        name, count, unit, seconds, count / seconds if seconds else 0.0, unit))
+
+
+def random_trace(G, V_coord, length, noise, rng):
+    """
+    Returns a list of noisy (lat, lon) points along a random walk on G,
+    one point per vertex visited, at least length points long unless
+    the walk gets stuck.
+    """
+    v = rng.choice(list(V_coord))
+    trace = []
+    prev = None
+    while len(trace) < length:
+        (lat, lon) = V_coord[v]
+        trace.append((lat + rng.randint(-noise, noise),
+                      lon + rng.randint(-noise, noise)))
+        choices = [w for w in G.adj_to(v) if w != prev] or list(G.adj_to(v))
+        if not choices:
+            break
+        (prev, v) = (v, rng.choice(choices))
+    return trace
+
+
+def bench_mapmatch(G, V_coord, args, rng):
+    import mapmatch
+
+    matcher = mapmatch.MapMatcher(G, V_coord)
+    trace = random_trace(G, V_coord, args.points, 15, rng)
+
+    t = time.perf_counter()
+    n = sum(1 for item in matcher.match(trace))
+    report("mapmatch", n, "points", time.perf_counter() - t)
+
+
+def timed(fn, *args):
+    t = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - t
+
+
+def bench_traversal(G, V_coord, args, rng):
+    import compact
+    import traversal
+
+    t = time.perf_counter()
+    C = compact.CompactGraph.from_digraph(G, order=V_coord)
+    report("compact build", C.num_edges(), "edges", time.perf_counter() - t)
+
+    source = rng.choice(list(V_coord))
+    n = G.num_vertices()
+
+    # shortest_path to a vertex that does not exist has to search
+    # everything reachable, just like a full bfs
+    report("digraph.shortest_path", n, "vertices",
+           timed(digraph.shortest_path, G, source, None))
+    report("bfs Digraph", n, "vertices", timed(traversal.bfs, G, source))
+    report("bfs CompactGraph", n, "vertices", timed(traversal.bfs, C, source))
+
+    report("digraph.spanning_tree", n, "vertices",
+           timed(digraph.spanning_tree, G, source))
+    report("dfs Digraph", n, "vertices", timed(traversal.dfs, G, source))
+    report("dfs CompactGraph", n, "vertices", timed(traversal.dfs, C, source))
+
+    report("topo Digraph", n, "vertices", timed(traversal.topological_order, G))
+    report("topo CompactGraph", n, "vertices",
+           timed(traversal.topological_order, C))
+    report("scc Digraph", n, "vertices", timed(traversal.scc, G))
+    report("scc CompactGraph", n, "vertices", timed(traversal.scc, C))
+
+
+def distance_cost(V_coord):
+    def cost(e):
+        (a, b) = (V_coord[e[0]], V_coord[e[1]])
+        return ((a[0] - b[0])**2 + (a[1] - b[1])**2)**.5
+    return cost
+
+
+def bench_sharded(G, V_coord, args, rng):
+    import partition
+
+    cost = distance_cost(V_coord)
+    vertices = list(V_coord)
+    pairs = [(rng.choice(vertices), rng.choice(vertices))
+             for i in range(args.queries)]
+
+    t = time.perf_counter()
+    router = partition.ShardedRouter(G.edges(), V_coord, cost,
+                                     args.shards, args.shards)
+    report("sharded setup", len(router.overlay), "overlay vertices",
+           time.perf_counter() - t)
+    try:
+        t = time.perf_counter()
+        for (start, dest) in pairs:
+            router.least_cost_path(start, dest)
+        report("sharded queries", len(pairs), "queries", time.perf_counter() - t)
+
+        t = time.perf_counter()
+        for (start, dest) in pairs:
+            dijkstra.bounded_search(G, start, cost, targets={dest})
+        report("single process queries", len(pairs), "queries",
+               time.perf_counter() - t)
+
+        checked = pairs[:args.verify]
+        wrong = partition.verify(router, G, cost, checked)
+        print("verified {} routes against least_cost_path, {} wrong".format(
+            len(checked), len(wrong)))
+    finally:
+        router.close()
+
+
+def scatter(G, V_coord, rng):
+    """
+    Returns (G, V_coord) with every vertex given a random 9 digit id and
+    V_coord in random order, like the ids of a real map file, which say
+    nothing about where a vertex is.
+    """
+    vertices = list(V_coord)
+    rng.shuffle(vertices)
+    new_ids = rng.sample(range(10**8, 10**9), len(vertices))
+    rename = dict(zip(vertices, new_ids))
+    H = digraph.Digraph([(rename[u], rename[v]) for (u, v) in G.edges()])
+    for v in new_ids:
+        H.add_vertex(v)
+    return (H, {rename[v]: V_coord[v] for v in vertices})
+
+
+def bench_ordering(G, V_coord, args, rng):
+    import compact
+    import ordering
+    import traversal
+
+    if not args.graphname:
+        (G, V_coord) = scatter(G, V_coord, rng)
+    E = G.edges()
+    V = G.vertices()
+    vertices = list(V_coord)
+    pairs = [(rng.choice(vertices), rng.choice(vertices))
+             for i in range(args.queries)]
+    n = len(V_coord)
+
+    for curve in ("file", "hilbert", "morton"):
+        # dense numbers in file order, or along the curve
+        t = time.perf_counter()
+        if curve == "file":
+            ids = vertices
+        else:
+            ids = ordering.Renumbering(V_coord, curve, V).ids
+        number = {v: i for (i, v) in enumerate(ids)}
+        H = digraph.Digraph((number[u], number[v]) for (u, v) in E)
+        for i in range(len(ids)):
+            H.add_vertex(i)
+        H_coord = {i: V_coord[v] for (i, v) in enumerate(ids)}
+        report("renumber " + curve, n, "vertices", time.perf_counter() - t)
+
+        cost = distance_cost(H_coord)
+        t = time.perf_counter()
+        for (start, dest) in pairs:
+            dijkstra.bounded_search(H, number[start], cost,
+                                    targets={number[dest]})
+        report("search " + curve, len(pairs), "queries", time.perf_counter() - t)
+
+        C = compact.CompactGraph(range(len(ids)), H.edges())
+        source = number[pairs[0][0]] if pairs else 0
+        report("bfs compact " + curve, n, "vertices",
+               timed(traversal.bfs, C, source))
+        report("scc compact " + curve, n, "vertices", timed(traversal.scc, C))
+
+    # the same searches on the original ids, as least_cost_path sees them
+    cost = distance_cost(V_coord)
+    t = time.perf_counter()
+    for (start, dest) in pairs:
+        dijkstra.bounded_search(G, start, cost, targets={dest})
+    report("search original ids", len(pairs), "queries", time.perf_counter() - t)
+
+
+BENCHMARKS = {
+    "mapmatch": bench_mapmatch,
+    "traversal": bench_traversal,
+    "sharded": bench_sharded,
+    "ordering": bench_ordering,
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Routing benchmarks.')
+    parser.add_argument('benchmark', nargs='*',
+                        help='benchmarks to run (DEFAULT = all): ' +
+                             ', '.join(sorted(BENCHMARKS)))
+    parser.add_argument('-g', '--graph', dest='graphname', default=None,
+                        help='path to graph (DEFAULT = synthetic grid)')
+    parser.add_argument('--size', type=int, default=10000,
+                        help='vertices in the synthetic grid (DEFAULT = 10000)')
+    parser.add_argument('--points', type=int, default=2000,
+                        help='length of generated traces (DEFAULT = 2000)')
+    parser.add_argument('--queries', type=int, default=200,
+                        help='routing queries to time (DEFAULT = 200)')
+    parser.add_argument('--verify', type=int, default=5,
+                        help='queries to check against least_cost_path (DEFAULT = 5)')
+    parser.add_argument('--shards', type=int, default=2,
+                        help='shards along each side for sharded (DEFAULT = 2)')
+    parser.add_argument('--seed', type=int, default=296,
+                        help='random seed (DEFAULT = 296)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    names = args.benchmark or sorted(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print("Unknown benchmark {}".format(name), file=sys.stderr)
+            return 1
+
+    t = time.perf_counter()
+    (G, V_coord) = load(args)
+    report("load", len(V_coord), "vertices", time.perf_counter() - t)
+
+    for name in names:
+        BENCHMARKS[name](G, V_coord, args, random.Random(args.seed))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
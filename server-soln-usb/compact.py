@@ -0,0 +1,159 @@
+"""
+Compact array representation of a Digraph.
+
+Digraph keeps a Python set per vertex in each direction, which is easy to
+change but large and slow to walk.  CompactGraph is a read-only copy in
+compressed sparse row form:
+
+    ids[i]          the vertex id of vertex index i
+    index[v]        the vertex index of vertex id v
+    out_start       out edges of vertex index i are the edge numbers
+                    out_start[i] .. out_start[i+1]-1
+    source[e]       vertex index the edge e leaves
+    target[e]       vertex index the edge e enters
+    in_start        in edges of vertex index i are in_edge[in_start[i]] ..
+                    in_edge[in_start[i+1]-1]
+    in_edge         edge numbers, grouped by the vertex they enter
+
+Edges are numbered 0 .. m-1 and out edges of one vertex are contiguous,
+so an edge number is a cheap handle for per edge data kept in arrays.
+
+>>> import digraph
+>>> G = digraph.Digraph([(10, 20), (20, 30), (10, 30)])
+>>> C = CompactGraph.from_digraph(G, order=[10, 20, 30])
+>>> (C.num_vertices(), C.num_edges())
+(3, 3)
+>>> [C.edge(e) for e in C.out_edges(C.index[10])]
+[(10, 20), (10, 30)]
+>>> sorted(C.edge(e) for e in C.in_edges(C.index[30]))
+[(10, 30), (20, 30)]
+>>> sorted(C.adj_to(10))
+[20, 30]
+>>> sorted(C.adj_from(30))
+[10, 20]
+"""
+
+from array import array
+
+
+class CompactGraph:
+    """
+    Read-only compressed sparse row digraph.  Build one with
+    from_digraph or from_edges.
+    """
+
+    def __init__(self, ids, edges):
+        """
+        ids is the list of vertex ids, in the order they should be
+        numbered.  edges is an iterable of (u, v) vertex id pairs.
+        """
+        self.ids = list(ids)
+        self.index = {v: i for (i, v) in enumerate(self.ids)}
+        n = len(self.ids)
+        index = self.index
+
+        pairs = sorted((index[u], index[v]) for (u, v) in edges)
+        m = len(pairs)
+
+        self.source = array('l', (p[0] for p in pairs))
+        self.target = array('l', (p[1] for p in pairs))
+
+        out_start = array('l', [0]) * (n + 1)
+        for s in self.source:
+            out_start[s + 1] += 1
+        for i in range(n):
+            out_start[i + 1] += out_start[i]
+        self.out_start = out_start
+
+        in_start = array('l', [0]) * (n + 1)
+        for t in self.target:
+            in_start[t + 1] += 1
+        for i in range(n):
+            in_start[i + 1] += in_start[i]
+        fill = array('l', in_start)
+        in_edge = array('l', [0]) * m
+        for e in range(m):
+            t = self.target[e]
+            in_edge[fill[t]] = e
+            fill[t] += 1
+        self.in_start = in_start
+        self.in_edge = in_edge
+
+    @classmethod
+    def from_digraph(cls, G, order=None):
+        """
+        Returns a CompactGraph copy of the Digraph G.  order, if given,
+        lists every vertex of G in the order they should be numbered.
+        """
+        if order is None:
+            order = G.vertices()
+        return cls(order, G.edges())
+
+    @classmethod
+    def from_edges(cls, V, E, order=None):
+        """
+        Returns a CompactGraph for the vertices V and edges E, as returned
+        by readModule.read_graph.
+        """
+        if order is None:
+            order = V
+        return cls(order, E)
+
+    def num_vertices(self):
+        return len(self.ids)
+
+    def num_edges(self):
+        return len(self.target)
+
+    def out_edges(self, i):
+        """
+        Edge numbers leaving vertex index i.
+        """
+        return range(self.out_start[i], self.out_start[i + 1])
+
+    def in_edges(self, i):
+        """
+        Edge numbers entering vertex index i.
+        """
+        in_edge = self.in_edge
+        return [in_edge[k] for k in range(self.in_start[i], self.in_start[i + 1])]
+
+    def edge(self, e):
+        """
+        Returns edge number e as a (u, v) pair of vertex ids.
+        """
+        return (self.ids[self.source[e]], self.ids[self.target[e]])
+
+    def edge_number(self, u, v):
+        """
+        Returns the number of the edge from vertex id u to vertex id v,
+        or None if there is no such edge.
+        """
+        i = self.index[u]
+        j = self.index[v]
+        target = self.target
+        for e in self.out_edges(i):
+            if target[e] == j:
+                return e
+        return None
+
+    def adj_to(self, v):
+        """
+        Vertex ids with an edge from vertex id v, like Digraph.adj_to.
+        """
+        ids = self.ids
+        target = self.target
+        return [ids[target[e]] for e in self.out_edges(self.index[v])]
+
+    def adj_from(self, v):
+        """
+        Vertex ids with an edge to vertex id v, like Digraph.adj_from.
+        """
+        ids = self.ids
+        source = self.source
+        return [ids[source[e]] for e in self.in_edges(self.index[v])]
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -3,12 +3,8 @@ Graph module for undirected graphs.
 """
 
 import random
+from collections import deque
 
-try:
-    import display
-except:
-    print("Warning: failed to load display module.  Graph drawing will not work.")
-    
 class Digraph:
     """
     Directed graph.  The vertices must be immutable.
@@ -86,11 +82,27 @@ class Digraph:
         """
         return set(self._tosets.keys())
 
-    def draw(self, filename, attr = {}):
+    def iter_edges(self):
         """
-        Draws the graph into a dot file.
+        Generates the edges of the graph as ordered tuples, without
+        building the whole set as edges() does.
+
+        >>> sorted(Digraph([(1, 2), (2, 1)]).iter_edges())
+        [(1, 2), (2, 1)]
         """
-        display.write_dot_desc((self.vertices(), self.eges()), filename, attr)
+        for v in self._tosets:
+            for w in self._tosets[v]:
+                yield (v, w)
+
+    def draw(self, filename, attr = {}, **options):
+        """
+        Draws the graph into a dot file.  The vertices and edges are
+        streamed out, see display.write_dot_stream for the options.
+        """
+        # only loaded here, so that using graphs does not need it
+        import display
+        display.write_dot_stream((iter(self._tosets), self.iter_edges()),
+                                 filename, 'digraph', attr, **options)
 
     def num_edges(self):
         """
@@ -180,10 +192,11 @@ class Digraph:
         # Sets first element as previous for base case
         # Will always be previous cursor for every other case
         # This makes a single point a valid path from itself to itself
+        tosets = self._tosets
         prevertex = path[0]
         value = False
         for vertex in path:
-            if (vertex in self.adj_to(prevertex)) or (vertex == prevertex):
+            if (vertex == prevertex) or (vertex in tosets.get(prevertex, ())):
                 value = True
                 prevertex = vertex
             else:
@@ -213,8 +226,26 @@ def random_graph(n, m):
     if m > max_num_edges:
         raise ValueError("For {} vertices, you wanted {} edges, but can only have a maximum of {}".format(n, m, max_num_edges))
 
-    while G.num_edges() < m:
-        G.add_edge(random.sample(range(n), 2))
+    # Pick edges by number, u * n + v, so that duplicates are cheap to
+    # spot.  When more than half of all edges are wanted, pick the ones
+    # to leave out instead, so that retries stay rare.
+    want = min(m, max_num_edges - m)
+    picked = set()
+    while len(picked) < want:
+        u = random.randrange(n)
+        v = random.randrange(n - 1)
+        if v >= u:
+            v += 1
+        picked.add(u * n + v)
+
+    if want == m:
+        for e in picked:
+            G.add_edge(divmod(e, n))
+    else:
+        for u in range(n):
+            for v in range(n):
+                if u != v and u * n + v not in picked:
+                    G.add_edge((u, v))
 
     return G
 
@@ -304,11 +335,11 @@ def shortest_path(G, source, dest):
     False
     """
     parent = {}
-    queue = []
+    queue = deque()
     queue.append(source)
     
     while queue:
-        cur = queue.pop(0)
+        cur = queue.popleft()
         if cur == dest:
             path = [dest]
             while path[-1] != source:
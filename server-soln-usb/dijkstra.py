@@ -1,4 +1,5 @@
-import digraph
+import heapq
+import time
 
 def least_cost_path(G, start, dest, cost):
     """
@@ -59,11 +60,8 @@ def least_cost_path(G, start, dest, cost):
     parent = {}
 
     # Check if the start and dest are in the given graph
-    if not(start in G.vertices() and dest in G.vertices()):
-        return None
-
-    # If the vertices exist, check if a path exists between the two vertices:
-    if digraph.shortest_path(G, start, dest) == None:
+    vertices = G.vertices()
+    if not(start in vertices and dest in vertices):
         return None
 
     while todo and (dest not in visited):
@@ -85,18 +83,136 @@ def least_cost_path(G, start, dest, cost):
                 parent[n] = cur
 
     # if there is a path, extract it.  The graph may be disconnected
-    # so in that case return None
-    # extract path
+    # so in that case return None.  A path taken from parent is always
+    # a path in G, so it is not checked again.
+    if dest not in visited:
+        return None
+    return extract_path(parent, start, dest)
+
+class Budget:
+    """
+    The effort one search may spend: at most max_settled settled
+    vertices and at most max_seconds of wall time, either of which may
+    be None for no limit.  A search calls start() when it begins and
+    spend() before settling each vertex; spend() returns False once the
+    budget is used up, and exhausted then says which limit ran out,
+    "settled" or "time".  Use a new Budget, or start() again, for each
+    search.
+
+    >>> b = Budget(max_settled=2)
+    >>> b.start()
+    >>> [b.spend() for i in range(3)], b.exhausted
+    ([True, True, False], 'settled')
+    """
+
+    # the clock is only read every so many settled vertices
+    CHECK_EVERY = 64
+
+    def __init__(self, max_settled=None, max_seconds=None):
+        self.max_settled = max_settled
+        self.max_seconds = max_seconds
+        self.start()
+
+    def start(self):
+        self.settled = 0
+        self.exhausted = None
+        self.deadline = None
+        if self.max_seconds is not None:
+            self.deadline = time.perf_counter() + self.max_seconds
+
+    def spend(self):
+        self.settled += 1
+        if self.max_settled is not None and self.settled > self.max_settled:
+            self.exhausted = "settled"
+            return False
+        if (self.deadline is not None and self.settled % self.CHECK_EVERY == 0
+                and time.perf_counter() > self.deadline):
+            self.exhausted = "time"
+            return False
+        return True
+
+def bounded_search(G, start, cost, limit=float("inf"), targets=None,
+                   budget=None):
+    """
+    (dist, parent) = bounded_search(G, start, cost, limit, targets, budget)
+
+    Runs Dijkstra's algorithm from start using a binary heap, but gives
+    up on any vertex whose cost from start would exceed limit.  If
+    targets is given the search also stops as soon as every vertex in
+    targets has been settled.  Given a Budget, the search also stops
+    when the budget runs out, and budget.exhausted says so.
+
+    dist[v] is the least cost from start to v for every settled vertex,
+    and parent[v] is the vertex just before v on that least cost path.
+
+    >>> import digraph
+    >>> G = digraph.Digraph([(1, 2), (2, 3), (3, 4), (1, 3)])
+    >>> def unit(e): return 1
+    >>> (dist, parent) = bounded_search(G, 1, unit)
+    >>> sorted(dist.items())
+    [(1, 0), (2, 1), (3, 1), (4, 2)]
+    >>> (dist, parent) = bounded_search(G, 1, unit, limit=1)
+    >>> sorted(dist)
+    [1, 2, 3]
+    >>> (dist, parent) = bounded_search(G, 1, unit, targets={2})
+    >>> 4 in dist
+    False
+    >>> budget = Budget(max_settled=2)
+    >>> (dist, parent) = bounded_search(G, 1, unit, budget=budget)
+    >>> (len(dist), budget.exhausted)
+    (2, 'settled')
+    """
+    dist = {}
+    parent = {}
+    best = {start: 0}
+    heap = [(0, start)]
+    remaining = set(targets) if targets is not None else None
+    if budget is not None:
+        budget.start()
+
+    while heap:
+        (c, cur) = heapq.heappop(heap)
+        if cur in dist:
+            continue
+        if budget is not None and not budget.spend():
+            break
+        dist[cur] = c
+
+        if remaining is not None:
+            remaining.discard(cur)
+            if not remaining:
+                break
+
+        for n in G.adj_to(cur):
+            if n in dist:
+                continue
+            nc = c + cost((cur, n))
+            if nc <= limit and (n not in best or nc < best[n]):
+                best[n] = nc
+                parent[n] = cur
+                heapq.heappush(heap, (nc, n))
+
+    return (dist, parent)
+
+def extract_path(parent, start, dest):
+    """
+    Walks the parent map from dest back to start and returns the path
+    from start to dest, or None if dest was never reached.
+
+    >>> extract_path({2: 1, 3: 2}, 1, 3)
+    [1, 2, 3]
+    >>> extract_path({2: 1}, 1, 1)
+    [1]
+    >>> print(extract_path({2: 1}, 1, 4))
+    None
+    """
+    if dest != start and dest not in parent:
+        return None
     path = [dest]
     while path[-1] != start:
         path.append(parent[path[-1]])
     path.reverse()
-    
-    if G.is_path(path) == True:
-        return path
-
-    else:
-        return None
+    return path
 
 if __name__ == "__main__":
     import doctest
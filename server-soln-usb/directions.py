@@ -0,0 +1,197 @@
+"""
+Street names and turn by turn directions.
+
+StreetNames keeps each distinct street name once, numbered from 0, and
+gives every edge the number of its name instead of its own string.
+Given a compact.CompactGraph, the numbers are kept in an array indexed
+by its edge numbers, a few bytes an edge instead of a dict entry.
+
+instructions turns a path into a short list of steps by merging runs of
+consecutive edges on the same street: "Follow 109 Street for 850 m",
+"Turn left onto 82 Avenue", and so on, rather than hundreds of
+waypoints.
+
+>>> V_coord = {1: (0, 0), 2: (100, 0), 3: (200, 0), 4: (200, -100)}
+>>> E_name = {(1, 2): "109 Street", (2, 3): "109 Street", (3, 4): "82 Avenue"}
+>>> names = StreetNames(E_name)
+>>> names.names
+['109 Street', '82 Avenue']
+>>> names.name_of((2, 3))
+'109 Street'
+>>> import compact
+>>> C = compact.CompactGraph.from_edges(V_coord, E_name)
+>>> names = StreetNames(E_name, C)
+>>> (names.edge_name, names.name_of((3, 4)))
+(array('l', [0, 0, 1]), '82 Avenue')
+>>> for line in describe([1, 2, 3, 4], names, V_coord):
+...     print(line)
+Follow 109 Street for 223 m
+Turn left onto 82 Avenue
+Follow 82 Avenue for 66 m
+Arrive at destination
+"""
+
+import math
+from array import array
+
+# metres per V_coord unit (1e-5 degree) north-south, and east-west at
+# Edmonton's latitude
+METRES_LAT = 1.11320
+METRES_LON = METRES_LAT * math.cos(math.radians(53.54))
+
+
+def metres(a, b):
+    """
+    Approximate ground distance in metres between two V_coord points.
+
+    >>> round(metres((0, 0), (100, 0)), 1)
+    111.3
+    """
+    dlat = (b[0] - a[0]) * METRES_LAT
+    dlon = (b[1] - a[1]) * METRES_LON
+    return (dlat * dlat + dlon * dlon) ** .5
+
+
+class StreetNames:
+    """
+    Interned street name table.
+
+    names[i] is the i-th distinct name and edge_name[e] is the name
+    number of edge e: a dict keyed by (u, v), or given the CompactGraph
+    C an array('l') indexed by the edge numbers of C.  An edge without a
+    name gets the name "".
+    """
+
+    def __init__(self, E_name, C=None):
+        self.names = []
+        self.number = {}
+        self.C = C
+        if C is None:
+            self.edge_name = {}
+            for (e, name) in E_name.items():
+                self.edge_name[e] = self.intern(name)
+        else:
+            self.edge_name = array('l', (self.intern(E_name.get(C.edge(e), ""))
+                                         for e in range(C.num_edges())))
+
+    def intern(self, name):
+        """
+        Returns the number of name, adding it to the table if needed.
+        """
+        i = self.number.get(name)
+        if i is None:
+            i = self.number[name] = len(self.names)
+            self.names.append(name)
+        return i
+
+    def __len__(self):
+        return len(self.names)
+
+    def name_id(self, e):
+        """
+        Returns the name number of edge e = (u, v).
+        """
+        C = self.C
+        if C is None:
+            i = self.edge_name.get(e)
+        elif e[0] in C.index and e[1] in C.index:
+            f = C.edge_number(e[0], e[1])
+            i = None if f is None else self.edge_name[f]
+        else:
+            i = None
+        if i is None:
+            i = self.intern("")
+        return i
+
+    def name_of(self, e):
+        """
+        Returns the name of edge e = (u, v).
+        """
+        return self.names[self.name_id(e)]
+
+    def for_compact(self, C):
+        """
+        Returns an array of name numbers indexed by the edge numbers of
+        the compact.CompactGraph C.
+        """
+        if C is self.C:
+            return self.edge_name
+        return array('l', (self.name_id(C.edge(e)) for e in range(C.num_edges())))
+
+    def describe(self, path, V_coord):
+        """
+        Returns the steps of path as a list of English instructions, see
+        describe.
+        """
+        return describe(path, self, V_coord)
+
+
+def instructions(path, names, V_coord):
+    """
+    Collapses path into steps along one street each.  Returns a list of
+    (name number, index in path where the step starts, index where it
+    ends, length in metres).  A path of a single vertex has no steps.
+
+    >>> V_coord = {1: (0, 0), 2: (100, 0), 3: (200, 0)}
+    >>> names = StreetNames({(1, 2): "A", (2, 3): "A"})
+    >>> [(n, i, j, round(d)) for (n, i, j, d) in instructions([1, 2, 3], names, V_coord)]
+    [(0, 0, 2, 223)]
+    """
+    steps = []
+    name_id = names.name_id
+    for i in range(len(path) - 1):
+        n = name_id((path[i], path[i + 1]))
+        d = metres(V_coord[path[i]], V_coord[path[i + 1]])
+        if steps and steps[-1][0] == n:
+            (n, first, last, total) = steps[-1]
+            steps[-1] = (n, first, i + 1, total + d)
+        else:
+            steps.append((n, i, i + 1, d))
+    return steps
+
+
+def turn(a, b, c):
+    """
+    Says which way to turn at b going from a to c: "left", "right",
+    "straight" or "around", from the V_coord points a, b and c.
+
+    >>> turn((0, 0), (10, 0), (10, -10)), turn((0, 0), (10, 0), (10, 10))
+    ('left', 'right')
+    >>> turn((0, 0), (10, 0), (20, 1)), turn((0, 0), (10, 0), (0, 0))
+    ('straight', 'around')
+    """
+    # x is east (lon) and y is north (lat)
+    (x1, y1) = ((b[1] - a[1]) * METRES_LON, (b[0] - a[0]) * METRES_LAT)
+    (x2, y2) = ((c[1] - b[1]) * METRES_LON, (c[0] - b[0]) * METRES_LAT)
+    angle = math.degrees(math.atan2(x1 * y2 - y1 * x2, x1 * x2 + y1 * y2))
+    if abs(angle) < 20:
+        return "straight"
+    if abs(angle) > 160:
+        return "around"
+    return "left" if angle > 0 else "right"
+
+
+def describe(path, names, V_coord):
+    """
+    Returns the steps of path as a list of English instructions.
+    """
+    lines = []
+    for (k, (n, first, last, d)) in enumerate(instructions(path, names, V_coord)):
+        name = names.names[n] or "the road"
+        if k > 0:
+            way = turn(V_coord[path[first - 1]], V_coord[path[first]],
+                       V_coord[path[first + 1]])
+            if way == "straight":
+                lines.append("Continue onto {}".format(name))
+            elif way == "around":
+                lines.append("Turn around onto {}".format(name))
+            else:
+                lines.append("Turn {} onto {}".format(way, name))
+        lines.append("Follow {} for {:.0f} m".format(name, d))
+    lines.append("Arrive at destination")
+    return lines
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
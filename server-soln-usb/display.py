@@ -40,34 +40,29 @@ Each of these keys maps to a dictionary.
 import time
 import sys
 
-def gen_dot_desc(G, graphtype='graph', attributes={}):
+def _dot_lines(G, graphtype='graph', attributes={}, keep=None,
+               highlight=None, highlight_color="red", V_coord=None):
     """
-    Given graph G, return a string that encodes the dot
-    representation of G.
-
-    >>> g = ({1, 2, 3}, {(1, 2), (1, 3)} )
-    >>> s = gen_dot_desc(g)
- 
+    Generates the lines of the dot representation of G = (V, E) one at
+    a time, looking at each vertex and edge only once.
+
+    keep, if given, is a function of a vertex; vertices it rejects, and
+    edges touching them, are left out.  highlight, if given, is a path
+    (list of vertices) whose vertices and edges are drawn in
+    highlight_color unless attributes says otherwise.  If V_coord is
+    given each vertex is pinned at its coordinates, for neato -n.
     """
-    if "vertex_color" in attributes:
-        vertex_color=attributes["vertex_color"]
-    else:
-        vertex_color={ }
-
-    if "edge_color" in attributes:
-        edge_color=attributes["edge_color"]
+    vertex_color = attributes.get("vertex_color", {})
+    edge_color = attributes.get("edge_color", {})
+    vertex_label = attributes.get("vertex_label", {})
+    edge_label = attributes.get("edge_label", {})
+
+    # only the route itself is remembered, never the whole graph
+    if highlight:
+        on_path = set(highlight)
+        path_edges = set(zip(highlight, highlight[1:]))
     else:
-        edge_color={ }
-
-    if "vertex_label" in attributes:
-        vertex_label=attributes["vertex_label"]
-    else:
-        vertex_label={ }
-
-    if "edge_label" in attributes:
-        edge_label=attributes["edge_label"]
-    else:
-        edge_label={ }
+        on_path = path_edges = ()
 
     (V, E) = G
 
@@ -77,7 +72,7 @@ def gen_dot_desc(G, graphtype='graph', attributes={}):
         edgesym = "->"
 
     # generate the header
-    dot_desc = ( graphtype + 
+    yield ( graphtype + 
         " g {\n" + 
         "  ordering=out;\n" +
         "  node [shape=circle];\n" +
@@ -85,38 +80,69 @@ def gen_dot_desc(G, graphtype='graph', attributes={}):
         )
 
     # now generate vertex and edges information
-    if len(V) == 0:
-       dot_desc += "Empty [shape=ellipse];\n"
+    empty = True
+    for n in V:
+        if keep is not None and not keep(n):
+            continue
+        empty = False
+
+        color = "white"
+        if n in vertex_color: 
+            color = vertex_color[n]
+        elif n in on_path:
+            color = highlight_color
+
+        label = str(n)
+        if n in vertex_label: 
+            label = vertex_label[n]
+
+        pos = ""
+        if V_coord is not None:
+            pos = ', pos="{},{}"'.format(V_coord[n][1], V_coord[n][0])
+
+        yield '  {v} [label="{l}", style=filled, fillcolor="{c}"{p}];\n'.format(
+            v=str(n), l=label, c=color, p=pos)
+
+    if empty:
+        yield "Empty [shape=ellipse];\n"
     else:
-        for n in V:
-            color = "white"
-            if n in vertex_color: 
-                color = vertex_color[n]
-
-            label = str(n)
-            if n in vertex_label: 
-                label = vertex_label[n]
-
-            dot_desc += '  {v} [label="{l}", style=filled, fillcolor="{c}"];\n'.format(
-                v=str(n), l=label, c=color)
-
         for e in E:
             (x, y) = e
+            if keep is not None and not (keep(x) and keep(y)):
+                continue
             color = "black"
             if e in edge_color: 
                 color = edge_color[e]
+            elif e in path_edges or (edgesym == "--" and (y, x) in path_edges):
+                color = highlight_color
             label = ""
             if e in edge_label:
                 label = ', label="{}"'.format(edge_label[e])
 
-            dot_desc += '  {vx} {esym} {vy} [color="{c}" {l}];\n'.format(
+            yield '  {vx} {esym} {vy} [color="{c}" {l}];\n'.format(
                     esym=edgesym, vx=str(x), vy=str(y), c=color, l=label)
 
-
     # close off the description
-    dot_desc += "}\n"
+    yield "}\n"
 
-    return dot_desc
+def gen_dot_desc(G, graphtype='graph', attributes={}):
+    """
+    Given graph G, return a string that encodes the dot
+    representation of G.
+
+    >>> g = ({1, 2, 3}, {(1, 2), (1, 3)} )
+    >>> s = gen_dot_desc(g)
+    >>> print(gen_dot_desc(({1}, set()), 'digraph'))
+    digraph g {
+      ordering=out;
+      node [shape=circle];
+      edge [penwidth=3];
+      1 [label="1", style=filled, fillcolor="white"];
+    }
+    <BLANKLINE>
+ 
+    """
+    return ''.join(_dot_lines(G, graphtype, attributes))
 
 def write_dot_desc(G, file_name, graphtype='graph', attributes={}):
     """
@@ -131,7 +157,64 @@ def write_dot_desc(G, file_name, graphtype='graph', attributes={}):
     # http://docs.python.org/3.2/tutorial/inputoutput.html
 
     with open(file_name, 'w') as f:
-        f.write( gen_dot_desc(G, graphtype, attributes) )
+        f.writelines( _dot_lines(G, graphtype, attributes) )
+
+def bbox_around(path, V_coord, margin=0):
+    """
+    Returns the (min lat, min lon, max lat, max lon) box around the
+    vertices of path, grown by margin on every side.
+
+    >>> bbox_around([1, 2], {1: (0, 5), 2: (3, 1)}, margin=1)
+    (-1, 0, 4, 6)
+    """
+    lats = [V_coord[v][0] for v in path]
+    lons = [V_coord[v][1] for v in path]
+    return (min(lats) - margin, min(lons) - margin,
+            max(lats) + margin, max(lons) + margin)
+
+def write_dot_stream(G, file_name, graphtype='digraph', attributes={},
+                     V_coord=None, bbox=None, path=None,
+                     path_color="red", positions=False):
+    """
+    Writes the dot description of G = (V, E) to file_name (or an open
+    file) while walking V and E once, so V and E can be generators over
+    a graph of any size and the extra memory used does not grow with it.
+
+    If bbox = (min lat, min lon, max lat, max lon) is given only the
+    vertices of V_coord inside it are drawn.  If path is given its
+    vertices and edges are drawn in path_color.  With positions=True
+    the vertices are pinned at their V_coord location.
+
+    >>> import io
+    >>> V_coord = {1: (0, 0), 2: (0, 10), 3: (50, 50)}
+    >>> out = io.StringIO()
+    >>> write_dot_stream(({1, 2, 3}, [(1, 2), (2, 3)]), out,
+    ...     V_coord=V_coord, bbox=(0, 0, 10, 10), path=[1, 2])
+    >>> print(out.getvalue())
+    digraph g {
+      ordering=out;
+      node [shape=circle];
+      edge [penwidth=3];
+      1 [label="1", style=filled, fillcolor="red"];
+      2 [label="2", style=filled, fillcolor="red"];
+      1 -> 2 [color="red" ];
+    }
+    <BLANKLINE>
+    """
+    keep = None
+    if bbox is not None:
+        (lat0, lon0, lat1, lon1) = bbox
+        def keep(v):
+            (lat, lon) = V_coord[v]
+            return lat0 <= lat <= lat1 and lon0 <= lon <= lon1
+
+    lines = _dot_lines(G, graphtype, attributes, keep, path, path_color,
+                       V_coord if positions else None)
+    if hasattr(file_name, 'write'):
+        file_name.writelines(lines)
+    else:
+        with open(file_name, 'w') as f:
+            f.writelines(lines)
 
 def pause(time=1,prompt="next?"):
     """
@@ -0,0 +1,131 @@
+"""
+Nearest facility queries.
+
+Dispatch asks "which of these depots is closest by road to this point".
+Running least_cost_path once per depot searches much the same part of
+the map over and over.  nearest runs one Dijkstra search out from the
+point instead and stops as soon as it has settled k of the depots: the
+first settled are the nearest.
+
+Road distance is not symmetric on one way streets.  By default the
+search follows edges forwards and finds the facilities nearest to get
+to from the point; with reverse=True it follows them backwards, through
+Digraph.adj_from, and finds the facilities it is quickest to get from
+to the point, as when sending a vehicle out.
+
+A Facilities is the set of targets, snapped onto the graph once and
+reused for every query.  Several facilities may snap to one vertex.
+
+>>> import digraph
+>>> V_coord = {1: (0, 0), 2: (0, 10), 3: (0, 20), 4: (0, 30)}
+>>> G = digraph.Digraph([(1, 2), (2, 3), (3, 4), (4, 3), (2, 1), (4, 1)])
+>>> def length(e):
+...     (a, b) = (V_coord[e[0]], V_coord[e[1]])
+...     return abs(a[1] - b[1])
+>>> depots = Facilities({"north": 4, "middle": 3})
+>>> nearest(G, 1, depots, length, k=2)
+[('middle', 3, 20), ('north', 4, 30)]
+>>> nearest(G, 1, depots, length, reverse=True, paths=True)
+[('north', 4, 30, [4, 1])]
+"""
+
+import heapq
+
+
+class Facilities:
+    """
+    A reusable set of facilities.  points maps each facility to the
+    vertex it is at or, given a spatial index (or V_coord, to search
+    for the nearest vertex with a throwaway one), to its (lat, lon):
+
+        vertex[f]   the vertex facility f is at
+        at[v]       the facilities at vertex v, in the order given
+
+    >>> Facilities({"a": (1, 1), "b": (0, 9)}, V_coord={1: (0, 0), 2: (0, 10)}).at
+    {1: ['a'], 2: ['b']}
+    """
+
+    def __init__(self, points, index=None, V_coord=None):
+        if index is None and V_coord is not None:
+            import spatial
+            index = spatial.GridIndex(V_coord)
+        names = list(points)
+        if index is None:
+            vertices = [points[f] for f in names]
+        else:
+            (vertices, distances) = index.snap_many([points[f][0] for f in names],
+                                                    [points[f][1] for f in names])
+        self.vertex = dict(zip(names, vertices))
+        self.at = {}
+        for f in names:
+            self.at.setdefault(self.vertex[f], []).append(f)
+
+    def __len__(self):
+        return len(self.vertex)
+
+
+def nearest(G, start, facilities, cost, k=1, reverse=False, paths=False,
+            budget=None):
+    """
+    Returns the k facilities of the Facilities facilities nearest to
+    vertex start in the Digraph G by the edge costs cost((u, v)), as a
+    list of (facility, vertex, cost), nearest first, or (facility,
+    vertex, cost, path) with paths=True.  With reverse=True costs and
+    paths run from the facility to start.  Facilities that cannot be
+    reached are left out, so fewer than k may come back.  Given a
+    dijkstra.Budget, the search stops when the budget runs out.
+    """
+    found = []
+    adj = G.adj_from if reverse else G.adj_to
+    try:
+        adj(start)
+    except KeyError:
+        # start is not in G
+        return found
+    if k < 1 or not facilities:
+        return found
+    at = facilities.at
+    dist = {}
+    parent = {}
+    best = {start: 0}
+    heap = [(0, start)]
+    if budget is not None:
+        budget.start()
+
+    while heap and len(found) < k:
+        (c, cur) = heapq.heappop(heap)
+        if cur in dist:
+            continue
+        if budget is not None and not budget.spend():
+            break
+        dist[cur] = c
+
+        for f in at.get(cur, ()):
+            if len(found) < k:
+                found.append((f, cur, c))
+
+        for n in adj(cur):
+            if n in dist:
+                continue
+            nc = c + cost((n, cur) if reverse else (cur, n))
+            if n not in best or nc < best[n]:
+                best[n] = nc
+                parent[n] = cur
+                heapq.heappush(heap, (nc, n))
+
+    if not paths:
+        return found
+    result = []
+    for (f, v, c) in found:
+        path = [v]
+        while path[-1] != start:
+            path.append(parent[path[-1]])
+        if not reverse:
+            path.reverse()
+        result.append((f, v, c, path))
+    return result
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
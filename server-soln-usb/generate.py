@@ -0,0 +1,310 @@
+"""
+    python3 generate.py [options] kind -o graph-file [-b binary-file]
+
+Synthetic road graphs for load testing, written straight to the text
+graph format read by readModule.read_graph and/or the binary format read
+by readModule.read_binary, without ever building a Digraph.
+
+Kinds:
+    uniform    --vertices N --edges M random edges between points
+               scattered over the Edmonton area
+    grid       --rows R --cols C grid of two-way avenues and streets
+    roads      like grid, but with jittered intersections, missing
+               blocks and some one-way streets, so it looks more like a
+               real road network
+    edmonton   --copies K copies of the graph in --graph, tiled side by
+               side and joined at their edges; its binary copy is read
+               when it is up to date, but only written with
+               --write-cache
+
+Each generator yields records in the same shape as the lines of a graph
+file: ('V', id, lat, lon) for every vertex first, then ('E', start, stop,
+name) for every edge.  lat and lon are in the scaled integer units of
+V_coord.
+
+>>> records = list(grid(2, 2, spacing=10, origin=(0, 0)))
+>>> records[:4]
+[('V', 1, 0, 0), ('V', 2, 0, 10), ('V', 3, 10, 0), ('V', 4, 10, 10)]
+>>> records[4:6]
+[('E', 1, 2, '1 Avenue'), ('E', 2, 1, '1 Avenue')]
+>>> len(records)
+12
+"""
+import argparse
+import math
+import random
+import sys
+import time
+from array import array
+
+import readModule
+
+# south west corner of the Edmonton map, in V_coord units
+EDMONTON = (5340000, -11370000)
+
+
+def uniform(n, m, seed=None, origin=EDMONTON, extent=(30000, 40000)):
+    """
+    n vertices scattered uniformly over a box extent = (height, width)
+    north east of origin, and m distinct random edges between them.
+
+    >>> records = list(uniform(10, 20, seed=1))
+    >>> sum(1 for r in records if r[0] == 'V'), sum(1 for r in records if r[0] == 'E')
+    (10, 20)
+    >>> list(uniform(2, 3))
+    Traceback (most recent call last):
+    ...
+    ValueError: For 2 vertices, you wanted 3 edges, but can only have a maximum of 2
+    """
+    max_num_edges = n * (n - 1)
+    if m > max_num_edges:
+        raise ValueError("For {} vertices, you wanted {} edges, but can only have a maximum of {}".format(n, m, max_num_edges))
+
+    rng = random.Random(seed)
+    for v in range(n):
+        yield ('V', v + 1, origin[0] + rng.randrange(extent[0]),
+               origin[1] + rng.randrange(extent[1]))
+
+    # same trick as digraph.random_graph: edges are numbered u * n + v,
+    # and remembered by number only
+    picked = set()
+    while len(picked) < m:
+        u = rng.randrange(n)
+        v = rng.randrange(n - 1)
+        if v >= u:
+            v += 1
+        e = u * n + v
+        if e not in picked:
+            picked.add(e)
+            yield ('E', u + 1, v + 1, "Random Road")
+
+
+def grid(rows, cols, spacing=100, origin=EDMONTON, jitter=0, drop=0.0,
+         oneway=0.0, seed=None):
+    """
+    A rows x cols grid of intersections spacing units apart.  Row r is
+    "<r+1> Avenue" and column c is "<c+1> Street".  Each intersection is
+    moved by up to jitter units, each block is left out with probability
+    drop and made one-way (in a random direction) with probability oneway.
+    """
+    rng = random.Random(seed)
+    for r in range(rows):
+        for c in range(cols):
+            lat = origin[0] + r * spacing
+            lon = origin[1] + c * spacing
+            if jitter:
+                lat += rng.randint(-jitter, jitter)
+                lon += rng.randint(-jitter, jitter)
+            yield ('V', r * cols + c + 1, lat, lon)
+
+    def block(u, v, name):
+        if drop and rng.random() < drop:
+            return
+        if oneway and rng.random() < oneway:
+            if rng.random() < 0.5:
+                (u, v) = (v, u)
+            yield ('E', u, v, name)
+        else:
+            yield ('E', u, v, name)
+            yield ('E', v, u, name)
+
+    for r in range(rows):
+        avenue = "{} Avenue".format(r + 1)
+        for c in range(cols - 1):
+            u = r * cols + c + 1
+            yield from block(u, u + 1, avenue)
+    for c in range(cols):
+        street = "{} Street".format(c + 1)
+        for r in range(rows - 1):
+            u = r * cols + c + 1
+            yield from block(u, u + cols, street)
+
+
+def roads(rows, cols, spacing=100, origin=EDMONTON, seed=None):
+    """
+    A road-like planar network: a grid with intersections moved by up to
+    a quarter block, one block in ten missing and one in ten one-way.
+    """
+    return grid(rows, cols, spacing, origin, jitter=spacing // 4,
+                drop=0.1, oneway=0.1, seed=seed)
+
+
+def copies(E, E_name, V, V_coord, k, links=8):
+    """
+    k copies of the graph (E, E_name, V, V_coord) laid out in a roughly
+    square block of tiles.  Copy t has every vertex id increased by
+    t * (max id + 1).  Neighbouring tiles are joined by two-way links
+    between up to links of the outermost vertices on facing sides.
+
+    >>> (E, E_name, V, V_coord) = readModule.read_graph("test.map")
+    >>> records = list(copies(E, E_name, V, V_coord, 2, links=1))
+    >>> [r for r in records if r[0] == 'V'][5]
+    ('V', 7, 0, 200001)
+    >>> [r for r in records if r[0] == 'E'][-2:]
+    [('E', 4, 8, 'Tile Link'), ('E', 8, 4, 'Tile Link')]
+    """
+    if not V_coord:
+        return
+    stride = max(V) + 1
+    across = math.ceil(k ** .5)
+
+    lats = [c[0] for c in V_coord.values()]
+    lons = [c[1] for c in V_coord.values()]
+    height = max(lats) - min(lats) + 1
+    width = max(lons) - min(lons) + 1
+
+    for t in range(k):
+        (row, col) = divmod(t, across)
+        for (v, (lat, lon)) in V_coord.items():
+            yield ('V', v + t * stride, lat + row * height, lon + col * width)
+
+    for t in range(k):
+        offset = t * stride
+        for e in E:
+            yield ('E', e[0] + offset, e[1] + offset, E_name.get(e, ""))
+
+    # the vertices nearest each side of a tile
+    by_lon = sorted(V_coord, key=lambda v: V_coord[v][1])
+    by_lat = sorted(V_coord, key=lambda v: V_coord[v][0])
+    (west, east) = (by_lon[:links], by_lon[::-1][:links])
+    (south, north) = (by_lat[:links], by_lat[::-1][:links])
+
+    for t in range(k):
+        (row, col) = divmod(t, across)
+        pairs = []
+        if col + 1 < across and t + 1 < k:
+            pairs.append((t + 1, east, west))
+        if t + across < k:
+            pairs.append((t + across, north, south))
+        for (other, here, there) in pairs:
+            for (u, v) in zip(here, there):
+                (u, v) = (u + t * stride, v + other * stride)
+                yield ('E', u, v, "Tile Link")
+                yield ('E', v, u, "Tile Link")
+
+
+def to_degrees(x):
+    """
+    Formats the scaled coordinate x as degrees, so that read_graph's
+    int(float(s) * 100000) gives x back exactly.  Half a unit is added
+    away from zero because that conversion truncates.
+
+    >>> to_degrees(5356380), to_degrees(-11350856), to_degrees(0)
+    ('53.563805', '-113.508565', '0.000005')
+    >>> int(float(to_degrees(28999)) * 100000)
+    28999
+    """
+    if x >= 0:
+        return "{:.6f}".format((x + 0.5) / 100000)
+    return "{:.6f}".format((x - 0.5) / 100000)
+
+
+def write_text(file_name, records):
+    """
+    Writes records to file_name in the text graph format, one line at a
+    time.  Returns (vertex count, edge count).
+    """
+    nv = ne = 0
+    with open(file_name, 'w') as f:
+        write = f.write
+        for r in records:
+            if r[0] == 'V':
+                write("V,{},{},{}\n".format(r[1], to_degrees(r[2]), to_degrees(r[3])))
+                nv += 1
+            else:
+                write("E,{},{},{}\n".format(r[1], r[2], r[3]))
+                ne += 1
+    return (nv, ne)
+
+
+def write_binary(file_name, records):
+    """
+    Writes records to file_name in the binary graph format.  The columns
+    are gathered into arrays first, which costs 16 bytes per vertex and
+    12 per edge.  Returns (vertex count, edge count).
+    """
+    ids = array('q')
+    lats = array('i')
+    lons = array('i')
+    starts = array('I')
+    stops = array('I')
+    name_ids = array('I')
+    names = []
+    name_id = {}
+    position = {}
+
+    for r in records:
+        if r[0] == 'V':
+            position[r[1]] = len(ids)
+            ids.append(r[1])
+            lats.append(r[2])
+            lons.append(r[3])
+        else:
+            name = r[3]
+            if name not in name_id:
+                name_id[name] = len(names)
+                names.append(name)
+            starts.append(position[r[1]])
+            stops.append(position[r[2]])
+            name_ids.append(name_id[name])
+
+    readModule.write_binary_arrays(file_name, ids, lats, lons, names,
+                                   starts, stops, name_ids)
+    return (len(ids), len(starts))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Generate synthetic road graphs.')
+    parser.add_argument('kind', choices=['uniform', 'grid', 'roads', 'edmonton'])
+    parser.add_argument('-o', '--output', dest='output', default=None,
+                        help='text graph file to write')
+    parser.add_argument('-b', '--binary', dest='binary', default=None,
+                        help='binary graph file to write')
+    parser.add_argument('--vertices', type=int, default=1000000)
+    parser.add_argument('--edges', type=int, default=2500000)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--cols', type=int, default=1000)
+    parser.add_argument('--spacing', type=int, default=100)
+    parser.add_argument('--copies', type=int, default=16)
+    parser.add_argument('-g', '--graph', dest='graphname',
+                        default='edmonton-roads-2.0.1.txt',
+                        help='map to copy (DEFAULT = "edmonton-roads-2.0.1.txt")')
+    parser.add_argument('--write-cache', dest='write_cache', action='store_true',
+                        help='write the binary copy of --graph next to it '
+                             'if it is missing or out of date')
+    parser.add_argument('--seed', type=int, default=296,
+                        help='random seed (DEFAULT = 296)')
+    args = parser.parse_args(argv)
+    if not (args.output or args.binary):
+        parser.error("give at least one of -o and -b")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.kind == 'uniform':
+        make = lambda: uniform(args.vertices, args.edges, args.seed)
+    elif args.kind == 'grid':
+        make = lambda: grid(args.rows, args.cols, args.spacing, seed=args.seed)
+    elif args.kind == 'roads':
+        make = lambda: roads(args.rows, args.cols, args.spacing, seed=args.seed)
+    else:
+        graph = readModule.load_graph(args.graphname, write=args.write_cache)
+        make = lambda: copies(*graph, k=args.copies)
+
+    t = time.perf_counter()
+    # the generators are seeded, so each file gets its own pass over the
+    # same records rather than buffering them all
+    if args.output:
+        counts = write_text(args.output, make())
+    if args.binary:
+        counts = write_binary(args.binary, make())
+    print("wrote {} vertices and {} edges in {:.1f}s".format(
+        counts[0], counts[1], time.perf_counter() - t), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,446 @@
+"""
+    python3 loadgen.py [-g graph-file] [--requests FILE] [--count N]
+                       [--concurrency C] [--rate R] [--baud B] [--pty]
+                       [--write-cache]
+
+Load generator for server.py, for when there is no Arduino on the other
+end of the serial line.
+
+Requests are the "lat lon lat lon" lines the client sends.  They are
+replayed from a file given with --requests (any line of exactly four
+integers counts, so tests/test-path.txt works as is, as does a stream
+saved earlier with --save) or made up at random around the vertices of
+the graph.  Each answer is checked against the format of
+tests/server-path-*-output.txt: a line with the number of waypoints N,
+then N lines of "lat lon" integers.  A server with a search budget may
+also answer "N partial" or "0 budget" (see postprocess.header); those
+are counted as well.
+
+There are two ways to reach the server:
+
+    socket   (default) server.serve runs in this process, once per
+             client, on one end of a socket pair standing in for
+             serial.Serial.  All the clients share one Map, just like
+             the threads of serve_pipelined do.
+    pty      server.py is started as a separate process with -s pointing
+             at a pseudo terminal, exactly as it would be at an Arduino.
+             There is only one serial line, so only one client.
+
+Each client sends a request, waits for the whole answer and, when --rate
+is given, waits out the rest of its share of the rate before the next.
+--baud slows the server's writes down to what a serial line at that
+speed could carry (10 bits per byte).
+
+At the end it prints the throughput and the latency percentiles, from
+sending a request to reading the last line of its answer.
+
+The binary copy of the graph is read when it is up to date but only
+written with --write-cache.  In pty mode server.py loads the graph
+itself, as it always does.
+"""
+import argparse
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import readModule
+
+
+def parse_request(line):
+    """
+    Returns the four integers of a "lat lon lat lon" request line, or
+    None if line is not one.
+
+    >>> parse_request("5356386 -11350854 5351786 -11349738 ")
+    (5356386, -11350854, 5351786, -11349738)
+    >>> print(parse_request("104 St and 82 Ave. 53.517859,-113.497381"))
+    None
+    """
+    fields = line.split()
+    if len(fields) != 4:
+        return None
+    try:
+        return tuple(int(f) for f in fields)
+    except ValueError:
+        return None
+
+
+def read_requests(file_name):
+    """
+    Returns the list of requests in file_name, skipping every line that
+    is not a request.
+    """
+    requests = []
+    with open(file_name) as f:
+        for line in f:
+            request = parse_request(line)
+            if request is not None:
+                requests.append(request)
+    return requests
+
+
+def random_requests(V_coord, count, rng, noise=50):
+    """
+    Returns count requests between random vertices of V_coord, each end
+    moved up to noise units off its vertex.
+
+    >>> rng = random.Random(1)
+    >>> [len(r) for r in random_requests({1: (0, 0), 2: (100, 100)}, 3, rng)]
+    [4, 4, 4]
+    """
+    coords = list(V_coord.values())
+    requests = []
+    for i in range(count):
+        (a, b) = (rng.choice(coords), rng.choice(coords))
+        requests.append(tuple(x + rng.randint(-noise, noise)
+                              for x in (a[0], a[1], b[0], b[1])))
+    return requests
+
+
+def check_answer(lines):
+    """
+    Checks an answer, given as its list of lines without newlines,
+    against the expected output format.  Returns the list of (lat, lon)
+    waypoints, or raises ValueError saying what is wrong.
+
+    >>> check_answer(["2", "5356380 -11350856", "5356375 -11350848"])
+    [(5356380, -11350856), (5356375, -11350848)]
+    >>> check_answer(["0"])
+    []
+    >>> check_answer(["0 budget"]), check_answer(["1 partial", "0 0"])
+    ([], [(0, 0)])
+    >>> check_answer(["2", "5356380 -11350856"])
+    Traceback (most recent call last):
+    ...
+    ValueError: expected 2 waypoints, got 1
+    """
+    if not lines:
+        raise ValueError("empty answer")
+    n = answer_size(lines[0])
+    if n is None:
+        raise ValueError("bad waypoint count {!r}".format(lines[0]))
+    if len(lines) - 1 != n:
+        raise ValueError("expected {} waypoints, got {}".format(n, len(lines) - 1))
+    path = []
+    for line in lines[1:]:
+        fields = line.split(' ')
+        try:
+            (lat, lon) = (int(f) for f in fields)
+        except ValueError:
+            raise ValueError("bad waypoint {!r}".format(line))
+        path.append((lat, lon))
+    return path
+
+
+def answer_size(header):
+    """
+    Returns the number of waypoints the first line of an answer says
+    follow, or None if it is not a first line.
+
+    >>> answer_size("3"), answer_size("3 partial"), answer_size("0 budget")
+    (3, 3, 0)
+    >>> print(answer_size("3 budget"))
+    None
+    """
+    fields = header.split(' ')
+    try:
+        n = int(fields[0])
+    except ValueError:
+        return None
+    if n < 0 or len(fields) > 2:
+        return None
+    if len(fields) == 2 and fields[1] != ("partial" if n else "budget"):
+        return None
+    return n
+
+
+def read_answer(readline):
+    """
+    Reads one answer with readline, which returns bytes lines as
+    serial.Serial.readline does.  Returns its list of lines, or raises
+    EOFError if the stream ends first.
+    """
+    lines = []
+    n = None
+    while n is None or len(lines) <= n:
+        raw = readline()
+        if not raw:
+            raise EOFError("server closed the connection")
+        line = raw.decode('ascii').rstrip("\r\n")
+        lines.append(line)
+        if n is None:
+            n = answer_size(line)
+            if n is None:
+                # let check_answer say what is wrong
+                return lines
+    return lines
+
+
+def percentile(values, p):
+    """
+    Returns the p-th percentile of the sorted list values, by nearest
+    rank.
+
+    >>> percentile(list(range(1, 101)), 99), percentile([3, 5], 50)
+    (99, 3)
+    """
+    if not values:
+        return 0.0
+    k = max(0, -(-len(values) * p // 100) - 1)
+    return values[int(k)]
+
+
+class FakeSerial:
+    """
+    Stands in for serial.Serial on one end of a connected socket: the
+    server reads lines with readline and answers with write.  Given a
+    baud rate, write takes as long as the bytes would take to go out
+    over a serial line at that speed.
+    """
+
+    def __init__(self, sock, baud=None):
+        self.sock = sock
+        self.file = sock.makefile('rb')
+        self.baud = baud
+
+    def readline(self):
+        try:
+            return self.file.readline()
+        except OSError:
+            return b''
+
+    def write(self, data):
+        if self.baud:
+            time.sleep(len(data) * 10 / self.baud)
+        self.sock.sendall(data)
+        return len(data)
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+class Stats:
+    """
+    Latencies and failures collected by all the clients.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.errors = []
+        self.waypoints = 0
+        # answers "N partial" or "0 budget"
+        self.cut_short = 0
+
+    def add(self, latency, waypoints, complete=True):
+        with self.lock:
+            self.latencies.append(latency)
+            self.waypoints += waypoints
+            if not complete:
+                self.cut_short += 1
+
+    def fail(self, request, error):
+        with self.lock:
+            self.errors.append((request, error))
+
+    def report(self, seconds, out=sys.stdout):
+        latencies = sorted(self.latencies)
+        done = len(latencies)
+        print("{} requests answered, {} failed, {} waypoints in {:.3f}s".format(
+            done, len(self.errors), self.waypoints, seconds), file=out)
+        if self.cut_short:
+            print("{} cut short by the search budget".format(self.cut_short),
+                  file=out)
+        print("throughput {:.1f} requests/s".format(
+            done / seconds if seconds else 0.0), file=out)
+        print("latency ms  p50 {:.2f}  p90 {:.2f}  p99 {:.2f}  max {:.2f}".format(
+            *(1000 * percentile(latencies, p) for p in (50, 90, 99, 100))),
+            file=out)
+        for (request, error) in self.errors[:10]:
+            print("failed {}: {}".format(' '.join(map(str, request)), error),
+                  file=out)
+
+
+def run_client(requests, readline, write, stats, interval=0.0):
+    """
+    Sends each request with write, reads and checks its answer with
+    readline and records the outcome in stats.  Starts a request at
+    most every interval seconds.  Stops at the first request that gets
+    no answer.
+    """
+    due = time.perf_counter()
+    for request in requests:
+        now = time.perf_counter()
+        if now < due:
+            time.sleep(due - now)
+        due = max(now, due) + interval
+
+        t = time.perf_counter()
+        write(bytes(' '.join(map(str, request)) + "\n", encoding='ascii'))
+        try:
+            lines = read_answer(readline)
+        except (EOFError, OSError) as e:
+            stats.fail(request, e)
+            return
+        latency = time.perf_counter() - t
+        try:
+            path = check_answer(lines)
+        except ValueError as e:
+            stats.fail(request, e)
+            continue
+        stats.add(latency, len(path), ' ' not in lines[0])
+
+
+def run_sockets(roadmap, requests, args, stats):
+    """
+    Runs args.concurrency clients, each against its own server.serve
+    thread over a socket pair, sharing roadmap.  Returns the seconds
+    the clients took.
+    """
+    import server
+
+    shares = [requests[k::args.concurrency] for k in range(args.concurrency)]
+    interval = args.concurrency / args.rate if args.rate else 0.0
+    servers = []
+    clients = []
+    for share in shares:
+        (here, there) = socket.socketpair()
+        here.settimeout(args.timeout)
+        port = FakeSerial(there, args.baud)
+        servers.append(threading.Thread(target=server.serve,
+                                        args=(roadmap, port, port), daemon=True))
+        client = here.makefile('rb')
+        clients.append((here, threading.Thread(
+            target=run_client,
+            args=(share, client.readline, here.sendall, stats, interval))))
+    for t in servers:
+        t.start()
+    start = time.perf_counter()
+    for (sock, t) in clients:
+        t.start()
+    for (sock, t) in clients:
+        t.join()
+    seconds = time.perf_counter() - start
+    for (sock, t) in clients:
+        # closing our end ends the server's serve loop
+        sock.shutdown(socket.SHUT_RDWR)
+        sock.close()
+    for t in servers:
+        t.join(args.timeout)
+    return seconds
+
+
+def run_pty(requests, args, stats):
+    """
+    Starts server.py on a pseudo terminal and runs one client against it.
+    Returns the seconds the client took, not counting server startup.
+    """
+    import tty
+
+    (master, slave) = os.openpty()
+    tty.setraw(slave)
+    command = [sys.executable, os.path.join(os.path.dirname(__file__) or '.',
+                                            'server.py'),
+               '-g', args.graphname, '-s', os.ttyname(slave)]
+    if args.pipeline:
+        command.append('-p')
+    proc = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    try:
+        time.sleep(args.startup)
+        port = os.fdopen(master, 'r+b', buffering=0)
+        reader = port.readline
+
+        def write(data):
+            if args.baud:
+                time.sleep(len(data) * 10 / args.baud)
+            port.write(data)
+
+        interval = 1 / args.rate if args.rate else 0.0
+        start = time.perf_counter()
+        run_client(requests, reader, write, stats, interval)
+        return time.perf_counter() - start
+    finally:
+        proc.terminate()
+        proc.wait()
+        os.close(slave)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Load generator for server.py.')
+    parser.add_argument('-g', '--graph', dest='graphname', default='test.map',
+                        help='path to graph (DEFAULT = test.map)')
+    parser.add_argument('--requests', default=None,
+                        help='file of "lat lon lat lon" lines to replay '
+                             '(DEFAULT = random requests)')
+    parser.add_argument('--save', default=None,
+                        help='write the requests sent to this file, for replay')
+    parser.add_argument('--count', type=int, default=1000,
+                        help='random requests to send (DEFAULT = 1000)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='times to send the whole request stream (DEFAULT = 1)')
+    parser.add_argument('-c', '--concurrency', type=int, default=4,
+                        help='clients sending at once, socket mode only (DEFAULT = 4)')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='requests per second over all clients (DEFAULT = as fast as possible)')
+    parser.add_argument('--baud', type=int, default=None,
+                        help='throttle writes to this serial line speed (DEFAULT = no limit)')
+    parser.add_argument('--pty', action='store_true',
+                        help='run server.py as a process on a pseudo terminal')
+    parser.add_argument('--write-cache', dest='write_cache', action='store_true',
+                        help='write the binary copy of the graph next to it '
+                             'if it is missing or out of date')
+    parser.add_argument('-p', '--pipeline', action='store_true',
+                        help='pass -p to server.py in pty mode')
+    parser.add_argument('--startup', type=float, default=2.0,
+                        help='seconds to let server.py start in pty mode (DEFAULT = 2)')
+    parser.add_argument('--timeout', type=float, default=30.0,
+                        help='seconds to wait for an answer (DEFAULT = 30)')
+    parser.add_argument('--seed', type=int, default=296,
+                        help='random seed (DEFAULT = 296)')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.concurrency < 1:
+        print("--concurrency must be at least 1", file=sys.stderr)
+        return 1
+
+    roadmap = None
+    if args.pty:
+        (E, E_name, V, V_coord) = readModule.load_graph(args.graphname,
+                                                        write=args.write_cache)
+    else:
+        from map import Map
+        roadmap = Map(args.graphname, write_cache=args.write_cache)
+        V_coord = roadmap.V_coord
+
+    if args.requests:
+        requests = read_requests(args.requests)
+    else:
+        requests = random_requests(V_coord, args.count, random.Random(args.seed))
+    requests = requests * args.repeat
+    if not requests:
+        print("No requests to send", file=sys.stderr)
+        return 1
+    if args.save:
+        with open(args.save, 'w') as f:
+            for request in requests:
+                f.write(' '.join(map(str, request)) + "\n")
+
+    stats = Stats()
+    if args.pty:
+        seconds = run_pty(requests, args, stats)
+    else:
+        seconds = run_sockets(roadmap, requests, args, stats)
+    stats.report(seconds)
+    return 1 if stats.errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
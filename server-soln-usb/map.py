@@ -1,24 +1,612 @@
 """
 map.py
 
+Map is the entry point for routing on a road graph file.  The graph is
+loaded once (from the binary copy next to the text file when there is an
+up to date one, see readModule.load_graph, which is written for next
+time unless write_cache is False) and the indexes built on top
+of it, and the modules behind them, are only loaded the first time they
+are needed:
+
+    index        spatial.GridIndex used to snap coordinates onto vertices
+    components   weakly connected component of each vertex, used to turn
+                 down requests between parts of the map that do not
+                 touch without searching
+    compact      compact.CompactGraph copy of G, numbered along a Hilbert
+                 curve (see ordering.py) so nearby vertices sit nearby
+    turn_costs   turns.TurnCosts for turn aware routing
+    names        directions.StreetNames, the interned street name table,
+                 with a name number per edge of compact
+    profiles     timedep.Profiles, the speed profiles read from the
+                 profiles file, for routes that depend on departure time
+
+Given a region.Region, only the part of the map inside it is loaded.
+Routes can also be had as a pyramid.Pyramid, for sending an overview
+first and detail on demand.
+
+Coordinates are in the scaled integer units of V_coord, the same as the
+client sends over the serial port.  Snapped vertices and found paths are
+memoized, so asking for the same route twice only searches once.  Given
+a routestore.RouteStore, found paths are also kept on disk and shared
+with other processes and later runs.
+
+Each search can be held to a budget of settled vertices (max_settled)
+and wall time (max_seconds), so that one query that has to explore the
+whole map cannot hold up every other client.  A search that runs out of
+budget gives no route, or with partial=True the path as far as the
+settled vertex nearest the destination; either way the Route says it is
+not complete, and nothing cut short by a budget is memoized or stored.
+
+Requests are snapped onto vertices before anything else, and a search
+for a (start, dest) pair that another thread is already searching is
+not started again: the thread waits for that search and shares its
+result, so a burst of identical requests (a fleet setting off from one
+depot) costs one search.  coalesced counts the requests served so.
+This only helps when several threads share the Map: server.py routes
+the requests of its serial port in one thread, serve_pipelined too, so
+a server gains nothing from it, while the clients of loadgen.py's
+socket mode, which share one Map, do.
 """
 
+import threading
+from collections import OrderedDict
+
+import digraph
+import dijkstra
+import postprocess
+import readModule
+import spatial
+
+# marks a route that is in neither the memory cache nor the store
+_MISSING = object()
+
+class _Flight:
+    """
+    One search in progress, for the threads waiting on its result.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
 class Map:
     """
     The constructor class
-    >>> m = Map("test.map")
-    >>> p = m.get_path( (0.0,0.0), (0.0,0.0) )
-    >>> str(p)
-    '[(0.0,0.0)]'
+
+    >>> m = Map("test.map", cache=False)
+    >>> m.get_path( (0, 0), (0, 0) )
+    [(0, 0)]
+    >>> m.get_path( (-99000, -101000), (100000, 100000) )
+    [(-100000, -100000), (-100000, 100000), (100000, 100000)]
+    >>> m.where_am_i( (90000, 95000) )
+    4
+    >>> m.get_vertex_path(4, 3)
+    [4, 5, 2, 3]
+
+    With a route store, a fresh Map finds routes found by an earlier one
+
+    >>> import routestore
+    >>> store = routestore.RouteStore(":memory:")
+    >>> Map("test.map", cache=False, store=store).get_vertex_path(4, 3)
+    [4, 5, 2, 3]
+    >>> m = Map("test.map", cache=False, store=store)
+    >>> m.warm(10)
+    1
+    >>> m.get_vertex_path(4, 3)
+    [4, 5, 2, 3]
+
+    A budget too small for the route gives no route, or part of it
+
+    >>> Map("test.map", cache=False, max_settled=2).get_vertex_path(4, 3)
+    >>> m = Map("test.map", cache=False, max_settled=3, partial=True)
+    >>> m.get_vertex_path(4, 3)
+    [4, 5, 1]
+    >>> m.get_route( (90000, 95000), (-100000, 100000) ).complete
+    False
+
+    Threads asking for the same route at once share one search.  Here
+    the search is held up until the other three threads are waiting
+    for it, and all four get the same path, each a copy of its own
+
+    >>> import time
+    >>> m = Map("test.map", cache=False)
+    >>> go = threading.Event()
+    >>> def held_cost(e, cost=m.cost):
+    ...     go.wait()
+    ...     return cost(e)
+    >>> m.cost = held_cost
+    >>> paths = []
+    >>> threads = [threading.Thread(target=lambda: paths.append(m.get_vertex_path(4, 3)))
+    ...            for i in range(4)]
+    >>> for t in threads:
+    ...     t.start()
+    >>> while m.coalesced < 3:
+    ...     time.sleep(0.01)
+    >>> go.set()
+    >>> for t in threads:
+    ...     t.join()
+    >>> (paths[0], m.coalesced, all(p == paths[0] for p in paths))
+    ([4, 5, 2, 3], 3, True)
+    >>> len({id(p) for p in paths})
+    4
     """
-    def __init__(self, file):
-        pass
+    # names the cost function in the route store
+    cost_model = "distance"
+
+    def __init__(self, file, cache=True, path_cache_size=1024, store=None,
+                 region=None, max_settled=None, max_seconds=None,
+                 partial=False, profiles=None, write_cache=True):
+        self.file = file
+        self.profiles_file = profiles
+        self.region = region
+        self.max_settled = max_settled
+        self.max_seconds = max_seconds
+        self.partial = partial
+        if cache:
+            graph = readModule.load_graph(file, region=region,
+                                          write=write_cache)
+        else:
+            graph = readModule.read_graph(file, region)
+        (self.E, self.E_name, self.V, self.V_coord) = graph
+
+        self.G = digraph.Digraph(self.E)
+        for v in self.V:
+            self.G.add_vertex(v)
+
+        self._index = None
+        self._components = None
+        self._compact = None
+        self._turn_costs = None
+        self._names = None
+        self._profiles = None
+        self._snapped = OrderedDict()
+        self._paths = OrderedDict()
+        self._pyramids = OrderedDict()
+        self.path_cache_size = path_cache_size
+        self._graph_hash = None
+        self.store = store
+        # searches in progress by (start, dest), and how many requests
+        # waited for one of them instead of searching again
+        self._flights = {}
+        self.coalesced = 0
+        # guards the memo caches, so one Map can serve several threads
+        self._lock = threading.Lock()
+
+    def cost(self, e):
+        """
+        Straight-line length of the edge e, the same cost as
+        server.cost_distance.
+        """
+        (a, b) = (self.V_coord[e[0]], self.V_coord[e[1]])
+        return ((a[0] - b[0])**2 + (a[1] - b[1])**2)**.5
+
+    @property
+    def graph_hash(self):
+        """
+        Hash of the graph file, used to key routes in the route store.
+        """
+        if self._graph_hash is None:
+            import routestore
+            try:
+                self._graph_hash = routestore.file_hash(self.file)
+            except OSError:
+                self._graph_hash = routestore.file_hash(self.file + ".bin")
+            if self.region is not None:
+                # routes on part of the map are not routes on all of it
+                r = self.region
+                self._graph_hash += " {} {} {}".format(r.box, r.polygon, r.margin)
+        return self._graph_hash
+
+    def warm(self, limit):
+        """
+        Loads the limit most requested routes from the route store into
+        memory.  Returns how many were loaded.
+        """
+        if self.store is None:
+            return 0
+        routes = self.store.warm(self.graph_hash, self.cost_model,
+                                 min(limit, self.path_cache_size))
+        # least requested first, so the most requested are evicted last
+        with self._lock:
+            for (key, path) in reversed(list(routes.items())):
+                self._paths[key] = path
+        return len(routes)
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = spatial.GridIndex(self.V_coord)
+        return self._index
+
+    @property
+    def components(self):
+        if self._components is None:
+            G = self.G
+            label = {}
+            for v in self.V_coord:
+                if v in label:
+                    continue
+                label[v] = v
+                todo = [v]
+                while todo:
+                    cur = todo.pop()
+                    for n in G.adj_to(cur) | G.adj_from(cur):
+                        if n not in label:
+                            label[n] = v
+                            todo.append(n)
+            self._components = label
+        return self._components
+
+    @property
+    def compact(self):
+        if self._compact is None:
+            import compact
+            import ordering
+            order = ordering.Renumbering(self.V_coord, V=self.V).ids
+            self._compact = compact.CompactGraph.from_edges(self.V, self.E,
+                                                            order=order)
+        return self._compact
+
+    @property
+    def turn_costs(self):
+        if self._turn_costs is None:
+            import turns
+            self._turn_costs = turns.TurnCosts(self.compact, self.V_coord,
+                                               self.E_name)
+        return self._turn_costs
+
+    @property
+    def names(self):
+        if self._names is None:
+            import directions
+            self._names = directions.StreetNames(self.E_name, self.compact)
+        return self._names
+
+    @property
+    def profiles(self):
+        """
+        The timedep.Profiles read from the profiles file, or with every
+        edge at the free flow speed if the Map was not given one.
+        """
+        if self._profiles is None:
+            import timedep
+            if self.profiles_file is None:
+                self._profiles = timedep.Profiles(self.compact, self.V_coord)
+            else:
+                self._profiles = timedep.read_profiles(self.profiles_file,
+                                                       self.compact,
+                                                       self.V_coord)
+        return self._profiles
 
-    def get_path(self, start_coord, stop_coord):
-        return []
-    
     def where_am_i(self, coord):
-        pass
+        """
+        Returns the vertex nearest to coord = (lat, lon).  The most
+        recently snapped coordinates are remembered, as paths are.
+
+        >>> m = Map("test.map", cache=False, path_cache_size=2)
+        >>> [m.where_am_i(c) for c in [(0, 0), (90000, 95000), (0, 0), (1, 1)]]
+        [1, 4, 1, 1]
+        >>> list(m._snapped)
+        [(0, 0), (1, 1)]
+        """
+        with self._lock:
+            v = self._snapped.get(coord)
+            if v is not None:
+                self._snapped.move_to_end(coord)
+                return v
+        v = self.index.nearest(coord[0], coord[1])[0]
+        with self._lock:
+            self._snapped[coord] = v
+            if len(self._snapped) > self.path_cache_size:
+                self._snapped.popitem(last=False)
+        return v
+
+    def budget(self):
+        """
+        Returns a fresh dijkstra.Budget for one search, or None if the
+        searches of this Map are not limited.
+        """
+        if self.max_settled is None and self.max_seconds is None:
+            return None
+        return dijkstra.Budget(self.max_settled, self.max_seconds)
+
+    def get_vertex_path(self, start, dest):
+        """
+        Returns the least cost path from vertex start to vertex dest as a
+        list of vertices, or None if dest cannot be reached.  If the
+        search runs out of budget, returns None, or the partial path
+        when partial is set.
+        """
+        return self._find(start, dest).vertices or None
+
+    def _nearest_reached(self, dest, reached):
+        # the vertex of reached nearest dest in a straight line
+        (lat, lon) = self.V_coord[dest]
+        V_coord = self.V_coord
+        return min(reached, key=lambda v: (V_coord[v][0] - lat) ** 2
+                                       + (V_coord[v][1] - lon) ** 2)
+
+    def _finish_path(self, path):
+        # the Route along a path from the caches, which keep no costs;
+        # postprocess works out straight line lengths itself, faster
+        # than calling self.cost on every edge
+        cost = None if self.cost_model == "distance" else self.cost
+        return postprocess.finish_path(path, self.V_coord, cost)
+
+    def _find(self, start, dest):
+        # returns the postprocess.Route from start to dest, with
+        # complete False if a budget ran out before dest was settled
+        key = (start, dest)
+        if self.store is not None:
+            # every request counts towards warm, however it is answered
+            self.store.hit(self.graph_hash, self.cost_model, start, dest)
+        with self._lock:
+            path = self._paths.get(key, _MISSING)
+            if path is not _MISSING:
+                self._paths.move_to_end(key)
+                hit = True
+            else:
+                hit = False
+                flight = self._flights.get(key)
+                if flight is None:
+                    flight = self._flights[key] = _Flight()
+                    leader = True
+                else:
+                    self.coalesced += 1
+                    leader = False
+
+        if hit:
+            return self._finish_path(path)
+        if not leader:
+            # a Route of its own, as a cache hit gets
+            return flight.wait().copy()
+        try:
+            flight.result = self._search(start, dest)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+        return flight.result
+
+    def _search(self, start, dest):
+        # the work behind _find, done by one thread per (start, dest); a
+        # fresh search is finished straight from its parent map
+        path = _MISSING
+        if self.store is not None:
+            path = self.store.get(self.graph_hash, self.cost_model,
+                                  start, dest, _MISSING)
+        if path is not _MISSING:
+            route = self._finish_path(path)
+        else:
+            route = None
+            components = self.components
+            if components.get(start) == components.get(dest):
+                budget = self.budget()
+                (dist, parent) = dijkstra.bounded_search(self.G, start,
+                                                         self.cost,
+                                                         targets={dest},
+                                                         budget=budget)
+                if dest not in dist and budget is not None and budget.exhausted:
+                    if self.partial and dist:
+                        route = postprocess.finish(
+                            parent, start, self._nearest_reached(dest, dist),
+                            self.V_coord, dist=dist)
+                    else:
+                        route = postprocess.Route()
+                    route.complete = False
+                    return route
+                route = postprocess.finish(parent, start, dest, self.V_coord,
+                                           dist=dist)
+            if route is None:
+                route = postprocess.Route()
+            path = route.vertices or None
+            if self.store is not None:
+                self.store.put(self.graph_hash, self.cost_model,
+                               start, dest, path)
+
+        with self._lock:
+            self._paths[(start, dest)] = path
+            if len(self._paths) > self.path_cache_size:
+                self._paths.popitem(last=False)
+        return route
+
+    def get_route(self, start_coord, stop_coord):
+        """
+        Returns the route between the vertices nearest to start_coord and
+        stop_coord as a postprocess.Route, with its waypoints, running
+        costs and distances and the lines to send, all worked out in one
+        pass.  There being no route gives the empty Route.  A route
+        cut short by the search budget has complete set to False.
+
+        A fresh search is finished by postprocess.finish straight from
+        its parent map, with the costs the search found; a route from
+        the caches or the store goes through finish_path.
+
+        >>> m = Map("test.map", cache=False)
+        >>> r = m.get_route( (-99000, -101000), (100000, 100000) )
+        >>> (len(r), r.total_cost())
+        (3, 400000.0)
+        >>> again = m.get_route( (-99000, -101000), (100000, 100000) )
+        >>> (again.vertices, again.total_cost())
+        ([2, 3, 4], 400000.0)
+        """
+        return self._find(self.where_am_i(start_coord),
+                          self.where_am_i(stop_coord))
+
+    def get_path(self, start_coord, stop_coord):
+        """
+        Returns the route between the vertices nearest to start_coord and
+        stop_coord as a list of (lat, lon) waypoints, or [] if there is
+        no route.
+        """
+        return self.get_route(start_coord, stop_coord).coords
+
+    def get_pyramid(self, start_coord, stop_coord):
+        """
+        Returns the route between start_coord and stop_coord as a
+        pyramid.Pyramid, to hand out at several levels of detail.  The
+        most recently used pyramids are kept, so asking for more detail
+        on the same route does not work them out again.
+
+        >>> m = Map("test.map", cache=False)
+        >>> p = m.get_pyramid( (-100000, -100000), (100000, 100000) )
+        >>> p.overview(2)
+        [(0, (-100000, -100000)), (2, (100000, 100000))]
+        >>> m.get_pyramid( (-99000, -101000), (100000, 100000) ) is p
+        True
+        """
+        key = (self.where_am_i(start_coord), self.where_am_i(stop_coord))
+        with self._lock:
+            p = self._pyramids.get(key)
+            if p is not None:
+                self._pyramids.move_to_end(key)
+                return p
+
+        import pyramid
+        route = self.get_route(start_coord, stop_coord)
+        p = pyramid.Pyramid(route.coords, route.complete)
+        if not route.complete:
+            return p
+        with self._lock:
+            self._pyramids[key] = p
+            if len(self._pyramids) > self.path_cache_size:
+                self._pyramids.popitem(last=False)
+        return p
+
+    def get_td_route(self, start_coord, stop_coord, departure):
+        """
+        Returns the quickest route between the vertices nearest to
+        start_coord and stop_coord leaving at second departure after
+        midnight, under the speed profiles, as a postprocess.Route whose
+        costs are the seconds after departure each waypoint is reached
+        at.  Routes depending on the time are neither memoized nor
+        stored.  A search that runs out of budget gives the empty Route,
+        or with partial set the route to the reached vertex nearest the
+        destination, with complete False either way, as get_route.
+
+        >>> m = Map("test.map", cache=False)
+        >>> r = m.get_td_route( (-99000, -101000), (100000, 100000), 8 * 3600 )
+        >>> (len(r), round(r.total_cost()))
+        (3, 25556)
+        >>> m = Map("test.map", cache=False, max_settled=2, partial=True)
+        >>> r = m.get_td_route( (90000, 95000), (-100000, 100000), 8 * 3600 )
+        >>> (r.vertices, r.complete)
+        ([4, 5, 1], False)
+        """
+        import timedep
+        profiles = self.profiles
+        C = self.compact
+        (start, dest) = (self.where_am_i(start_coord),
+                         self.where_am_i(stop_coord))
+        budget = self.budget()
+        (arrival, parent) = timedep.earliest_arrival(C, profiles, start, dest,
+                                                     departure, self.V_coord,
+                                                     budget)
+        complete = budget is None or not budget.exhausted
+        ids = C.ids
+        route = None
+        if complete:
+            route = postprocess.finish(parent, C.index[start], C.index[dest],
+                                       self.V_coord, dist=arrival, ids=ids)
+        elif self.partial:
+            reached = [ids[i] for i in range(len(arrival))
+                       if arrival[i] != float("inf")]
+            if reached:
+                nearest = self._nearest_reached(dest, reached)
+                route = postprocess.finish(parent, C.index[start],
+                                           C.index[nearest], self.V_coord,
+                                           dist=arrival, ids=ids)
+        if route is None:
+            route = postprocess.Route()
+        route.complete = complete
+        return route
+
+    def facilities(self, points):
+        """
+        Returns a facilities.Facilities for points, a dict from each
+        facility to its (lat, lon), snapped with this Map's index.  Keep
+        it and pass it to get_nearest for every query on those points.
+        """
+        import facilities
+        return facilities.Facilities(points, self.index)
+
+    def get_nearest(self, coord, targets, k=1, reverse=False, paths=False,
+                    budget=None):
+        """
+        Returns the k facilities of targets, made by facilities, nearest
+        by road to the vertex nearest coord, as facilities.nearest does,
+        with the paths as lists of (lat, lon) waypoints.  With
+        reverse=True the costs are from each facility to coord.  The
+        search is held to budget, a dijkstra.Budget (DEFAULT = a fresh
+        one from this Map's limits); pass one in to check afterwards
+        whether it ran out, in which case fewer than k may come back
+        even though more can be reached.
+
+        >>> m = Map("test.map", cache=False)
+        >>> depots = m.facilities({"a": (100000, 100000), "b": (-100000, 100000)})
+        >>> m.get_nearest( (-100000, -100000), depots, k=2 )
+        [('b', 3, 200000.0), ('a', 4, 400000.0)]
+        >>> m.get_nearest( (-100000, -100000), depots, reverse=True, paths=True )
+        [('b', 3, 282842.71247461904, [(-100000, 100000), (0, 0), (-100000, -100000)])]
+        >>> budget = dijkstra.Budget(max_settled=1)
+        >>> (m.get_nearest( (-100000, -100000), depots, budget=budget ), budget.exhausted)
+        ([], 'settled')
+        """
+        import facilities
+        if budget is None:
+            budget = self.budget()
+        found = facilities.nearest(self.G, self.where_am_i(coord), targets,
+                                   self.cost, k, reverse, paths, budget)
+        if paths:
+            V_coord = self.V_coord
+            found = [(f, v, c, [V_coord[x] for x in path])
+                     for (f, v, c, path) in found]
+        return found
+
+    def get_directions(self, start_coord, stop_coord):
+        """
+        Returns turn by turn instructions for the route between
+        start_coord and stop_coord, or [] if there is no route.
+
+        >>> m = Map("test.map", cache=False)
+        >>> for line in m.get_directions( (-100000, -100000), (100000, 100000) ):
+        ...     print(line)
+        Follow 2-3 for 132306 m
+        Turn left onto 3-4
+        Follow 3-4 for 222640 m
+        Arrive at destination
+        """
+        path = self.get_vertex_path(self.where_am_i(start_coord),
+                                    self.where_am_i(stop_coord))
+        if path is None:
+            return []
+        return self.names.describe(path, self.V_coord)
+
+    def get_turn_path(self, start_coord, stop_coord):
+        """
+        Like get_path, but the route also pays for turns, and avoids
+        u-turns and banned turns, as set up in turn_costs.
+
+        >>> m = Map("test.map", cache=False)
+        >>> m.get_turn_path( (-100000, -100000), (-100000, 100000) )
+        [(-100000, -100000), (-100000, 100000)]
+        """
+        import turns
+        path = turns.least_cost_turn_path(self.compact,
+                                          self.where_am_i(start_coord),
+                                          self.where_am_i(stop_coord),
+                                          self.cost, self.turn_costs)
+        return postprocess.finish_path(path, self.V_coord, self.cost).coords
 
 if __name__ == "__main__":
     import doctest
@@ -0,0 +1,242 @@
+"""
+Map matching of GPS traces onto the road digraph.
+
+A trace is a sequence of (lat, lon) points in the scaled integer units
+of V_coord.  MapMatcher treats the true vertex at each point as the
+hidden state of a hidden Markov model and runs the Viterbi algorithm
+over it:
+
+    - the candidate states for a point are the vertices found within
+      search_radius of it by a spatial.GridIndex
+    - a candidate costs 0.5 * (d / sigma)**2, where d is how far the
+      point is from the vertex (negative log of a gaussian)
+    - moving from candidate u to candidate v costs
+      |route(u, v) - straight(u, v)| / beta, where route is the least
+      cost on the road graph, found by a dijkstra.bounded_search that
+      gives up once it is much longer than the straight-line distance
+
+Matching is streamed.  Only the columns of the Viterbi trellis that
+are still undecided are kept; as soon as every surviving candidate
+traces back to the same earlier vertex, everything up to that vertex
+is final and is handed to the caller.  max_window caps how many
+undecided columns are kept for traces that never converge.
+
+>>> import digraph
+>>> V_coord = {1: (0, 0), 2: (0, 100), 3: (0, 200), 4: (100, 100)}
+>>> G = digraph.Digraph([(1, 2), (2, 1), (2, 3), (3, 2), (2, 4), (4, 2)])
+>>> m = MapMatcher(G, V_coord, sigma=10, search_radius=60)
+>>> trace = [(3, 4), (-5, 60), (2, 190), (5, 205)]
+>>> list(m.match(trace))
+[(0, 1), (1, 2), (2, 3), (3, 3)]
+>>> list(m.match_path(trace))
+[1, 2, 3]
+"""
+
+import dijkstra
+import spatial
+
+
+def straight_distance(a, b):
+    """
+    Straight-line distance between two scaled (lat, lon) points.
+
+    >>> straight_distance((0, 0), (3, 4))
+    5.0
+    """
+    return ((a[0] - b[0])**2 + (a[1] - b[1])**2)**.5
+
+
+class MapMatcher:
+    """
+    HMM/Viterbi map matcher over a Digraph.
+
+    G, V_coord   the road graph and its vertex coordinates
+    cost         edge cost function, defaults to straight-line edge length
+    index        a spatial.GridIndex over V_coord, built if not supplied
+    sigma        GPS noise, in V_coord units
+    beta         how strongly detours are penalized, in V_coord units
+    search_radius, max_candidates
+                 how candidate vertices are chosen for each point
+    route_factor, route_slack
+                 a transition search gives up past
+                 route_factor * straight + route_slack
+    max_window   most undecided trellis columns kept in memory
+    """
+
+    def __init__(self, G, V_coord, cost=None, index=None, sigma=10,
+                 beta=20, search_radius=50, max_candidates=8,
+                 route_factor=2.0, route_slack=100, max_window=64):
+        self.G = G
+        self.V_coord = V_coord
+        if cost is None:
+            cost = lambda e: straight_distance(V_coord[e[0]], V_coord[e[1]])
+        self.cost = cost
+        if index is None:
+            index = spatial.GridIndex(V_coord)
+        self.index = index
+        self.sigma = sigma
+        self.beta = beta
+        self.search_radius = search_radius
+        self.max_candidates = max_candidates
+        self.route_factor = route_factor
+        self.route_slack = route_slack
+        self.max_window = max_window
+
+    def candidates(self, point):
+        """
+        Returns [(vertex, emission cost)] for the point.  If no vertex
+        is within search_radius the single nearest vertex is used.
+        """
+        (lat, lon) = point
+        near = self.index.within(lat, lon, self.search_radius)
+        if not near:
+            near = [self.index.nearest(lat, lon)]
+        sigma = self.sigma
+        return [(v, 0.5 * (d / sigma)**2)
+                for (v, d) in near[:self.max_candidates]]
+
+    def _transitions(self, prev, cur):
+        """
+        Returns trans[i][j], the cost of moving from the i-th vertex of
+        prev to the j-th vertex of cur, or None where there is no route
+        within the search bound.
+        """
+        V_coord = self.V_coord
+        targets = {v for v in cur}
+        trans = []
+        for u in prev:
+            ucoord = V_coord[u]
+            reach = max(straight_distance(ucoord, V_coord[v]) for v in cur)
+            limit = self.route_factor * reach + self.route_slack
+            (dist, parent) = dijkstra.bounded_search(
+                self.G, u, self.cost, limit, targets)
+            row = []
+            for v in cur:
+                if v in dist:
+                    row.append(abs(dist[v] -
+                        straight_distance(ucoord, V_coord[v])) / self.beta)
+                else:
+                    row.append(None)
+            trans.append(row)
+        return trans
+
+    def match(self, trace):
+        """
+        Generator yielding (i, vertex) for each point trace[i], in order,
+        as soon as the match for that point is final.  trace can be any
+        iterable, so an unbounded feed of points can be matched.
+        """
+        # window[k] is one trellis column: a list of
+        # [vertex, total cost, index of best predecessor in window[k-1]]
+        window = []
+        first = 0  # trace index of window[0]
+
+        for point in trace:
+            cands = self.candidates(point)
+            if window:
+                prev = window[-1]
+                trans = self._transitions([s[0] for s in prev],
+                                          [v for (v, e) in cands])
+                column = []
+                for (j, (v, emit)) in enumerate(cands):
+                    best = None
+                    for (i, s) in enumerate(prev):
+                        t = trans[i][j]
+                        if t is None:
+                            continue
+                        total = s[1] + t + emit
+                        if best is None or total < best[1]:
+                            best = [v, total, i]
+                    if best is not None:
+                        column.append(best)
+
+                if not column:
+                    # no candidate is reachable: the trace left the graph
+                    # or jumped, so finish off what we have and start over
+                    for item in self._flush(window, first, len(window)):
+                        yield item
+                    first += len(window)
+                    window = []
+                else:
+                    window.append(column)
+
+            if not window:
+                window.append([[v, emit, None] for (v, emit) in cands])
+
+            # emit whatever all survivors agree on
+            decided = self._converged(window)
+            if len(window) > self.max_window:
+                decided = max(decided, len(window) - self.max_window)
+            if decided:
+                for item in self._flush(window, first, decided):
+                    yield item
+                first += decided
+                window = window[decided:]
+                for s in window[0]:
+                    s[2] = None
+
+        if window:
+            for item in self._flush(window, first, len(window)):
+                yield item
+
+    def _converged(self, window):
+        """
+        Returns how many leading columns of window are decided, that is
+        every state in the last column traces back through the same
+        state in each of them.
+        """
+        alive = set(range(len(window[-1])))
+        for k in range(len(window) - 1, 0, -1):
+            alive = {window[k][i][2] for i in alive}
+            if len(alive) == 1:
+                return k
+        return 0
+
+    def _flush(self, window, first, count):
+        """
+        Yields the decided (index, vertex) pairs for the first count
+        columns of window, following back pointers from the cheapest
+        state in column count-1 or, for a full flush, the last column.
+        """
+        last = len(window) - 1
+        best = min(range(len(window[last])), key=lambda i: window[last][i][1])
+        chosen = []
+        for k in range(last, -1, -1):
+            if k < count:
+                chosen.append(window[k][best][0])
+            best = window[k][best][2]
+        chosen.reverse()
+        for (k, v) in enumerate(chosen):
+            yield (first + k, v)
+
+    def match_path(self, trace):
+        """
+        Generator yielding the vertices of the road path through the
+        matched vertices, filling in the route between consecutive
+        matches.  Consecutive repeats are dropped.  If the trace breaks
+        (there is no route between two matches) None is yielded between
+        the two pieces.
+        """
+        prev = None
+        for (i, v) in self.match(trace):
+            if prev is None:
+                yield v
+            elif v != prev:
+                limit = (self.route_factor *
+                    straight_distance(self.V_coord[prev], self.V_coord[v]) +
+                    self.route_slack)
+                (dist, parent) = dijkstra.bounded_search(
+                    self.G, prev, self.cost, limit, {v})
+                path = dijkstra.extract_path(parent, prev, v)
+                if path is None:
+                    yield None
+                    yield v
+                else:
+                    for w in path[1:]:
+                        yield w
+            prev = v
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,234 @@
+"""
+    python3 memreport.py [-g graph-file] [--all] [--tracemalloc]
+                         [--write-cache]
+
+Memory report for a loaded map, for capacity planning.
+
+Loads the graph the way server.py does, with map.Map, builds its
+indexes and prints how many bytes each structure takes, in total and
+per vertex and per edge of the graph:
+
+    E, E_name, V, V_coord   the graph as readModule returns it
+    G                       the digraph.Digraph set of sets
+    index                   the spatial.GridIndex for snapping
+    components              the component label of each vertex
+    compact                 the compact.CompactGraph array copy of G
+and with --all also
+    names                   directions.StreetNames, the name table
+                            and the name number of each compact edge
+    turn_costs              turns.TurnCosts
+    profiles                timedep.Profiles
+
+Sizes are deep sizes: sys.getsizeof of the structure and everything it
+holds, each object once.  Each structure is sized on its own, so objects
+shared between structures (the edge tuples E and E_name have in common,
+vertex id ints) count towards each of them; the total sizes them all
+together and counts them once.  References from one structure to
+another, such as TurnCosts.C to compact, are not followed.
+
+Then the array forms are compared with the structures they stand in
+for: compact with G, and with --all names with E_name.
+
+With --tracemalloc the memory the Python allocator hands out while each
+structure is built is measured as well.  It catches what deep sizing
+cannot see (over-allocation, memory freed afterwards is not counted),
+but loading and building take several times longer while tracing.  A
+step also counts importing the modules it needs the first time, which
+only matters on a map as small as test.map.
+
+The binary copy of the graph is read when it is up to date, as the
+server does, but only written with --write-cache, so a report leaves no
+file behind.
+"""
+import argparse
+import sys
+import time
+import types
+from array import array
+
+from map import Map
+
+# objects deep_size does not look inside: their size is their own
+_LEAVES = (str, bytes, bytearray, int, float, complex, bool, type(None),
+           array, range)
+
+# objects deep_size leaves out altogether
+_SKIP = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType,
+         types.MethodType)
+
+
+def deep_size(obj, seen=None):
+    """
+    Returns the size in bytes of obj and everything it holds: the items
+    of containers, the keys and values of dicts and the attributes of
+    other objects.  Objects whose id is in seen are not counted, and the
+    ids of the objects counted are added to it.
+
+    >>> deep_size([]) == sys.getsizeof([])
+    True
+    >>> t = ("a long enough string",)
+    >>> deep_size([t, t]) == sum(sys.getsizeof(x) for x in ([t, t], t, t[0]))
+    True
+    """
+    if seen is None:
+        seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, _SKIP):
+            continue
+        seen.add(id(o))
+        total += sys.getsizeof(o)
+        if isinstance(o, _LEAVES):
+            continue
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        else:
+            d = getattr(o, '__dict__', None)
+            if d is not None:
+                stack.append(d)
+            for slot in getattr(type(o), '__slots__', ()):
+                if hasattr(o, slot):
+                    stack.append(getattr(o, slot))
+    return total
+
+
+def structures(roadmap, everything=False):
+    """
+    Returns the list of (name, structure) of roadmap to report on,
+    building the lazy ones.
+    """
+    found = [
+        ("E", roadmap.E),
+        ("E_name", roadmap.E_name),
+        ("V", roadmap.V),
+        ("V_coord", roadmap.V_coord),
+        ("G", roadmap.G),
+        ("index", roadmap.index),
+        ("components", roadmap.components),
+        ("compact", roadmap.compact),
+    ]
+    if everything:
+        found.append(("names", roadmap.names))
+        found.append(("turn_costs", roadmap.turn_costs))
+        found.append(("profiles", roadmap.profiles))
+    return found
+
+
+def sizes(found):
+    """
+    Returns ({name: deep size}, total) for the (name, structure) pairs
+    in found, see the module documentation.
+    """
+    ids = {id(s) for (name, s) in found}
+    result = {}
+    for (name, s) in found:
+        result[name] = deep_size(s, ids - {id(s)})
+    total = deep_size([s for (name, s) in found])
+    # the list holding them is not part of any of them
+    total -= sys.getsizeof([s for (name, s) in found])
+    return (result, total)
+
+
+def traced_build(file_name, everything=False, write_cache=False):
+    """
+    Loads file_name and builds its structures under tracemalloc.
+    Returns (roadmap, steps), steps a list of (step, bytes) of the
+    memory still allocated after each step.
+    """
+    import tracemalloc
+
+    steps = []
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        roadmap = Map(file_name, write_cache=write_cache)
+        after = tracemalloc.get_traced_memory()[0]
+        steps.append(("E, E_name, V, V_coord, G", after - before))
+        names = ["index", "components", "compact"]
+        if everything:
+            names.extend(["names", "turn_costs", "profiles"])
+        for name in names:
+            before = after
+            getattr(roadmap, name)
+            after = tracemalloc.get_traced_memory()[0]
+            steps.append((name, after - before))
+    finally:
+        tracemalloc.stop()
+    return (roadmap, steps)
+
+
+def report(rows, n, m, out=sys.stdout):
+    """
+    Prints a (name, bytes) row per structure, with bytes per vertex and
+    per edge for a graph of n vertices and m edges.
+    """
+    print("{:<26}{:>14}{:>12}{:>12}".format("structure", "bytes", "per vertex",
+                                            "per edge"), file=out)
+    for (name, size) in rows:
+        print("{:<26}{:>14,}{:>12.1f}{:>12.1f}".format(
+            name, size, size / n if n else 0.0, size / m if m else 0.0), file=out)
+
+
+def compare(deep, out=sys.stdout):
+    """
+    Prints how big each array form is against the structure it stands
+    in for.
+    """
+    for (small, big) in [("compact", "G"), ("names", "E_name")]:
+        if small in deep and deep.get(big):
+            print("{} is {:.1%} of {} ({:,} bytes saved)".format(
+                small, deep[small] / deep[big], big, deep[big] - deep[small]),
+                file=out)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Memory report for a loaded map.')
+    parser.add_argument('-g', '--graph', dest='graphname', default='test.map',
+                        help='path to graph (DEFAULT = test.map)')
+    parser.add_argument('--all', dest='everything', action='store_true',
+                        help='also build and size street names, turn costs '
+                             'and speed profiles')
+    parser.add_argument('--tracemalloc', action='store_true',
+                        help='also measure what building each structure '
+                             'allocates, with tracemalloc')
+    parser.add_argument('--write-cache', dest='write_cache', action='store_true',
+                        help='write the binary copy of the graph next to it '
+                             'if it is missing or out of date')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    t = time.perf_counter()
+    if args.tracemalloc:
+        (roadmap, steps) = traced_build(args.graphname, args.everything,
+                                        args.write_cache)
+    else:
+        roadmap = Map(args.graphname, write_cache=args.write_cache)
+        steps = None
+    found = structures(roadmap, args.everything)
+    n = len(roadmap.V)
+    m = len(roadmap.E)
+    print("{}: {} vertices, {} edges, loaded in {:.3f}s".format(
+        args.graphname, n, m, time.perf_counter() - t))
+    print()
+
+    (deep, total) = sizes(found)
+    report([(name, deep[name]) for (name, s) in found] + [("total", total)], n, m)
+    print()
+    compare(deep)
+
+    if steps is not None:
+        print()
+        print("allocated while building (tracemalloc):")
+        report(steps + [("total", sum(size for (step, size) in steps))], n, m)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
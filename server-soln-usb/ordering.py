@@ -0,0 +1,190 @@
+"""
+Spatially local vertex orderings.
+
+Vertex ids in the map are OpenStreetMap ids, which say nothing about
+where a vertex is: neighbouring intersections can have ids millions
+apart.  Numbering vertices along a space filling curve over V_coord
+instead puts vertices that are close on the map close together in
+number, so arrays indexed by vertex number (compact.CompactGraph, the
+vertex table of a binary graph file) are walked mostly in nearby
+memory, and small dense ints hash evenly into dicts and sets.
+
+Two curves are available:
+
+    hilbert   never jumps: consecutive cells along the curve always
+              touch, so it keeps the most locality
+    morton    (Z order) interleaves the bits of the two coordinates,
+              cheaper to work out but with long jumps between quadrants
+
+Renumbering gives every vertex a dense number 0 .. n-1 along the curve
+and maps both ways between numbers and ids.
+
+>>> V_coord = {900: (0, 0), 500: (0, 10), 700: (10, 10), 100: (10, 0)}
+>>> curve_order(V_coord)
+[900, 500, 700, 100]
+>>> curve_order(V_coord, "morton")
+[900, 500, 100, 700]
+>>> r = Renumbering(V_coord)
+>>> r.number[100], r.ids[3]
+(3, 100)
+>>> r.graph({(900, 500), (700, 100)}, {(900, 500): "A"}, set(V_coord), V_coord)
+({(0, 1), (2, 3)}, {(0, 1): 'A'}, {0, 1, 2, 3}, {0: (0, 0), 1: (0, 10), 2: (10, 10), 3: (10, 0)})
+>>> r.to_ids([0, 3])
+[900, 100]
+"""
+
+from array import array
+
+# coordinates are scaled onto a 2**BITS x 2**BITS grid before ordering
+BITS = 16
+
+
+def morton_key(x, y, bits=BITS):
+    """
+    Position of the grid cell (x, y) along the Morton (Z order) curve.
+
+    >>> [morton_key(x, y, 1) for (x, y) in [(0, 0), (0, 1), (1, 0), (1, 1)]]
+    [0, 1, 2, 3]
+    """
+    key = 0
+    for b in range(bits - 1, -1, -1):
+        key = (key << 2) | (((x >> b) & 1) << 1) | ((y >> b) & 1)
+    return key
+
+
+def hilbert_key(x, y, bits=BITS):
+    """
+    Position of the grid cell (x, y) along the Hilbert curve.
+
+    >>> [hilbert_key(x, y, 1) for (x, y) in [(0, 0), (0, 1), (1, 1), (1, 0)]]
+    [0, 1, 2, 3]
+    """
+    n = 1 << bits
+    key = 0
+    s = n >> 1
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        key += s * s * ((3 * rx) ^ ry)
+        # rotate the quadrant so the curve inside it starts at its corner
+        if ry == 0:
+            if rx == 1:
+                (x, y) = (n - 1 - x, n - 1 - y)
+            (x, y) = (y, x)
+        s >>= 1
+    return key
+
+
+CURVES = {
+    "hilbert": hilbert_key,
+    "morton": morton_key,
+}
+
+
+def frame(V_coord):
+    """
+    Returns (lat0, lon0, span): the south west corner of the bounding
+    box of V_coord and the length of its longer side, the square that
+    curve_keys scales onto the curve's grid.
+
+    >>> frame({1: (0, 5), 2: (10, 25)})
+    (0, 5, 20)
+    """
+    if not V_coord:
+        return (0, 0, 1)
+    lats = [c[0] for c in V_coord.values()]
+    lons = [c[1] for c in V_coord.values()]
+    (lat0, lon0) = (min(lats), min(lons))
+    return (lat0, lon0, max(max(lats) - lat0, max(lons) - lon0, 1))
+
+
+def grid_cell(lat, lon, square, bits=BITS):
+    """
+    Returns the (x, y) cell of the 2**bits x 2**bits grid over square,
+    as returned by frame, that (lat, lon) falls in.  Points outside the
+    square go in the nearest cell on its edge.
+    """
+    (lat0, lon0, span) = square
+    top = (1 << bits) - 1
+    x = (lat - lat0) * top // span
+    y = (lon - lon0) * top // span
+    return (min(max(x, 0), top), min(max(y, 0), top))
+
+
+def curve_keys(V_coord, curve="hilbert", bits=BITS):
+    """
+    Returns {v: position along curve} for the vertices of V_coord, with
+    the bounding box of V_coord scaled onto the curve's grid.  Both
+    axes are scaled alike, so the grid cells stay square.
+    """
+    if curve not in CURVES:
+        raise ValueError("unknown curve {!r}, expected one of {}".format(
+            curve, ", ".join(sorted(CURVES))))
+    key = CURVES[curve]
+    square = frame(V_coord)
+    return {v: key(*grid_cell(lat, lon, square, bits), bits)
+            for (v, (lat, lon)) in V_coord.items()}
+
+
+def curve_order(V_coord, curve="hilbert", bits=BITS):
+    """
+    Returns the vertices of V_coord sorted along curve.  Vertices in
+    the same grid cell keep their V_coord order.
+    """
+    keys = curve_keys(V_coord, curve, bits)
+    return sorted(V_coord, key=keys.__getitem__)
+
+
+class Renumbering:
+    """
+    Dense numbers for the vertices of V_coord along curve:
+
+        ids[i]      the vertex id of number i, an array('q')
+        number[v]   the number of vertex id v
+
+    Vertices without coordinates in V (if given) are numbered last.
+    """
+
+    def __init__(self, V_coord, curve="hilbert", V=()):
+        order = curve_order(V_coord, curve)
+        order.extend(v for v in V if v not in V_coord)
+        self.ids = array('q', order)
+        self.number = {v: i for (i, v) in enumerate(order)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def to_ids(self, numbers):
+        """
+        Returns the list of vertex ids for a list of numbers, such as a
+        path found on the renumbered graph.
+        """
+        ids = self.ids
+        return [ids[i] for i in numbers]
+
+    def to_numbers(self, vertices):
+        """
+        Returns the list of numbers for a list of vertex ids.
+        """
+        number = self.number
+        return [number[v] for v in vertices]
+
+    def graph(self, E, E_name, V, V_coord):
+        """
+        Returns the graph (E, E_name, V, V_coord), as read_graph returns
+        it, with every vertex id replaced by its number.  V_coord comes
+        back in number order.
+        """
+        number = self.number
+        new_E = {(number[u], number[v]) for (u, v) in E}
+        new_E_name = {(number[u], number[v]): name
+                      for ((u, v), name) in E_name.items()}
+        new_V = {number[v] for v in V}
+        new_V_coord = {i: V_coord[v] for (i, v) in enumerate(self.ids)
+                       if v in V_coord}
+        return (new_E, new_E_name, new_V, new_V_coord)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,345 @@
+"""
+Geographic partitioning and sharded routing.
+
+The map is cut into rows x cols rectangular cells over the bounding box
+of V_coord.  Each cell becomes a Shard holding only its own vertices and
+the edges between them, with the edge costs already worked out, so a
+shard can live in a worker process of its own.
+
+Edges between cells are what tie the shards together.  Their start
+vertices are the exits of a cell and their end vertices the entries of
+a cell.  Like a multilevel overlay graph, the coordinator keeps a small
+overlay graph over just these boundary vertices:
+
+    - every edge between cells, with its cost
+    - for every cell, an edge from each entry to each exit it can reach
+      inside the cell, costing the least cost of doing so, worked out by
+      the shard once up front
+
+A route from start to dest is then any within-cell path from start to
+an exit of its cell, a least cost path over the overlay graph to an
+entry of dest's cell, and a within-cell path from there to dest (or,
+if both ends share a cell, possibly just a path inside it).  The two
+end searches run in the two shards at the same time, the overlay search
+runs in the coordinator, and the shards fill the overlay edges back in
+with real paths, again at the same time.
+
+>>> import bench
+>>> (G, V_coord) = bench.grid_map(6, 6)
+>>> def cost(e):
+...     (a, b) = (V_coord[e[0]], V_coord[e[1]])
+...     return ((a[0] - b[0])**2 + (a[1] - b[1])**2)**.5
+>>> router = ShardedRouter(G.edges(), V_coord, cost, 2, 2, processes=False)
+>>> len(router.shards)
+4
+>>> path = router.least_cost_path(0, 35)
+>>> (len(path), path[0], path[-1], G.is_path(path))
+(11, 0, 35, True)
+>>> router.least_cost_path(7, 7)
+[7]
+>>> router.close()
+"""
+
+import heapq
+import itertools
+import multiprocessing
+
+import dijkstra
+
+
+class Shard:
+    """
+    The part of the graph inside one cell: adj[u] and radj[v] are lists
+    of (neighbour, edge cost) pairs for the edges inside the cell.
+    """
+
+    def __init__(self, adj, radj):
+        self.adj = adj
+        self.radj = radj
+
+    def _search(self, source, targets, reverse=False):
+        adj = self.radj if reverse else self.adj
+        dist = {}
+        parent = {}
+        heap = [(0, source)]
+        best = {source: 0}
+        remaining = set(targets)
+        while heap and remaining:
+            (c, u) = heapq.heappop(heap)
+            if u in dist:
+                continue
+            dist[u] = c
+            remaining.discard(u)
+            for (v, w) in adj.get(u, ()):
+                nc = c + w
+                if v not in dist and (v not in best or nc < best[v]):
+                    best[v] = nc
+                    parent[v] = u
+                    heapq.heappush(heap, (nc, v))
+        return (dist, parent)
+
+    def distances(self, source, targets, reverse=False):
+        """
+        Returns {t: least cost from source to t} for the targets that
+        can be reached inside the shard.  With reverse=True the costs
+        are from each t to source instead.
+        """
+        (dist, parent) = self._search(source, targets, reverse)
+        return {t: dist[t] for t in targets if t in dist}
+
+    def table(self, sources, targets):
+        """
+        Returns {(s, t): least cost} for every target reachable from
+        every source inside the shard.
+        """
+        result = {}
+        for s in sources:
+            for (t, d) in self.distances(s, targets).items():
+                result[(s, t)] = d
+        return result
+
+    def path(self, start, dest):
+        """
+        Returns the least cost path from start to dest inside the shard.
+        """
+        (dist, parent) = self._search(start, [dest])
+        return dijkstra.extract_path(parent, start, dest)
+
+    def paths(self, pairs):
+        """
+        Returns the list of path(a, b) for each (a, b) in pairs.
+        """
+        return [self.path(a, b) for (a, b) in pairs]
+
+
+def _serve(conn, shard):
+    """
+    Worker process loop: runs shard methods for the coordinator until
+    it sends None.
+    """
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        (method, args) = msg
+        conn.send(getattr(shard, method)(*args))
+    conn.close()
+
+
+class _LocalShard:
+    """
+    Stands in for a worker process when the router runs in one process,
+    with the same send/recv calls.
+    """
+
+    def __init__(self, shard):
+        self.shard = shard
+        self.pending = []
+
+    def send(self, msg):
+        (method, args) = msg
+        self.pending.append(getattr(self.shard, method)(*args))
+
+    def recv(self):
+        return self.pending.pop(0)
+
+
+def cells(V_coord, rows, cols):
+    """
+    Returns {v: cell number} cutting the bounding box of V_coord into
+    rows x cols cells, numbered row by row from the south west.
+
+    >>> cells({1: (0, 0), 2: (0, 10), 3: (10, 10)}, 2, 2)
+    {1: 0, 2: 1, 3: 3}
+    """
+    lats = [c[0] for c in V_coord.values()]
+    lons = [c[1] for c in V_coord.values()]
+    (lat0, lon0) = (min(lats), min(lons))
+    height = max(lats) - lat0 + 1
+    width = max(lons) - lon0 + 1
+    return {v: ((lat - lat0) * rows // height) * cols +
+               (lon - lon0) * cols // width
+            for (v, (lat, lon)) in V_coord.items()}
+
+
+class ShardedRouter:
+    """
+    Coordinator for routing over rows x cols shards.
+
+    E is the set of edges, V_coord the vertex coordinates and cost the
+    edge cost function; costs are worked out here, once, and only the
+    numbers are handed to the shards.  With processes=True each shard
+    runs in its own worker process, otherwise everything runs here.
+    Call close() when done to stop the workers.
+    """
+
+    def __init__(self, E, V_coord, cost, rows=2, cols=2, processes=True):
+        self.shard_of = cells(V_coord, rows, cols)
+        shard_of = self.shard_of
+        count = rows * cols
+
+        adjs = [{} for k in range(count)]
+        radjs = [{} for k in range(count)]
+        self.overlay = {}
+        self.entries = [set() for k in range(count)]
+        self.exits = [set() for k in range(count)]
+
+        for e in E:
+            (u, v) = e
+            c = cost(e)
+            (ku, kv) = (shard_of[u], shard_of[v])
+            if ku == kv:
+                adjs[ku].setdefault(u, []).append((v, c))
+                radjs[ku].setdefault(v, []).append((u, c))
+            else:
+                self.exits[ku].add(u)
+                self.entries[kv].add(v)
+                self.overlay.setdefault(u, []).append((v, c, None))
+
+        self.shards = []
+        self.workers = []
+        for k in range(count):
+            shard = Shard(adjs[k], radjs[k])
+            if processes:
+                (here, there) = multiprocessing.Pipe()
+                p = multiprocessing.Process(target=_serve, args=(there, shard),
+                                            daemon=True)
+                p.start()
+                self.workers.append(p)
+                self.shards.append(here)
+            else:
+                self.shards.append(_LocalShard(shard))
+        # the coordinator only keeps the overlay from here on
+        del adjs, radjs
+
+        # entry to exit costs inside each cell, all shards at once
+        for k in range(count):
+            self.shards[k].send(('table', (self.entries[k], self.exits[k])))
+        for k in range(count):
+            for ((a, b), d) in self.shards[k].recv().items():
+                if a != b:
+                    self.overlay.setdefault(a, []).append((b, d, k))
+
+    def close(self):
+        """
+        Stops the worker processes.
+        """
+        for (conn, p) in zip(self.shards, self.workers):
+            conn.send(None)
+            p.join()
+        self.workers = []
+
+    def least_cost_path(self, start, dest):
+        """
+        Returns a least cost path from start to dest as a list of
+        vertices, or None if there is none.  The path from start to
+        start is [start].
+        """
+        if start not in self.shard_of or dest not in self.shard_of:
+            return None
+        if start == dest:
+            return [start]
+
+        (ks, kt) = (self.shard_of[start], self.shard_of[dest])
+
+        # both ends of the route, in their own shards at the same time
+        targets = set(self.exits[ks])
+        if ks == kt:
+            targets.add(dest)
+        self.shards[ks].send(('distances', (start, targets)))
+        self.shards[kt].send(('distances', (dest, self.entries[kt], True)))
+        head = self.shards[ks].recv()
+        tail = self.shards[kt].recv()
+
+        # best is the cheapest complete route found so far, as
+        # (cost, last overlay vertex or None for a route inside ks)
+        best = (float("inf"), None)
+        if dest in head:
+            best = (head[dest], None)
+
+        # search over the overlay; parent[x] = (y, shard) means x is
+        # reached from y inside shard, or over an edge if shard is None
+        # (tick only breaks ties, so vertices are never compared)
+        dist = {}
+        parent = {}
+        heap = []
+        tick = itertools.count()
+        for (x, d) in head.items():
+            if x != dest or x in self.exits[ks]:
+                heapq.heappush(heap, (d, next(tick), x, start, ks))
+        while heap:
+            (c, t, u, p, k) = heapq.heappop(heap)
+            if c >= best[0]:
+                break
+            if u in dist:
+                continue
+            dist[u] = c
+            parent[u] = (p, k)
+            if u in tail and c + tail[u] < best[0]:
+                best = (c + tail[u], u)
+            for (v, w, kv) in self.overlay.get(u, ()):
+                if v not in dist and c + w < best[0]:
+                    heapq.heappush(heap, (c + w, next(tick), v, u, kv))
+
+        (total, last) = best
+        if total == float("inf"):
+            return None
+
+        # the overlay steps, from dest back to start
+        segments = []
+        if last is None:
+            segments.append((start, dest, ks))
+        else:
+            segments.append((last, dest, kt))
+            u = last
+            while u != start:
+                (p, k) = parent[u]
+                segments.append((p, u, k))
+                u = p
+        segments.reverse()
+
+        # fill in the inside-a-shard steps, all shards at once
+        asked = {}
+        for (a, b, k) in segments:
+            if k is not None and a != b:
+                asked.setdefault(k, []).append((a, b))
+        for (k, pairs) in asked.items():
+            self.shards[k].send(('paths', (pairs,)))
+        found = {}
+        for (k, pairs) in asked.items():
+            for (pair, path) in zip(pairs, self.shards[k].recv()):
+                found[pair] = path
+
+        path = [start]
+        for (a, b, k) in segments:
+            if k is None:
+                path.append(b)
+            elif a != b:
+                path.extend(found[(a, b)][1:])
+        return path
+
+
+def verify(router, G, cost, pairs):
+    """
+    Checks router against dijkstra.least_cost_path on each (start, dest)
+    in pairs.  Returns the list of pairs where the two disagree on
+    whether there is a route or on its cost.
+    """
+    def length(path):
+        return sum(cost((path[i], path[i+1])) for i in range(len(path) - 1))
+
+    wrong = []
+    for (start, dest) in pairs:
+        expected = dijkstra.least_cost_path(G, start, dest, cost)
+        got = router.least_cost_path(start, dest)
+        if (expected is None) != (got is None):
+            wrong.append((start, dest))
+        elif got is not None and (not G.is_path(got) or
+                abs(length(got) - length(expected)) > 1e-6):
+            wrong.append((start, dest))
+    return wrong
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
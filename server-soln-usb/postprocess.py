@@ -0,0 +1,219 @@
+"""
+Everything done to a route after the search, in one go.
+
+Once a search has reached its destination, turning the result into an
+answer used to walk the path several times: extract it from the parent
+map, check it with G.is_path, take out cycles with digraph.compress,
+add up its length with server.total_distance, look up the coordinates
+and format the lines for the client.  finish does all of it in a walk
+back along the parent map and a single pass forward, and hands back a
+Route:
+
+    vertices    the vertex ids along the route
+    coords      their (lat, lon) V_coord coordinates
+    cost        array('d') of the cost from the start to each vertex
+    metres      array('d') of the ground distance from the start to
+                each vertex, see directions.metres
+    lines       the "lat lon" line of each waypoint for the client
+    complete    False if the search ran out of budget before reaching
+                the destination, see map.Map
+
+The answer sent to the client starts with the number of waypoints.  A
+route the budget cut short says so after the number, so the client can
+tell it from a whole route, and from there being no route at all:
+
+    N           a route of N waypoints
+    N partial   the route as far as the search got, see map.Map
+    0 budget    the search gave up before finding a route
+
+A path that comes out of a parent map cannot help being a path, so it
+is not checked again.  Engines that put their route together some other
+way (partition.ShardedRouter, turns.least_cost_turn_path, map matching)
+hand the finished list of vertices to finish_path instead, which also
+cuts out cycles if asked to.
+
+>>> V_coord = {1: (0, 0), 2: (0, 100), 3: (100, 100)}
+>>> r = finish({2: 1, 3: 2}, 1, 3, V_coord)
+>>> r.vertices, list(r.cost)
+([1, 2, 3], [0.0, 100.0, 200.0])
+>>> [round(m) for m in r.metres]
+[0, 66, 177]
+>>> print(r.text())
+3
+0 0
+0 100
+100 100
+>>> print(finish({2: 1}, 1, 3, V_coord))
+None
+>>> finish_path([1, 2, 1, 2, 3], V_coord, walk=True).vertices
+[1, 2, 3]
+>>> r.complete = False
+>>> print(r.text())
+3 partial
+0 0
+0 100
+100 100
+>>> header(0, complete=False)
+'0 budget'
+"""
+
+from array import array
+
+from directions import METRES_LAT, METRES_LON
+
+# what follows the number of waypoints in the answer to a route the
+# budget cut short, see the module documentation
+PARTIAL = "partial"
+BUDGET = "budget"
+
+
+def header(n, complete=True):
+    """
+    Returns the first line of the answer to a route request with n
+    waypoints, see the module documentation.
+    """
+    if complete:
+        return str(n)
+    return "{} {}".format(n, PARTIAL if n else BUDGET)
+
+
+class Route:
+    """
+    A finished route, see the module documentation.  The empty Route
+    stands for no route at all.
+    """
+
+    def __init__(self, vertices=None, coords=None, cost=None, metres=None,
+                 lines=None):
+        self.vertices = vertices if vertices is not None else []
+        self.coords = coords if coords is not None else []
+        self.cost = cost if cost is not None else array('d')
+        self.metres = metres if metres is not None else array('d')
+        self.lines = lines if lines is not None else []
+        self.complete = True
+
+    def __len__(self):
+        return len(self.vertices)
+
+    def copy(self):
+        """
+        Returns a Route of its own with the same contents, so that one
+        caller changing it does not change it for another.
+
+        >>> r = finish_path([1, 2], {1: (0, 0), 2: (0, 100)})
+        >>> c = r.copy()
+        >>> c.coords.pop()
+        (0, 100)
+        >>> (len(r.coords), list(c.cost), c.complete)
+        (2, [0.0, 100.0], True)
+        """
+        route = Route(list(self.vertices), list(self.coords),
+                      array('d', self.cost), array('d', self.metres),
+                      list(self.lines))
+        route.complete = self.complete
+        return route
+
+    def total_cost(self):
+        return self.cost[-1] if self.cost else 0.0
+
+    def total_metres(self):
+        return self.metres[-1] if self.metres else 0.0
+
+    def text(self):
+        """
+        The whole response for the client: the header, the number of
+        waypoints and whether the route is complete, then a "lat lon"
+        line per waypoint, as server.format_path gives.
+        """
+        return '\n'.join([header(len(self.lines), self.complete)] + self.lines)
+
+
+def _build(vertices, V_coord, dist=None, cost=None, ids=None, walk=False):
+    # the forward pass: vertices are in order from start to dest, as ids
+    # or, given ids, as indexes into it
+    if walk:
+        last = {}
+        for (i, x) in enumerate(vertices):
+            last[x] = i
+        kept = []
+        i = 0
+        while i < len(vertices):
+            kept.append(vertices[i])
+            i = last[vertices[i]] + 1
+        vertices = kept
+    if ids is not None:
+        keys = vertices
+        vertices = [ids[i] for i in vertices]
+
+    coords = [V_coord[v] for v in vertices]
+    lines = ['{} {}'.format(lat, lon) for (lat, lon) in coords]
+
+    n = len(vertices)
+    metres = array('d', [0.0]) * n
+    if dist is not None:
+        costs = array('d', (dist[x] for x in (keys if ids is not None else vertices)))
+    else:
+        costs = array('d', [0.0]) * n
+    total = 0.0
+    length = 0.0
+    for i in range(1, n):
+        (p, q) = (coords[i], coords[i - 1])
+        dlat = p[0] - q[0]
+        dlon = p[1] - q[1]
+        length += ((dlat * METRES_LAT) ** 2 + (dlon * METRES_LON) ** 2) ** .5
+        metres[i] = length
+        if dist is None:
+            if cost is None:
+                total += (dlat * dlat + dlon * dlon) ** .5
+            else:
+                total += cost((vertices[i - 1], vertices[i]))
+            costs[i] = total
+    return Route(vertices, coords, costs, metres, lines)
+
+
+def finish(parent, start, dest, V_coord, dist=None, cost=None, ids=None):
+    """
+    Returns the Route from start to dest along the parent map of a
+    search, or None if dest was not reached.
+
+    parent is a dict from each reached vertex to the one before it, as
+    dijkstra.bounded_search returns, or an array('l') in vertex indexes
+    with -1 for vertices not reached, as the traversal functions return
+    for a compact.CompactGraph; then start and dest are indexes too and
+    ids turns indexes into vertex ids.  Either way the start may or may
+    not be its own parent.
+
+    The cumulative costs are taken from dist, the costs the search
+    found, when given.  Otherwise each edge costs cost(e), or its
+    straight line length in V_coord units, as server.cost_distance.
+    """
+    if dest != start:
+        if isinstance(parent, dict):
+            if dest not in parent:
+                return None
+        elif parent[dest] < 0:
+            return None
+
+    back = [dest]
+    v = dest
+    while v != start:
+        v = parent[v]
+        back.append(v)
+    back.reverse()
+    return _build(back, V_coord, dist, cost, ids)
+
+
+def finish_path(path, V_coord, cost=None, walk=False):
+    """
+    Returns the Route along path, a list of vertex ids, or the empty
+    Route if path is None.  With walk=True, path may come back to a
+    vertex and the loop in between is cut out, as digraph.compress does.
+    """
+    if path is None:
+        return Route()
+    return _build(path, V_coord, cost=cost, walk=walk)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
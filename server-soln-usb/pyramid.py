@@ -0,0 +1,153 @@
+"""
+Multi-resolution route geometry.
+
+A Pyramid holds the waypoints of one route together with how much each
+matters to its shape.  Running Douglas-Peucker simplification on the
+route once, the importance of a waypoint is the distance from the chord
+it was split off at, capped by the importance of the waypoint whose
+split made that chord.  The ends of the route never go.  Every detail
+level then comes out of the same numbers:
+
+    level(tolerance)   the waypoints Douglas-Peucker keeps at that
+                       tolerance
+    overview(count)    the count waypoints that matter most
+
+and because the caps make importance shrink down the splits, a coarser
+level is always part of every finer one.  The client can show an
+overview first and ask for full detail only where it is looking, with
+segment (between two waypoints of the overview) and within (inside a
+bounding box).
+
+Waypoints always come back as (index, (lat, lon)), with index the
+position of the waypoint in the full route, so that pieces of different
+levels can be fitted together.
+
+>>> route = [(0, 0), (1, 10), (0, 20), (0, 30), (50, 40), (0, 50)]
+>>> p = Pyramid(route)
+>>> p.overview(3)
+[(0, (0, 0)), (4, (50, 40)), (5, (0, 50))]
+>>> [i for (i, coord) in p.level(5)]
+[0, 3, 4, 5]
+>>> p.segment(0, 3)
+[(0, (0, 0)), (1, (1, 10)), (2, (0, 20)), (3, (0, 30))]
+>>> p.within((0, 35, 60, 60))
+[(4, (50, 40)), (5, (0, 50))]
+"""
+
+from array import array
+
+
+def segment_distance(p, a, b):
+    """
+    Distance from point p to the line segment from a to b, in V_coord
+    units.
+
+    >>> segment_distance((5, 5), (0, 0), (0, 10))
+    5.0
+    >>> segment_distance((0, 13), (0, 0), (0, 10))
+    3.0
+    """
+    (dx, dy) = (b[0] - a[0], b[1] - a[1])
+    (px, py) = (p[0] - a[0], p[1] - a[1])
+    length2 = dx * dx + dy * dy
+    if length2:
+        t = (px * dx + py * dy) / length2
+        if t > 1:
+            (px, py) = (p[0] - b[0], p[1] - b[1])
+        elif t > 0:
+            (px, py) = (px - t * dx, py - t * dy)
+    return (px * px + py * py) ** .5
+
+
+def importance(points):
+    """
+    Returns an array('d') with the Douglas-Peucker importance of each
+    of points, infinite for the two ends.
+    """
+    n = len(points)
+    imp = array('d', [0.0]) * n
+    if n == 0:
+        return imp
+    imp[0] = imp[n - 1] = float("inf")
+
+    # chords still to split, as (first, last, cap)
+    todo = [(0, n - 1, float("inf"))]
+    while todo:
+        (i, j, cap) = todo.pop()
+        if j - i < 2:
+            continue
+        (a, b) = (points[i], points[j])
+        (best, k) = (-1.0, i + 1)
+        for m in range(i + 1, j):
+            d = segment_distance(points[m], a, b)
+            if d > best:
+                (best, k) = (d, m)
+        imp[k] = min(best, cap)
+        todo.append((i, k, imp[k]))
+        todo.append((k, j, imp[k]))
+    return imp
+
+
+class Pyramid:
+    """
+    Detail levels of the route points, a list of (lat, lon).  complete
+    is False for a route the search budget cut short, see map.Map.
+    """
+
+    def __init__(self, points, complete=True):
+        self.points = points
+        self.importance = importance(points)
+        self.complete = complete
+
+    def __len__(self):
+        return len(self.points)
+
+    def level(self, tolerance):
+        """
+        Returns the waypoints kept by Douglas-Peucker simplification at
+        tolerance.
+        """
+        imp = self.importance
+        return [(i, p) for (i, p) in enumerate(self.points) if imp[i] > tolerance]
+
+    def overview(self, count):
+        """
+        Returns the count most important waypoints, at least the two
+        ends, in route order.  Ties go to the waypoint nearer the start.
+        Waypoints that do not change the shape of the route at all, such
+        as those in the middle of a straight stretch, are left out.
+
+        >>> Pyramid([(0, 0), (0, 10), (0, 20), (5, 30)]).overview(3)
+        [(0, (0, 0)), (2, (0, 20)), (3, (5, 30))]
+        """
+        imp = self.importance
+        keep = [i for i in range(len(self.points)) if imp[i] > 0]
+        if count < len(keep):
+            keep = sorted(keep, key=lambda i: -imp[i])[:max(count, 2)]
+            keep.sort()
+        return [(i, self.points[i]) for i in keep]
+
+    def segment(self, first, last):
+        """
+        Returns every waypoint from index first to index last, clipped
+        to the route.
+        """
+        first = max(first, 0)
+        last = min(last, len(self.points) - 1)
+        return [(i, self.points[i]) for i in range(first, last + 1)]
+
+    def within(self, bbox):
+        """
+        Returns every waypoint inside bbox = (lat0, lon0, lat1, lon1),
+        edges included.
+        """
+        (lat0, lon0, lat1, lon1) = bbox
+        (lat0, lat1) = (min(lat0, lat1), max(lat0, lat1))
+        (lon0, lon1) = (min(lon0, lon1), max(lon0, lon1))
+        return [(i, (lat, lon)) for (i, (lat, lon)) in enumerate(self.points)
+                if lat0 <= lat <= lat1 and lon0 <= lon <= lon1]
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -1,6 +1,21 @@
+import os
+import struct
 import sys
+from array import array
 
-def read_graph(digraph_file_name):
+import ordering
+
+def read_graph(digraph_file_name, region=None):
+    """
+    Reads the text graph file digraph_file_name and returns
+    (E, E_name, V, V_coord).  Given a region.Region, only the vertices in
+    it are kept, with the edges between them.
+
+    >>> from region import Region
+    >>> (E, E_name, V, V_coord) = read_graph("test.map", Region([(0, 0), (100000, 100000)]))
+    >>> sorted(E), V_coord
+    ([(1, 4)], {1: (0, 0), 4: (100000, 100000)})
+    """
     digraph_file = open(digraph_file_name, 'r')
 
     V = set()
@@ -8,6 +23,12 @@ def read_graph(digraph_file_name):
     V_coord = { }
     E_name = { }
 
+    # vertices left out because they are outside the region
+    outside = set()
+
+    # every edge of a street shares one copy of the street's name
+    names = { }
+
     # process each line in the file
     for line in digraph_file:
 
@@ -27,9 +48,14 @@ def read_graph(digraph_file_name):
             # lat and long are ints
             lat=float(lat)
             long=float(long)
+            coord = (int(lat*100000), int(long*100000))
+
+            if region is not None and not region.contains(*coord):
+                outside.add(id)
+                continue
 
             V.add(id)
-            V_coord[id] = (int(lat*100000), int(long*100000))
+            V_coord[id] = coord
         
         elif type == 'E':
             # got an edge record
@@ -42,6 +68,10 @@ def read_graph(digraph_file_name):
 
             # get rid of leading and trailing quote " chars around name
             name = name.strip('"')
+            name = names.setdefault(name, name)
+
+            if start in outside or stop in outside:
+                continue
 
             # consistency check, we don't want auto adding of vertices when
             # adding an edge.
@@ -99,6 +129,308 @@ def value_search(V_coord, lat, lon):
 
     return key
 
+# Binary graph files
+#
+# A binary graph holds exactly what read_graph returns, but loads without
+# parsing any text.  All numbers are little-endian.  The layout is
+#
+#   header      magic b'EGRF', then version, vertex count, edge count and
+#               street name count as 32 bit unsigned ints
+#   frame       lat0, lon0 and span (int32) of the square the Hilbert
+#               curve is laid over (see ordering.frame), and the cell
+#               level L (uint32)
+#   cells       for each of the 4**L cells of level L along the curve,
+#               the position of its first vertex (uint32, one more than
+#               there are cells), then the same for edges
+#   vertices    ids (int64), then lats (int32), then lons (int32), then
+#               ranks (uint32), in the order of the vertex table
+#   names       byte offsets of each name into the name blob (uint32,
+#               one more than there are names), then the utf-8 blob
+#   edges       start vertex index, stop vertex index, name index (uint32)
+#
+# Vertices are referred to by their position in the vertex table, and
+# each distinct street name is stored once.  write_binary sorts the vertex
+# table along a Hilbert curve (see ordering.py), so a vertex's position is
+# a dense number in which vertices close on the map are close together.
+# The rank of a vertex is its position in the order the vertices were
+# read from the text file, so that reading gives back V_coord in exactly
+# the same order as read_graph does.
+#
+# Edges are sorted by start vertex, so the vertices of a cell, and the
+# edges leaving them, are each one run of every column.  Reading a region
+# (see region.py) only reads the runs of the cells it touches.  A table
+# that is not in curve order has cell level 0: one cell holding it all.
+
+BINARY_MAGIC = b'EGRF'
+BINARY_VERSION = 3
+_HEADER = struct.Struct('<4sIIII')
+_FRAME = struct.Struct('<iiiI')
+
+def _write_array(f, typecode, values):
+    # arrays of the right type are written as they are, without a copy
+    if (not isinstance(values, array) or values.typecode != typecode or
+            sys.byteorder == 'big'):
+        values = array(typecode, values)
+        if sys.byteorder == 'big':
+            values.byteswap()
+    values.tofile(f)
+
+def _read_array(f, typecode, n):
+    a = array(typecode)
+    a.fromfile(f, n)
+    if sys.byteorder == 'big':
+        a.byteswap()
+    return a
+
+def _cell_level(n):
+    # about 256 vertices per cell, up to 4**10 cells
+    level = 0
+    while 4 ** level * 256 < n and level < 10:
+        level += 1
+    return level
+
+def write_binary(file_name, E, E_name, V, V_coord):
+    """
+    Writes the graph returned by read_graph into file_name in the
+    binary graph format, with the vertex table in Hilbert curve order.
+    """
+    read_order = list(V_coord)
+    read_order.extend(v for v in V if v not in V_coord)
+    rank = {v: i for (i, v) in enumerate(read_order)}
+
+    square = ordering.frame(V_coord)
+    level = _cell_level(len(read_order))
+    keys = ordering.curve_keys(V_coord)
+    order = sorted(V_coord, key=keys.__getitem__)
+    order.extend(v for v in V if v not in V_coord)
+    index = {v: i for (i, v) in enumerate(order)}
+
+    # vertices without coordinates are last, in the last cell
+    cells = 4 ** level
+    shift = 2 * (ordering.BITS - level)
+    cell_of = [keys[v] >> shift if v in keys else cells - 1 for v in order]
+    edges = sorted(E, key=lambda e: index[e[0]])
+    vertex_start = array('I', [0]) * (cells + 1)
+    edge_start = array('I', [0]) * (cells + 1)
+    for k in cell_of:
+        vertex_start[k + 1] += 1
+    for e in edges:
+        edge_start[cell_of[index[e[0]]] + 1] += 1
+    for k in range(cells):
+        vertex_start[k + 1] += vertex_start[k]
+        edge_start[k + 1] += edge_start[k]
+
+    names = []
+    name_id = {}
+    for e in edges:
+        name = E_name.get(e, "")
+        if name not in name_id:
+            name_id[name] = len(names)
+            names.append(name)
+
+    write_binary_arrays(file_name, order,
+        (V_coord.get(v, (0, 0))[0] for v in order),
+        (V_coord.get(v, (0, 0))[1] for v in order),
+        names,
+        (index[e[0]] for e in edges),
+        (index[e[1]] for e in edges),
+        (name_id[E_name.get(e, "")] for e in edges),
+        (rank[v] for v in order),
+        (square, level, vertex_start, edge_start))
+
+def write_binary_arrays(file_name, ids, lats, lons, names, starts, stops,
+                        name_ids, ranks=None, cells=None):
+    """
+    Writes a binary graph straight from its columns: vertex ids, lats and
+    lons, the list of distinct street names, and for each edge its start
+    and stop vertex positions and the position of its name in names.
+    ranks gives the read order of each vertex, by default the order of
+    ids.  cells is (frame, level, vertex starts, edge starts) for a
+    table in curve order, by default one cell for everything.  Each
+    column can be any iterable of ints, or an array.
+    """
+    blob = bytearray()
+    offsets = [0]
+    for name in names:
+        blob.extend(name.encode('utf-8'))
+        offsets.append(len(blob))
+
+    if not isinstance(ids, array):
+        ids = array('q', ids)
+    if not isinstance(starts, array):
+        starts = array('I', starts)
+    if ranks is None:
+        ranks = range(len(ids))
+    if cells is None:
+        cells = ((0, 0, 1), 0, [0, len(ids)], [0, len(starts)])
+    ((lat0, lon0, span), level, vertex_start, edge_start) = cells
+
+    with open(file_name, 'wb') as f:
+        f.write(_HEADER.pack(BINARY_MAGIC, BINARY_VERSION,
+                             len(ids), len(starts), len(names)))
+        f.write(_FRAME.pack(lat0, lon0, span, level))
+        _write_array(f, 'I', vertex_start)
+        _write_array(f, 'I', edge_start)
+        _write_array(f, 'q', ids)
+        _write_array(f, 'i', lats)
+        _write_array(f, 'i', lons)
+        _write_array(f, 'I', ranks)
+        _write_array(f, 'I', offsets)
+        f.write(blob)
+        _write_array(f, 'I', starts)
+        _write_array(f, 'I', stops)
+        _write_array(f, 'I', name_ids)
+
+def _region_runs(square, level, vertex_start, edge_start, bounds):
+    """
+    Returns the ((first vertex, end), (first edge, end)) runs of the
+    cells that the box bounds = (lat0, lon0, lat1, lon1) touches.
+    """
+    shift = ordering.BITS - level
+    (x0, y0) = ordering.grid_cell(bounds[0], bounds[1], square)
+    (x1, y1) = ordering.grid_cell(bounds[2], bounds[3], square)
+    keys = sorted(ordering.hilbert_key(x, y, level)
+                  for x in range(x0 >> shift, (x1 >> shift) + 1)
+                  for y in range(y0 >> shift, (y1 >> shift) + 1))
+    runs = []
+    for k in keys:
+        if runs and runs[-1][1] == k:
+            runs[-1][1] = k + 1
+        else:
+            runs.append([k, k + 1])
+    return [((vertex_start[a], vertex_start[b]), (edge_start[a], edge_start[b]))
+            for (a, b) in runs]
+
+def read_binary(file_name, region=None):
+    """
+    Reads a graph written by write_binary and returns
+    (E, E_name, V, V_coord) just as read_graph does.  Given a
+    region.Region, returns only the part of the graph in it, as
+    region.subgraph does, reading only the cells of the file that the
+    region touches.
+
+    >>> import os, tempfile
+    >>> graph = read_graph("test.map")
+    >>> (fd, name) = tempfile.mkstemp()
+    >>> os.close(fd)
+    >>> write_binary(name, *graph)
+    >>> read_binary(name) == graph
+    True
+    >>> list(read_binary(name)[3]) == list(graph[3])
+    True
+    >>> from region import Region
+    >>> read_binary(name, Region([(-100000, -100000), (0, 0)]))
+    ({(1, 2)}, {(1, 2): '1-2'}, {1, 2}, {1: (0, 0), 2: (-100000, -100000)})
+    >>> os.remove(name)
+    """
+    with open(file_name, 'rb') as f:
+        header = f.read(_HEADER.size)
+        if len(header) != _HEADER.size:
+            raise Exception("{} is too short to be a binary graph".format(file_name))
+        (magic, version, nv, ne, nn) = _HEADER.unpack(header)
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            raise Exception("{} is not a version {} binary graph".format(
+                file_name, BINARY_VERSION))
+        (lat0, lon0, span, level) = _FRAME.unpack(f.read(_FRAME.size))
+        vertex_start = _read_array(f, 'I', 4 ** level + 1)
+        edge_start = _read_array(f, 'I', 4 ** level + 1)
+
+        if region is None:
+            ids = _read_array(f, 'q', nv)
+            lats = _read_array(f, 'i', nv)
+            lons = _read_array(f, 'i', nv)
+            ranks = _read_array(f, 'I', nv)
+            offsets = _read_array(f, 'I', nn + 1)
+            blob = f.read(offsets[-1])
+            starts = _read_array(f, 'I', ne)
+            stops = _read_array(f, 'I', ne)
+            name_ids = _read_array(f, 'I', ne)
+            positions = range(nv)
+        else:
+            # where each column starts
+            vertices = f.tell()
+            f.seek(vertices + 20 * nv)
+            offsets = _read_array(f, 'I', nn + 1)
+            blob = f.read(offsets[-1])
+            edges = f.tell()
+
+            def read_run(base, typecode, size, first, end):
+                f.seek(base + size * first)
+                return _read_array(f, typecode, end - first)
+
+            positions = array('l')
+            (ids, lats, lons, ranks) = (array('q'), array('i'), array('i'), array('I'))
+            (starts, stops, name_ids) = (array('I'), array('I'), array('I'))
+            runs = _region_runs((lat0, lon0, span), level, vertex_start,
+                                edge_start, region.bounds())
+            for ((a, b), (c, d)) in runs:
+                positions.extend(range(a, b))
+                ids.extend(read_run(vertices, 'q', 8, a, b))
+                lats.extend(read_run(vertices + 8 * nv, 'i', 4, a, b))
+                lons.extend(read_run(vertices + 12 * nv, 'i', 4, a, b))
+                ranks.extend(read_run(vertices + 16 * nv, 'I', 4, a, b))
+                starts.extend(read_run(edges, 'I', 4, c, d))
+                stops.extend(read_run(edges + 4 * ne, 'I', 4, c, d))
+                name_ids.extend(read_run(edges + 8 * ne, 'I', 4, c, d))
+
+    names = [blob[offsets[i]:offsets[i+1]].decode('utf-8') for i in range(nn)]
+
+    # k is where each vertex read is in ids, lats, lons and ranks
+    kept = {}
+    for (k, p) in enumerate(positions):
+        if region is None or region.contains(lats[k], lons[k]):
+            kept[p] = k
+
+    # kept vertices in read order
+    by_rank = sorted(kept.values(), key=ranks.__getitem__)
+
+    V = {ids[k] for k in by_rank}
+    V_coord = {ids[k]: (lats[k], lons[k]) for k in by_rank}
+    E = set()
+    E_name = {}
+    for (s, t, n) in zip(starts, stops, name_ids):
+        if s in kept and t in kept:
+            e = (ids[kept[s]], ids[kept[t]])
+            E.add(e)
+            E_name[e] = names[n]
+
+    return (E, E_name, V, V_coord)
+
+def load_graph(file_name, cache_name=None, region=None, write=True):
+    """
+    Returns (E, E_name, V, V_coord) for the text graph file_name, using
+    the binary copy cache_name (DEFAULT = file_name + ".bin") when it is
+    at least as new as the text file.  Otherwise the text file is read
+    and, unless write is False, the binary copy is (re)written for next
+    time, if possible.  Given a region.Region, returns only the part of
+    the graph in it.
+    """
+    if cache_name is None:
+        cache_name = file_name + ".bin"
+
+    try:
+        fresh = (not os.path.exists(file_name) or
+            os.path.getmtime(cache_name) >= os.path.getmtime(file_name))
+    except OSError:
+        fresh = False
+
+    if fresh:
+        try:
+            return read_binary(cache_name, region)
+        except Exception:
+            pass
+
+    graph = read_graph(file_name)
+    if write:
+        try:
+            write_binary(cache_name, *graph)
+        except OSError:
+            pass
+    if region is not None:
+        from region import subgraph
+        graph = subgraph(*graph, region)
+    return graph
+
 
 if __name__ == "__main__":
     import doctest
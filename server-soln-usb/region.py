@@ -0,0 +1,147 @@
+"""
+Regions of the map, for loading and serving only part of it.
+
+A Region is either a bounding box or a polygon in V_coord units, grown
+by a margin: a vertex belongs to the region if it is inside the shape
+or within margin of its edge.  The margin keeps roads that leave the
+district for a moment, and the vertices routes near the edge snap to.
+
+The subgraph of a region is the induced one: the vertices in the region
+and every edge with both ends in it.  Regions can be given to
+readModule.read_graph, readModule.load_graph and readModule.read_binary
+to load just that part of a map; from a binary graph file only the
+cells of the file the region touches are read at all.
+
+>>> box = Region([(0, 0), (100, 100)])
+>>> box.contains(50, 50), box.contains(150, 50)
+(True, False)
+>>> Region([(0, 0), (100, 100)], margin=60).contains(150, 50)
+True
+>>> triangle = Region([(0, 0), (0, 100), (100, 0)])
+>>> triangle.contains(10, 10), triangle.contains(90, 90)
+(True, False)
+>>> triangle.bounds()
+(0, 0, 100, 100)
+>>> V_coord = {1: (0, 0), 2: (50, 50), 3: (500, 500)}
+>>> E = {(1, 2), (2, 3)}
+>>> subgraph(E, {(1, 2): "A", (2, 3): "B"}, set(V_coord), V_coord, box)
+({(1, 2)}, {(1, 2): 'A'}, {1, 2}, {1: (0, 0), 2: (50, 50)})
+"""
+
+import pyramid
+
+
+class Region:
+    """
+    points is either two opposite corners (lat, lon) of a bounding box,
+    or three or more corners of a polygon, in order around it.  margin
+    is in V_coord units.
+    """
+
+    def __init__(self, points, margin=0):
+        points = [tuple(p) for p in points]
+        if len(points) < 2:
+            raise ValueError("a region needs at least 2 points, got {}".format(
+                len(points)))
+        if margin < 0:
+            raise ValueError("margin must not be negative, got {}".format(margin))
+        self.margin = margin
+        if len(points) == 2:
+            ((a, b), (c, d)) = points
+            self.box = (min(a, c), min(b, d), max(a, c), max(b, d))
+            self.polygon = None
+        else:
+            lats = [p[0] for p in points]
+            lons = [p[1] for p in points]
+            self.box = (min(lats), min(lons), max(lats), max(lons))
+            self.polygon = points
+
+    @classmethod
+    def parse(cls, text, margin=0):
+        """
+        Makes a Region from text of "lat,lon" points separated by
+        spaces, as given on the command line.
+
+        >>> Region.parse("5350000,-11360000 5360000,-11340000").box
+        (5350000, -11360000, 5360000, -11340000)
+        """
+        try:
+            points = [tuple(int(x) for x in p.split(',')) for p in text.split()]
+        except ValueError:
+            raise ValueError("bad region {!r}, expected lat,lon points".format(text))
+        if any(len(p) != 2 for p in points):
+            raise ValueError("bad region {!r}, expected lat,lon points".format(text))
+        return cls(points, margin)
+
+    def bounds(self):
+        """
+        Returns (lat0, lon0, lat1, lon1), the bounding box of the region
+        with its margin.
+        """
+        (a, b, c, d) = self.box
+        m = self.margin
+        return (a - m, b - m, c + m, d + m)
+
+    def _inside(self, lat, lon):
+        (a, b, c, d) = self.box
+        if not (a <= lat <= c and b <= lon <= d):
+            return False
+        if self.polygon is None:
+            return True
+        # count crossings of a ray going north from the point
+        inside = False
+        points = self.polygon
+        (plat, plon) = points[-1]
+        for (qlat, qlon) in points:
+            if (qlon > lon) != (plon > lon):
+                cross = plat + (lon - plon) * (qlat - plat) / (qlon - plon)
+                if cross > lat:
+                    inside = not inside
+            (plat, plon) = (qlat, qlon)
+        return inside
+
+    def _near_edge(self, lat, lon):
+        p = (lat, lon)
+        if self.polygon is None:
+            (a, b, c, d) = self.box
+            corners = [(a, b), (a, d), (c, d), (c, b)]
+        else:
+            corners = self.polygon
+        prev = corners[-1]
+        for q in corners:
+            if pyramid.segment_distance(p, prev, q) <= self.margin:
+                return True
+            prev = q
+        return False
+
+    def contains(self, lat, lon):
+        """
+        True if (lat, lon) is in the region or within margin of it.
+        """
+        if self._inside(lat, lon):
+            return True
+        if not self.margin:
+            return False
+        (a, b, c, d) = self.bounds()
+        if not (a <= lat <= c and b <= lon <= d):
+            return False
+        return self._near_edge(lat, lon)
+
+
+def subgraph(E, E_name, V, V_coord, region):
+    """
+    Returns the part of the graph (E, E_name, V, V_coord), as returned
+    by readModule.read_graph, inside region: its vertices and the edges
+    with both ends among them.  V_coord keeps its order.
+    """
+    contains = region.contains
+    sub_coord = {v: c for (v, c) in V_coord.items() if contains(c[0], c[1])}
+    sub_E = {e for e in E if e[0] in sub_coord and e[1] in sub_coord}
+    sub_E_name = {e: name for (e, name) in E_name.items() if e in sub_E}
+    sub_V = {v for v in V if v in sub_coord}
+    return (sub_E, sub_E_name, sub_V, sub_coord)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,224 @@
+"""
+Persistent route store.
+
+Routes that have been found once are kept in a sqlite database, so they
+survive server restarts and are shared by every process that opens the
+same file.  A route is keyed on
+
+    graph     a hash of the graph file, so a changed map never serves
+              stale routes
+    model     the name of the cost model the route was found with
+    start, dest
+              the snapped vertices
+
+and stored as a compact byte string: the vertex ids as zig-zag varint
+deltas from the previous id, see encode_path.  A NULL path records that
+there is no route.  hit() counts a request for a route, however it was
+answered; the counts are kept in memory and written in batches, so
+counting adds no database write per request.  warm() hands back the
+most requested routes so a new process can start with them in memory.
+
+sqlite's write-ahead log lets several processes read while one writes,
+and writers wait up to timeout seconds for each other.
+
+>>> store = RouteStore(":memory:")
+>>> store.put("g", "distance", 1, 3, [1, 2, 3])
+>>> store.get("g", "distance", 1, 3)
+[1, 2, 3]
+>>> store.get("g", "distance", 3, 1) is None
+True
+>>> store.put("g", "distance", 3, 1, None)
+>>> store.get("g", "distance", 3, 1, missing="never stored") is None
+True
+>>> for i in range(3):
+...     store.hit("g", "distance", 3, 1)
+>>> store.hit("g", "distance", 1, 3)
+>>> store.warm("g", "distance", 10)
+{(3, 1): None, (1, 3): [1, 2, 3]}
+>>> store.close()
+"""
+
+import hashlib
+import sqlite3
+import threading
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS routes (
+    graph TEXT NOT NULL,
+    model TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    dest INTEGER NOT NULL,
+    path BLOB,
+    hits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (graph, model, start, dest)
+)
+"""
+
+
+def encode_path(path):
+    """
+    Encodes a list of integer vertex ids as bytes: each id is written as
+    its difference from the one before, zig-zag mapped to a
+    non-negative number, in 7 bit groups.
+
+    >>> encode_path([277466945, 277466943, 277466942])
+    b'\\x82\\xbd\\xce\\x88\\x02\\x03\\x01'
+    >>> decode_path(encode_path([5, -3, 300, 300]))
+    [5, -3, 300, 300]
+    """
+    out = bytearray()
+    prev = 0
+    for v in path:
+        d = v - prev
+        prev = v
+        z = (d << 1) if d >= 0 else ((-d << 1) - 1)
+        while z >= 0x80:
+            out.append((z & 0x7f) | 0x80)
+            z >>= 7
+        out.append(z)
+    return bytes(out)
+
+
+def decode_path(data):
+    """
+    Inverse of encode_path.
+    """
+    path = []
+    prev = 0
+    z = 0
+    shift = 0
+    for b in data:
+        z |= (b & 0x7f) << shift
+        if b & 0x80:
+            shift += 7
+            continue
+        d = (z >> 1) if not (z & 1) else -((z + 1) >> 1)
+        prev += d
+        path.append(prev)
+        z = 0
+        shift = 0
+    return path
+
+
+def file_hash(file_name):
+    """
+    Returns the sha1 hex digest of the contents of file_name.
+    """
+    h = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class RouteStore:
+    """
+    sqlite backed route store.  One RouteStore can be shared by the
+    threads of a process; each process should open its own.  Hits are
+    written out every flush_every hits, and by warm, flush and close.
+    """
+
+    def __init__(self, file_name, timeout=5.0, flush_every=256):
+        self.db = sqlite3.connect(file_name, timeout=timeout,
+                                  check_same_thread=False,
+                                  isolation_level=None)
+        self.lock = threading.Lock()
+        self.flush_every = flush_every
+        # hits not yet written, by (graph, model, start, dest)
+        self._hits = {}
+        self._pending = 0
+        with self.lock:
+            if file_name != ":memory:":
+                self.db.execute("PRAGMA journal_mode=WAL")
+                self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(_SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.db.close()
+
+    def hit(self, graph, model, start, dest):
+        """
+        Counts a request for the route from start to dest.
+        """
+        key = (graph, model, start, dest)
+        with self.lock:
+            self._hits[key] = self._hits.get(key, 0) + 1
+            self._pending += 1
+            if self._pending >= self.flush_every:
+                self._flush()
+
+    def flush(self):
+        """
+        Writes the hits counted so far to the database.
+        """
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        # the caller holds self.lock; hits for routes that were never
+        # stored are dropped
+        if not self._hits:
+            return
+        rows = [(n,) + key for (key, n) in self._hits.items()]
+        self._hits = {}
+        self._pending = 0
+        self.db.execute("BEGIN")
+        try:
+            self.db.executemany(
+                "UPDATE routes SET hits = hits + ? WHERE graph=? AND model=? "
+                "AND start=? AND dest=?", rows)
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    def get(self, graph, model, start, dest, missing=None):
+        """
+        Returns the stored path from start to dest (None if it is known
+        that there is no route), or missing if the route was never
+        stored.
+        """
+        key = (graph, model, start, dest)
+        with self.lock:
+            row = self.db.execute(
+                "SELECT path FROM routes WHERE graph=? AND model=? "
+                "AND start=? AND dest=?", key).fetchone()
+        if row is None:
+            return missing
+        if row[0] is None:
+            return None
+        return decode_path(row[0])
+
+    def put(self, graph, model, start, dest, path):
+        """
+        Stores path (None for no route) from start to dest.  Storing a
+        route that is already there keeps its hit count.
+        """
+        data = None if path is None else encode_path(path)
+        with self.lock:
+            self.db.execute(
+                "INSERT INTO routes (graph, model, start, dest, path, hits) "
+                "VALUES (?, ?, ?, ?, ?, 0) "
+                "ON CONFLICT (graph, model, start, dest) "
+                "DO UPDATE SET path = excluded.path",
+                (graph, model, start, dest, data))
+
+    def warm(self, graph, model, limit):
+        """
+        Returns {(start, dest): path} for the limit most requested
+        routes of graph and model, most requested first.
+        """
+        with self.lock:
+            self._flush()
+            rows = self.db.execute(
+                "SELECT start, dest, path FROM routes WHERE graph=? AND model=? "
+                "ORDER BY hits DESC LIMIT ?", (graph, model, limit)).fetchall()
+        return {(start, dest): (None if data is None else decode_path(data))
+                for (start, dest, data) in rows}
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
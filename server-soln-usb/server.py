@@ -1,9 +1,13 @@
-import digraph
-import readModule
-import dijkstra
+import time
+started = time.perf_counter()
+
+from map import Map
+import postprocess
+import os
 import sys
-import serial
 import argparse
+import queue
+import threading
 
 global debug
 debug = False
@@ -83,13 +87,15 @@ def send(serial_port, message):
     serial_port.write(reencoded)
 
 
-def receive(serial_port, timeout=None):
+def receive(serial_port):
     """
-    Listen for a message. Attempt to timeout after a certain number of
-    milliseconds.
+    Listen for a message, waiting for a whole line.  Returns None if the
+    port has closed.
     """
     raw_message = serial_port.readline()
     debug and print("client:", raw_message, ":")
+    if not raw_message:
+        return None
     message = raw_message.decode('ascii')
     return message.rstrip("\n\r")
 
@@ -103,6 +109,16 @@ def parse_args():
              serialport -- str
              verbose    -- bool
              graphname  -- str
+             pipeline   -- bool
+             depth      -- int
+             store      -- str
+             warm       -- int
+             region     -- str
+             margin     -- int
+             max_settled -- int
+             max_time   -- float
+             partial    -- bool
+             profiles   -- str
     """
 
     parser = argparse.ArgumentParser(
@@ -119,58 +135,420 @@ def parse_args():
                         help='path to graph (DEFAULT = " edmonton-roads-2.0.1.txt")',
                         dest='graphname',
                         default=' edmonton-roads-2.0.1.txt')
+    parser.add_argument('-p', '--pipeline',
+                        help='read, route and write requests concurrently',
+                        dest='pipeline',
+                        action='store_true')
+    parser.add_argument('--depth',
+                        help='requests queued between pipeline stages (DEFAULT = 4)',
+                        dest='depth',
+                        type=int,
+                        default=4)
+    parser.add_argument('--store',
+                        help='sqlite file to keep found routes in across runs',
+                        dest='store',
+                        default=None)
+    parser.add_argument('--warm',
+                        help='most requested stored routes to load at startup (DEFAULT = 256)',
+                        dest='warm',
+                        type=int,
+                        default=256)
+    parser.add_argument('--region',
+                        help='only load the map inside this box or polygon, '
+                             'given as "lat,lon lat,lon ..." in map units',
+                        dest='region',
+                        default=None)
+    parser.add_argument('--margin',
+                        help='also load this far around --region, in map units (DEFAULT = 0)',
+                        dest='margin',
+                        type=int,
+                        default=0)
+    parser.add_argument('--max-settled',
+                        help='give up a route search after settling this many '
+                             'vertices (DEFAULT = no limit)',
+                        dest='max_settled',
+                        type=int,
+                        default=None)
+    parser.add_argument('--max-time',
+                        help='give up a route search after this many '
+                             'milliseconds (DEFAULT = no limit)',
+                        dest='max_time',
+                        type=float,
+                        default=None)
+    parser.add_argument('--partial',
+                        help='when a search gives up, answer with the route '
+                             'as far as it got, marked partial, instead of '
+                             '"0 budget"',
+                        dest='partial',
+                        action='store_true')
+    parser.add_argument('--profiles',
+                        help='speed profile file for requests with a departure '
+                             'time (DEFAULT = free flow speed everywhere)',
+                        dest='profiles',
+                        default=None)
     return parser.parse_args()
 
+def check_args(args):
+    """
+    Returns what is wrong with the arguments, or None if the server can
+    start with them.  Nothing here is slow, so mistakes show up at once
+    rather than after the graph has loaded.
+    """
+    if not args.serialport:
+        return "No serial port.  Supply one with the -s port option"
+    if not (os.path.isfile(args.graphname) or
+            os.path.isfile(args.graphname + ".bin")):
+        return "No graph file {}".format(args.graphname)
+    if args.depth < 1:
+        return "--depth must be at least 1"
+    if args.warm < 0:
+        return "--warm must not be negative"
+    if args.max_settled is not None and args.max_settled < 1:
+        return "--max-settled must be at least 1"
+    if args.max_time is not None and args.max_time <= 0:
+        return "--max-time must be positive"
+    if args.profiles is not None and not os.path.isfile(args.profiles):
+        return "No profile file {}".format(args.profiles)
+    if args.region is not None:
+        from region import Region
+        try:
+            Region.parse(args.region, args.margin)
+        except ValueError as e:
+            return str(e)
+    return None
+
 #dumbserver code ends here
 
-if __name__ == "__main__":
-    args = parse_args()
-    
-    # load the Edmonton map data into a digraph object, and store the
-    # ancillary information about street names and vertex locations
-    (E, E_name, V, V_coord) = readModule.read_graph(args.graphname)
-    G = digraph.Digraph(E)
-
-    # Initialize some stuff...
-    if args.serialport:
-        print("Opening serial port: %s" % args.serialport)
-        serial_out = serial_in =  serial.Serial(args.serialport, 9600)
-    else:
-        print("No serial port.  Supply one with the -s port option")
-        exit()
+def load_map(args, loaded):
+    """
+    Loads the map named in args, meant to run in a thread while the
+    serial port opens.  Puts the Map in loaded["map"], with its spatial
+    index and components already built so the first request does not
+    wait for them, and a list of (step, seconds) in loaded["times"].
+    If loading fails the exception goes in loaded["error"] instead.
+    """
+    times = loaded["times"] = []
+    try:
+        t = time.perf_counter()
+        store = None
+        if args.store:
+            import routestore
+            store = routestore.RouteStore(args.store)
+        region = None
+        if args.region is not None:
+            from region import Region
+            region = Region.parse(args.region, args.margin)
+        max_seconds = None
+        if args.max_time is not None:
+            max_seconds = args.max_time / 1000
+        roadmap = Map(args.graphname, store=store, region=region,
+                      max_settled=args.max_settled, max_seconds=max_seconds,
+                      partial=args.partial, profiles=args.profiles)
+        times.append(("graph", time.perf_counter() - t))
 
-    if args.verbose:
-        debug = True
-    else:
-        debug = False
+        if args.profiles is not None:
+            t = time.perf_counter()
+            roadmap.profiles
+            times.append(("profiles", time.perf_counter() - t))
+
+        t = time.perf_counter()
+        roadmap.index
+        roadmap.components
+        times.append(("indexes", time.perf_counter() - t))
+
+        if store is not None:
+            t = time.perf_counter()
+            n = roadmap.warm(args.warm)
+            times.append(("{} warm routes".format(n), time.perf_counter() - t))
+        loaded["map"] = roadmap
+    except Exception as e:
+        loaded["error"] = e
+
+def parse_route(msg):
+    """
+    Returns the ((lat, lon), (lat, lon)) ends of a "lat lon lat lon"
+    request, or None if msg is not one.
+
+    >>> parse_route("5356386 -11350854 5351786 -11349738")
+    ((5356386, -11350854), (5351786, -11349738))
+    """
+    fields = msg.split(' ')
+    if len(fields) != 4:
+        return None
+    try:
+        (start_lat, start_lon, dest_lat, dest_lon) = (int(f) for f in fields)
+    except ValueError:
+        return None
+    return ((start_lat, start_lon), (dest_lat, dest_lon))
+
+def route(roadmap, msg):
+    """
+    Answers one "lat lon lat lon" request with the list of (lat, lon)
+    waypoints of the route, or returns None if msg is not a request.
+
+    >>> m = Map("test.map", cache=False)
+    >>> route(m, "-99000 -101000 100000 100000")
+    [(-100000, -100000), (-100000, 100000), (100000, 100000)]
+    >>> print(route(m, "hello"))
+    None
+    """
+    ends = parse_route(msg)
+    if ends is None:
+        return None
+    return roadmap.get_path(*ends)
+
+def format_path(path):
+    """
+    Returns the whole response for a route as one message: the number
+    of waypoints, then one "lat lon" line per waypoint.
+
+    >>> print(format_path([(5356380, -11350856), (5356375, -11350848)]))
+    2
+    5356380 -11350856
+    5356375 -11350848
+    >>> format_path([])
+    '0'
+    """
+    lines = [str(len(path))]
+    lines.extend('{} {}'.format(lat, lon) for (lat, lon) in path)
+    return '\n'.join(lines)
+
+def format_waypoints(points, complete=True):
+    """
+    Returns the response for part of a route at some level of detail:
+    the number of waypoints, then a "lat lon index" line per waypoint,
+    where index is the position of the waypoint in the full route.  The
+    first line says whether the route is complete, as for a plain
+    request, see postprocess.header.
+
+    >>> print(format_waypoints([(0, (5356380, -11350856)), (7, (5356375, -11350848))]))
+    2
+    5356380 -11350856 0
+    5356375 -11350848 7
+    >>> print(format_waypoints([(0, (5356380, -11350856))], complete=False))
+    1 partial
+    5356380 -11350856 0
+    """
+    lines = [postprocess.header(len(points), complete)]
+    lines.extend('{} {} {}'.format(lat, lon, i) for (i, (lat, lon)) in points)
+    return '\n'.join(lines)
+
+# the commands for a route at some level of detail, and how many numbers
+# follow the start and destination coordinates of the route
+DETAIL_COMMANDS = {
+    'O': 1,     # overview: at most count waypoints
+    'S': 2,     # segment: every waypoint from index first to last
+    'B': 4,     # bounding box: every waypoint in lat0 lon0 lat1 lon1
+}
+
+def answer(roadmap, msg):
+    """
+    Returns the whole response to msg, or None if msg is not a request.
+    The plain "lat lon lat lon" route request may have a fifth number,
+    the departure time in seconds after midnight, for the quickest
+    route at that time under the speed profiles (see timedep.py).
+    Besides it there are requests for a route at some level of detail,
+    answered from a pyramid.Pyramid of the route:
+
+        O lat lon lat lon count
+        S lat lon lat lon first last
+        B lat lon lat lon lat0 lon0 lat1 lon1
+
+    where the first four numbers give the route as in a plain request.
+    A client can ask for an overview first and then, without the server
+    remembering anything about it, for the full detail of a stretch
+    between two overview waypoints or of what is on screen.
 
+    When a search budget is set (--max-settled, --max-time) the first
+    line of the answer is "0 budget" if the search gave up, and "N
+    partial" for the route as far as it got with --partial, see
+    postprocess.header.
 
+    >>> m = Map("test.map", cache=False)
+    >>> print(answer(m, "-99000 -101000 100000 100000"))
+    3
+    -100000 -100000
+    -100000 100000
+    100000 100000
+    >>> print(answer(m, "-99000 -101000 100000 100000 28800"))
+    3
+    -100000 -100000
+    -100000 100000
+    100000 100000
+    >>> print(answer(m, "O -99000 -101000 100000 100000 2"))
+    2
+    -100000 -100000 0
+    100000 100000 2
+    >>> print(answer(m, "S -99000 -101000 100000 100000 1 1"))
+    1
+    -100000 100000 1
+    >>> print(answer(m, "B -99000 -101000 100000 100000 -100000 0 100000 100000"))
+    2
+    -100000 100000 1
+    100000 100000 2
+    >>> print(answer(m, "S 1 2 3 4"))
+    None
+    >>> print(answer(Map("test.map", cache=False, max_settled=1),
+    ...              "-99000 -101000 100000 100000"))
+    0 budget
+    """
+    fields = msg.split(' ')
+    if fields[0] not in DETAIL_COMMANDS:
+        departure = None
+        if len(fields) == 5:
+            try:
+                departure = int(fields[4])
+            except ValueError:
+                return None
+            msg = ' '.join(fields[:4])
+        ends = parse_route(msg)
+        if ends is None:
+            return None
+        if departure is None:
+            r = roadmap.get_route(*ends)
+        else:
+            r = roadmap.get_td_route(ends[0], ends[1], departure)
+        if not r.complete:
+            debug and print("over budget:", msg, file=sys.stderr)
+        return r.text()
+
+    command = fields[0]
+    if len(fields) != 5 + DETAIL_COMMANDS[command]:
+        return None
+    try:
+        numbers = [int(f) for f in fields[1:]]
+    except ValueError:
+        return None
+    p = roadmap.get_pyramid(tuple(numbers[0:2]), tuple(numbers[2:4]))
+    args = numbers[4:]
+    if command == 'O':
+        points = p.overview(args[0])
+    elif command == 'S':
+        points = p.segment(args[0], args[1])
+    else:
+        points = p.within(args)
+    return format_waypoints(points, p.complete)
+
+def serve(roadmap, serial_in, serial_out):
+    """
+    Answers requests from serial_in on serial_out until the port closes.
+    Each answer is the number of waypoints on one line followed by a
+    line per waypoint, written to the port in one go, see answer.
+    """
     while True:
         # look for input of lat/lon
-        
         msg = receive(serial_in)
+        if msg is None:
+            break
         debug and print("GOT:" + msg + ":", file=sys.stderr)
-        fields = msg.split(' ');
-        if len(fields) != 4:
-            continue;
-        (start_lat, start_lon, dest_lat, dest_lon) = fields;
-        # send(serial_out, "2")
-        # send(serial_out, fields[0]+" "+fields[1])
-        # send(serial_out, fields[2]+" "+fields[3])
-
-        start = readModule.value_search(V_coord, int(start_lat), int(start_lon))
-        dest = readModule.value_search(V_coord, int(dest_lat), int(dest_lon))
-        
-        # find least_cost_path
-        path = dijkstra.least_cost_path(G, start, dest, cost_distance)
-        send(serial_out, str(len(path)))
-        # print(total_distance(path, cost_distance))
-        
-        # print path in "lat lon" format
-        if path is not None:
-            for vertex in path:
-                waypoint = V_coord[vertex]
-                send(serial_out, str(waypoint[0]) + ' ' + str(waypoint[1]))
-                
-    # import doctest
-    # doctest.testmod()
+        response = answer(roadmap, msg)
+        if response is None:
+            continue
+
+        send(serial_out, response)
+
+def serve_pipelined(roadmap, serial_in, serial_out, depth=4):
+    """
+    Like serve, but reading requests, finding routes and writing answers
+    happen in three threads joined by queues of at most depth entries.
+    While one answer trickles out over the serial line the next request
+    is already being read and routed.  Answers go out in request order.
+
+    Returns when serial_in closes or reading from it fails, once
+    everything already read has been answered.  A request that fails
+    while being routed is answered "0", as if there were no route.
+    """
+    requests = queue.Queue(depth)
+    answers = queue.Queue(depth)
+    done = object()
+
+    def reader():
+        try:
+            while True:
+                msg = receive(serial_in)
+                if msg is None:
+                    break
+                debug and print("GOT:" + msg + ":", file=sys.stderr)
+                requests.put(msg)
+        except Exception as e:
+            debug and print("reader stopped:", e, file=sys.stderr)
+        finally:
+            requests.put(done)
+
+    def router():
+        try:
+            while True:
+                msg = requests.get()
+                if msg is done:
+                    return
+                try:
+                    response = answer(roadmap, msg)
+                except Exception as e:
+                    # answer "no route" rather than leave the client waiting
+                    print("routing", repr(msg), "failed:", e, file=sys.stderr)
+                    response = "0"
+                if response is not None:
+                    answers.put(response)
+        finally:
+            answers.put(done)
+
+    threads = [threading.Thread(target=reader, daemon=True),
+               threading.Thread(target=router, daemon=True)]
+    for t in threads:
+        t.start()
+
+    while True:
+        message = answers.get()
+        if message is done:
+            break
+        send(serial_out, message)
+
+if __name__ == "__main__":
+    imported = time.perf_counter()
+    args = parse_args()
+    problem = check_args(args)
+    if problem:
+        print(problem)
+        sys.exit(1)
+    debug = args.verbose
+    checked = time.perf_counter()
+
+    # load the map data into a Map, which also holds the ancillary
+    # information about street names and vertex locations, while the
+    # serial port opens
+    loaded = {}
+    loader = threading.Thread(target=load_map, args=(args, loaded), daemon=True)
+    loader.start()
+
+    print("Opening serial port: %s" % args.serialport)
+    try:
+        import serial
+        serial_out = serial_in = serial.Serial(args.serialport, 9600)
+    except Exception as e:
+        print("Could not open serial port {}: {}".format(args.serialport, e))
+        sys.exit(1)
+    opened = time.perf_counter()
+
+    loader.join()
+    if "error" in loaded:
+        print("Could not load {}: {}".format(args.graphname, loaded["error"]))
+        sys.exit(1)
+    roadmap = loaded["map"]
+    (G, V_coord) = (roadmap.G, roadmap.V_coord)
+    ready = time.perf_counter()
+
+    print("Startup: imports {:.3f}s, arguments {:.3f}s, serial port {:.3f}s".format(
+        imported - started, checked - imported, opened - checked))
+    print("  in the background: " + ", ".join(
+        "{} {:.3f}s".format(step, seconds) for (step, seconds) in loaded["times"]))
+    print("Ready after {:.3f}s".format(ready - started))
+
+    try:
+        if args.pipeline:
+            serve_pipelined(roadmap, serial_in, serial_out, args.depth)
+        else:
+            serve(roadmap, serial_in, serial_out)
+    finally:
+        if roadmap.store is not None:
+            # writes out the hits not yet flushed
+            roadmap.store.close()
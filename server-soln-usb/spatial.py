@@ -0,0 +1,259 @@
+"""
+Spatial index over vertex coordinates.
+
+The server snaps every requested lat/lon onto the nearest vertex of the
+road graph.  readModule.value_search does this with a linear scan of
+V_coord, which is fine for one point but O(N*V) for a whole GPS trace or
+a batch of matrix inputs.
+
+GridIndex buckets the vertices into square cells of the scaled lat/lon
+plane (the same integer units as V_coord, 1e-5 degrees) and answers
+nearest vertex queries by searching rings of cells outward from the
+query until no closer vertex can exist.
+
+Results follow the same rules as value_search:
+    - a vertex sitting exactly on the query point wins, and if several
+      do, the one that comes last in V_coord order is returned
+    - otherwise the closest vertex by straight-line distance wins, and
+      ties go to the one that comes first in V_coord order
+
+>>> V_coord = {1: (2,2), 2:(3,4), 3:(6,2), 4:(53, -113)}
+>>> idx = GridIndex(V_coord, cell_size=4)
+>>> idx.nearest(3, 4)
+(2, 0.0)
+>>> idx.nearest(1000, 1000)[0]
+3
+>>> idx.snap_many([3, -1000, 11], [2, -1000, 11])
+([1, 4, 3], [1.0, 1376.7999128413685, 10.295630140987])
+"""
+
+from array import array
+
+
+class GridIndex:
+    """
+    Uniform grid over the scaled coordinates of V_coord.
+
+    cell_size is the side of a grid cell in V_coord units.  The default
+    of 200 (about 200 m north-south around Edmonton) keeps a handful of
+    road vertices in each cell.
+
+    >>> idx = GridIndex({1: (0, 0), 2: (0, 10), 3: (10, 10)}, cell_size=5)
+    >>> len(idx)
+    3
+    >>> idx.nearest(4, 9)
+    (2, 4.123105625617661)
+    >>> idx.within(0, 0, 10)
+    [(1, 0.0), (2, 10.0)]
+    >>> GridIndex({}).nearest(0, 0)
+    (0, inf)
+    """
+
+    def __init__(self, V_coord, cell_size=200):
+        if cell_size <= 0:
+            raise ValueError("cell_size must be positive, got {}".format(cell_size))
+        self.cell_size = cell_size
+
+        # _cells[(cx, cy)] holds parallel arrays of vertex ids, lats, lons
+        # and the position of the vertex in V_coord iteration order, which
+        # is what value_search uses to break ties.
+        cells = {}
+        for (rank, (v, (lat, lon))) in enumerate(V_coord.items()):
+            key = (lat // cell_size, lon // cell_size)
+            if key not in cells:
+                cells[key] = (array('q'), array('q'), array('q'), array('q'))
+            (ids, lats, lons, ranks) = cells[key]
+            ids.append(v)
+            lats.append(lat)
+            lons.append(lon)
+            ranks.append(rank)
+        self._cells = cells
+        self._size = len(V_coord)
+
+        if cells:
+            self._xmin = min(k[0] for k in cells)
+            self._xmax = max(k[0] for k in cells)
+            self._ymin = min(k[1] for k in cells)
+            self._ymax = max(k[1] for k in cells)
+
+    def __len__(self):
+        return self._size
+
+    def _ring(self, cx, cy, r):
+        """
+        Yields the non-empty cells at Chebyshev distance r from (cx, cy),
+        clipped to the occupied extent of the grid.
+        """
+        cells = self._cells
+        if r == 0:
+            if (cx, cy) in cells:
+                yield cells[(cx, cy)]
+            return
+
+        x0 = max(cx - r, self._xmin)
+        x1 = min(cx + r, self._xmax)
+        y0 = max(cy - r + 1, self._ymin)
+        y1 = min(cy + r - 1, self._ymax)
+
+        # far outside a sparse grid the ring is mostly empty cells, and
+        # looking at the occupied ones is cheaper
+        if (x1 - x0) + (y1 - y0) > len(cells):
+            for ((x, y), cell) in cells.items():
+                if max(abs(x - cx), abs(y - cy)) == r:
+                    yield cell
+            return
+
+        # top and bottom rows, including corners
+        for y in (cy - r, cy + r):
+            if self._ymin <= y <= self._ymax:
+                for x in range(x0, x1 + 1):
+                    if (x, y) in cells:
+                        yield cells[(x, y)]
+
+        # left and right columns, without corners
+        for x in (cx - r, cx + r):
+            if self._xmin <= x <= self._xmax:
+                for y in range(y0, y1 + 1):
+                    if (x, y) in cells:
+                        yield cells[(x, y)]
+
+    def _ring_bounds(self, cx, cy):
+        """
+        Returns (first, last) ring numbers around (cx, cy) that can
+        contain an occupied cell.
+        """
+        dx = max(self._xmin - cx, 0, cx - self._xmax)
+        dy = max(self._ymin - cy, 0, cy - self._ymax)
+        first = max(dx, dy)
+        last = max(cx - self._xmin, self._xmax - cx,
+                   cy - self._ymin, self._ymax - cy)
+        return (first, last)
+
+    def nearest(self, lat, lon):
+        """
+        Returns (vertex, distance) for the vertex nearest to the scaled
+        point (lat, lon).  An empty index returns (0, inf), just as
+        value_search returns key 0 when there is nothing to find.
+        """
+        if not self._size:
+            return (0, float("inf"))
+
+        size = self.cell_size
+        cx = lat // size
+        cy = lon // size
+        (first, last) = self._ring_bounds(cx, cy)
+
+        best = None
+        best_d2 = None
+        best_rank = None
+        for r in range(first, last + 1):
+            # every vertex in ring r is further than (r-1)*size away
+            if best is not None and r > 0:
+                reach = (r - 1) * size
+                if best_d2 <= reach * reach:
+                    break
+
+            for (ids, lats, lons, ranks) in self._ring(cx, cy, r):
+                for i in range(len(ids)):
+                    dlat = lat - lats[i]
+                    dlon = lon - lons[i]
+                    d2 = dlat * dlat + dlon * dlon
+                    if best is None or d2 < best_d2:
+                        better = True
+                    elif d2 == best_d2:
+                        # exact hits keep the last one, others the first one
+                        if d2 == 0:
+                            better = ranks[i] > best_rank
+                        else:
+                            better = ranks[i] < best_rank
+                    else:
+                        better = False
+                    if better:
+                        best = ids[i]
+                        best_d2 = d2
+                        best_rank = ranks[i]
+
+        return (best, best_d2 ** .5)
+
+    def within(self, lat, lon, radius):
+        """
+        Returns a list of (vertex, distance) for every vertex within
+        radius of (lat, lon), closest first.
+        """
+        if not self._size:
+            return []
+
+        size = self.cell_size
+        cx = lat // size
+        cy = lon // size
+        (first, last) = self._ring_bounds(cx, cy)
+        last = min(last, int(radius // size) + 1)
+        r2 = radius * radius
+
+        found = []
+        for r in range(first, last + 1):
+            for (ids, lats, lons, ranks) in self._ring(cx, cy, r):
+                for i in range(len(ids)):
+                    dlat = lat - lats[i]
+                    dlon = lon - lons[i]
+                    d2 = dlat * dlat + dlon * dlon
+                    if d2 <= r2:
+                        found.append((d2, ranks[i], ids[i]))
+        found.sort()
+        return [(v, d2 ** .5) for (d2, rank, v) in found]
+
+    def snap_many(self, lats, lons):
+        """
+        Bulk version of nearest.  lats and lons are equal length
+        sequences of scaled coordinates.  Returns (vertices, distances)
+        as two lists in the order of the input.
+
+        Queries are answered in cell order so that consecutive lookups
+        touch the same buckets, and repeated points (common in GPS traces
+        that sit still) are only searched once.
+
+        >>> idx = GridIndex({1: (0, 0), 2: (0, 10)}, cell_size=5)
+        >>> idx.snap_many([0, 1, 0], [9, 1, 9])
+        ([2, 1, 2], [1.0, 1.4142135623730951, 1.0])
+        >>> idx.snap_many([1], [2, 3])
+        Traceback (most recent call last):
+        ...
+        ValueError: got 1 latitudes but 2 longitudes
+        """
+        if len(lats) != len(lons):
+            raise ValueError("got {} latitudes but {} longitudes".format(
+                len(lats), len(lons)))
+
+        n = len(lats)
+        size = self.cell_size
+        order = sorted(range(n),
+            key=lambda i: (lats[i] // size, lons[i] // size))
+
+        vertices = [0] * n
+        distances = [0.0] * n
+        seen = {}
+        for i in order:
+            point = (lats[i], lons[i])
+            if point not in seen:
+                seen[point] = self.nearest(point[0], point[1])
+            (vertices[i], distances[i]) = seen[point]
+
+        return (vertices, distances)
+
+
+def snap_many(V_coord, lats, lons, cell_size=200):
+    """
+    Snaps each (lats[i], lons[i]) onto its nearest vertex in V_coord,
+    returning (vertices, distances).  Builds a throwaway GridIndex; keep
+    your own GridIndex around when snapping more than one batch.
+
+    >>> V_coord = {1: (2,2), 2:(3,4), 3:(6,2), 4:(53, -113)}
+    >>> snap_many(V_coord, [3, 3], [4, 2])
+    ([2, 1], [0.0, 1.0])
+    """
+    return GridIndex(V_coord, cell_size).snap_many(lats, lons)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
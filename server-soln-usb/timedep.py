@@ -0,0 +1,339 @@
+"""
+Time dependent routing.
+
+cost_distance costs an edge the same at rush hour as at three in the
+morning.  Here the time to drive an edge depends on when you start down
+it: each edge has a free flow time, its length in metres at speed, and
+follows a speed profile, a piecewise linear function of the time of day
+that the free flow time is multiplied by.  A profile is given by its
+breakpoints (second after midnight, factor), is interpolated in between
+and wraps around midnight; a profile of one breakpoint is constant.
+
+Profiles keeps all of it in arrays, indexed by the edge numbers of a
+compact.CompactGraph:
+
+    base[e]         free flow seconds of edge e, an array('d')
+    profile[e]      profile number of edge e, an array('l')
+    start           breakpoints of profile p are start[p] .. start[p+1]-1
+    times           second after midnight of each breakpoint, array('l')
+    factors         factor at each breakpoint, array('d')
+
+so most of the memory is one int and one double per edge however many
+edges share a profile, and a byte per edge marking the edges given a
+profile of their own.  Profile 0, "free", is the constant 1.0.
+
+Profiles are read from a text file in the style of the map file:
+
+    P,rush,0:00,1.0,7:00,1.0,8:00,3.0,9:30,1.0
+    D,rush              every edge not listed follows rush
+    E,3,4,rush          edge (3, 4) follows rush
+
+An E line wins over the D line whichever comes first.
+
+earliest_arrival is Dijkstra's algorithm on arrival times (the earliest
+arrival at the end of an edge is the earliest arrival at its start plus
+the edge's travel time at that moment), steered towards the destination
+like A* by the straight line distance at the fastest speed any profile
+allows.  That is exact as long as leaving an edge later never gets you
+to its end sooner, which holds unless a profile drops faster than one
+second of travel time per second of the day.
+
+>>> import compact
+>>> V_coord = {1: (0, 0), 2: (0, 1000), 3: (0, 2000), 4: (800, 1000)}
+>>> C = compact.CompactGraph.from_edges(V_coord, [(1, 2), (2, 3), (1, 4), (4, 3)])
+>>> profiles = Profiles(C, V_coord)
+>>> profiles.add("rush", [(7 * 3600, 1.0), (8 * 3600, 3.0), (9 * 3600, 1.0)])
+1
+>>> profiles.assign(1, 2, "rush")
+>>> profiles.assign(2, 3, "rush")
+>>> td_path(C, profiles, 1, 3, parse_time("3:00"))
+[1, 2, 3]
+>>> td_path(C, profiles, 1, 3, parse_time("8:00"))
+[1, 4, 3]
+>>> round(profiles.factor(1, parse_time("7:30")), 2)
+2.0
+"""
+
+import heapq
+from array import array
+from bisect import bisect_right
+
+from directions import metres
+
+# seconds in a day, the period of every profile
+DAY = 24 * 3600
+
+# free flow speed in metres per second, 50 km/h
+SPEED = 50 / 3.6
+
+
+def parse_time(text):
+    """
+    Returns the second after midnight of a "hh:mm" or "hh:mm:ss" time.
+
+    >>> parse_time("7:30"), parse_time("23:59:59")
+    (27000, 86399)
+    """
+    fields = text.split(':')
+    if not 2 <= len(fields) <= 3:
+        raise ValueError("bad time {!r}, expected hh:mm".format(text))
+    try:
+        numbers = [int(f) for f in fields] + [0]
+    except ValueError:
+        raise ValueError("bad time {!r}, expected hh:mm".format(text))
+    (h, m, s) = numbers[:3]
+    if not (0 <= h < 24 and 0 <= m < 60 and 0 <= s < 60):
+        raise ValueError("bad time {!r}, expected hh:mm".format(text))
+    return h * 3600 + m * 60 + s
+
+
+class Profiles:
+    """
+    Speed profiles for the edges of the CompactGraph C, see the module
+    documentation.  Every edge starts out on profile 0, "free".
+    """
+
+    def __init__(self, C, V_coord, speed=SPEED):
+        if speed <= 0:
+            raise ValueError("speed must be positive, got {}".format(speed))
+        self.C = C
+        self.speed = speed
+        self.names = {"free": 0}
+        self.start = array('l', [0, 1])
+        self.times = array('l', [0])
+        self.factors = array('d', [1.0])
+
+        ids = C.ids
+        m = C.num_edges()
+        self.base = array('d', (metres(V_coord[ids[C.source[e]]],
+                                       V_coord[ids[C.target[e]]]) / speed
+                                for e in range(m)))
+        self.profile = array('l', [0]) * m
+        # 1 for the edges assign put on a profile, which set_default
+        # leaves alone
+        self.assigned = bytearray(m)
+
+    def add(self, name, points):
+        """
+        Adds the profile name with breakpoints points, a list of
+        (second after midnight, factor).  Returns its number.
+        """
+        if name in self.names:
+            raise ValueError("profile {!r} given twice".format(name))
+        points = sorted(points)
+        if not points:
+            raise ValueError("profile {!r} has no breakpoints".format(name))
+        for (t, f) in points:
+            if not 0 <= t < DAY:
+                raise ValueError("profile {!r}: time {} is not in the day".format(
+                    name, t))
+            if f <= 0:
+                raise ValueError("profile {!r}: factor {} is not positive".format(
+                    name, f))
+        if len({t for (t, f) in points}) != len(points):
+            raise ValueError("profile {!r} has two breakpoints at one time".format(
+                name))
+        p = self.names[name] = len(self.start) - 1
+        self.times.extend(t for (t, f) in points)
+        self.factors.extend(f for (t, f) in points)
+        self.start.append(len(self.times))
+        return p
+
+    def number(self, name):
+        p = self.names.get(name)
+        if p is None:
+            raise ValueError("unknown profile {!r}".format(name))
+        return p
+
+    def assign(self, u, v, name):
+        """
+        Puts edge (u, v) on the profile name.  Edges that are not in
+        the graph, as when only a region of the map was loaded, are
+        skipped.
+        """
+        p = self.number(name)
+        C = self.C
+        if u in C.index and v in C.index:
+            e = C.edge_number(u, v)
+            if e is not None:
+                self.profile[e] = p
+                self.assigned[e] = 1
+
+    def set_default(self, name):
+        """
+        Puts every edge on the profile name, except the edges assign
+        has put on a profile, before or after.
+        """
+        p = self.number(name)
+        profile = self.profile
+        assigned = self.assigned
+        for e in range(len(profile)):
+            if not assigned[e]:
+                profile[e] = p
+
+    def min_factor(self):
+        return min(self.factors)
+
+    def factor(self, p, t):
+        """
+        Returns the factor of profile p at second t, taken modulo a day.
+        """
+        lo = self.start[p]
+        hi = self.start[p + 1]
+        times = self.times
+        factors = self.factors
+        if hi - lo == 1:
+            return factors[lo]
+        t %= DAY
+        k = bisect_right(times, t, lo, hi)
+        if k == lo:
+            (t0, f0) = (times[hi - 1] - DAY, factors[hi - 1])
+            (t1, f1) = (times[lo], factors[lo])
+        elif k == hi:
+            (t0, f0) = (times[hi - 1], factors[hi - 1])
+            (t1, f1) = (times[lo] + DAY, factors[lo])
+        else:
+            (t0, f0) = (times[k - 1], factors[k - 1])
+            (t1, f1) = (times[k], factors[k])
+        return f0 + (f1 - f0) * (t - t0) / (t1 - t0)
+
+    def travel_time(self, e, t):
+        """
+        Seconds to drive edge number e starting down it at second t.
+        """
+        return self.base[e] * self.factor(self.profile[e], t)
+
+
+def read_profiles(file_name, C, V_coord, speed=SPEED):
+    """
+    Reads the profile file file_name, see the module documentation, for
+    the CompactGraph C and returns its Profiles.
+
+    >>> import compact, os, tempfile
+    >>> V_coord = {1: (0, 0), 2: (0, 1000), 3: (0, 2000)}
+    >>> C = compact.CompactGraph.from_edges(V_coord, [(1, 2), (2, 3)])
+    >>> with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as f:
+    ...     _ = f.write("P,rush,8:00,3.0\\nP,slow,0:00,2.0\\n"
+    ...                 "E,1,2,slow\\nD,rush\\n")
+    >>> profiles = read_profiles(f.name, C, V_coord)
+    >>> os.remove(f.name)
+    >>> [profiles.factor(profiles.profile[C.edge_number(u, v)], 0)
+    ...  for (u, v) in [(1, 2), (2, 3)]]
+    [2.0, 3.0]
+    """
+    profiles = Profiles(C, V_coord, speed)
+    with open(file_name) as f:
+        for line in f:
+            line = line.rstrip()
+            if not line:
+                continue
+            fields = line.split(",")
+            type = fields[0]
+            if type == 'P':
+                if len(fields) < 4 or len(fields) % 2:
+                    raise Exception("Error: bad profile line |{}|".format(line))
+                points = [(parse_time(fields[i]), float(fields[i + 1]))
+                          for i in range(2, len(fields), 2)]
+                profiles.add(fields[1], points)
+            elif type == 'D':
+                (name,) = fields[1:]
+                profiles.set_default(name)
+            elif type == 'E':
+                (u, v, name) = fields[1:]
+                profiles.assign(int(u), int(v), name)
+            else:
+                raise Exception("Error: weird line |{}|".format(line))
+    return profiles
+
+
+def earliest_arrival(C, profiles, start, dest, departure, V_coord=None,
+                     budget=None):
+    """
+    (arrival, parent) = earliest_arrival(C, profiles, start, dest,
+                                         departure, V_coord, budget)
+
+    Searches the CompactGraph C from vertex id start, leaving at second
+    departure, until vertex id dest is settled.  arrival is an
+    array('d') of the seconds after departure each vertex index is
+    reached at, and parent an array('l') of the vertex index before each
+    on the way, -1 for vertices not reached.  Given V_coord the search
+    heads for dest first, as A*.  Given a dijkstra.Budget, it stops when
+    the budget runs out.
+    """
+    n = C.num_vertices()
+    arrival = array('d', [float("inf")]) * n
+    parent = array('l', [-1]) * n
+    if start not in C.index or dest not in C.index:
+        return (arrival, parent)
+
+    ids = C.ids
+    target = C.target
+    out_start = C.out_start
+    travel_time = profiles.travel_time
+    s = C.index[start]
+    d = C.index[dest]
+
+    if V_coord is not None:
+        goal = V_coord[dest]
+        # no edge can be driven faster than this, in seconds per metre
+        pace = profiles.min_factor() / profiles.speed
+
+        def estimate(i):
+            return metres(V_coord[ids[i]], goal) * pace
+    else:
+        def estimate(i):
+            return 0.0
+
+    if budget is not None:
+        budget.start()
+    settled = bytearray(n)
+    arrival[s] = 0.0
+    heap = [(estimate(s), s)]
+    while heap:
+        (f, i) = heapq.heappop(heap)
+        if settled[i]:
+            continue
+        if budget is not None and not budget.spend():
+            break
+        settled[i] = 1
+        if i == d:
+            break
+        a = arrival[i]
+        now = departure + a
+        for e in range(out_start[i], out_start[i + 1]):
+            j = target[e]
+            if settled[j]:
+                continue
+            b = a + travel_time(e, now)
+            if b < arrival[j]:
+                arrival[j] = b
+                parent[j] = i
+                heapq.heappush(heap, (b + estimate(j), j))
+    return (arrival, parent)
+
+
+def td_path(C, profiles, start, dest, departure, V_coord=None):
+    """
+    Returns the quickest path from vertex id start to vertex id dest
+    leaving at second departure, as a list of vertex ids, or None if
+    there is no route.
+    """
+    (arrival, parent) = earliest_arrival(C, profiles, start, dest, departure,
+                                         V_coord)
+    if start not in C.index or dest not in C.index:
+        return None
+    s = C.index[start]
+    i = C.index[dest]
+    if i != s and parent[i] < 0:
+        return None
+    path = [dest]
+    while i != s:
+        i = parent[i]
+        path.append(C.ids[i])
+    path.reverse()
+    return path
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
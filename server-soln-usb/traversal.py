@@ -0,0 +1,264 @@
+"""
+Graph traversals that do not build new graphs.
+
+Every function here takes either a digraph.Digraph or a
+compact.CompactGraph.  Rather than a new Digraph (as spanning_tree
+returns) each search hands back a parent map:
+
+    Digraph        parent is a dict from vertex to the vertex it was
+                   reached from, with parent[source] = source
+    CompactGraph   parent is an array('l') indexed by vertex index,
+                   holding the index of the vertex it was reached from,
+                   parent[source] = source and -1 where not reached
+
+Vertices passed in are always vertex ids.  Orders and labels that come
+back for a CompactGraph are in vertex indexes; C.ids[i] turns index i
+back into a vertex id.
+
+>>> import digraph
+>>> G = digraph.Digraph([(1, 2), (2, 3), (3, 1), (3, 4), (4, 5)])
+>>> (order, parent) = bfs(G, 1)
+>>> order
+[1, 2, 3, 4, 5]
+>>> path_to(parent, 5)
+[1, 2, 3, 4, 5]
+>>> C = compact.CompactGraph.from_digraph(G, order=[1, 2, 3, 4, 5])
+>>> (order, parent) = bfs(C, 1)
+>>> list(order), list(parent)
+([0, 1, 2, 3, 4], [0, 0, 1, 2, 3])
+>>> scc(G)[0]
+3
+>>> print(topological_order(G))
+None
+>>> topological_order(digraph.Digraph([(1, 2), (1, 3), (3, 2)]))
+[1, 3, 2]
+"""
+
+from array import array
+from collections import deque
+
+import compact
+
+
+def _is_compact(G):
+    return isinstance(G, compact.CompactGraph)
+
+
+def bfs(G, source):
+    """
+    Breadth first search from source.  Returns (order, parent), where
+    order lists the reached vertices in the order they were reached.
+    """
+    if _is_compact(G):
+        n = G.num_vertices()
+        out_start = G.out_start
+        target = G.target
+        s = G.index[source]
+        parent = array('l', [-1]) * n
+        parent[s] = s
+        order = array('l', [s])
+        # order doubles as the queue: everything after head is waiting
+        head = 0
+        while head < len(order):
+            cur = order[head]
+            head += 1
+            for w in target[out_start[cur]:out_start[cur + 1]]:
+                if parent[w] < 0:
+                    parent[w] = cur
+                    order.append(w)
+        return (order, parent)
+
+    adj = G.adj_to
+    parent = {source: source}
+    order = [source]
+    queue = deque(order)
+    while queue:
+        cur = queue.popleft()
+        for n in adj(cur):
+            if n not in parent:
+                parent[n] = cur
+                order.append(n)
+                queue.append(n)
+    return (order, parent)
+
+
+def dfs(G, source):
+    """
+    Depth first search from source, visiting vertices in the same order
+    as digraph.spanning_tree.  Returns (order, parent), with order the
+    preorder of the search tree.
+    """
+    if _is_compact(G):
+        n = G.num_vertices()
+        out_start = G.out_start
+        target = G.target
+        s = G.index[source]
+        parent = array('l', [-1]) * n
+        order = array('l')
+        todo = array('l', [s, s])  # pairs of (vertex, parent)
+        while todo:
+            p = todo.pop()
+            cur = todo.pop()
+            if parent[cur] >= 0:
+                continue
+            parent[cur] = p
+            order.append(cur)
+            for w in target[out_start[cur]:out_start[cur + 1]]:
+                if parent[w] < 0:
+                    todo.append(w)
+                    todo.append(cur)
+        return (order, parent)
+
+    adj = G.adj_to
+    parent = {}
+    order = []
+    todo = [(source, source)]
+    while todo:
+        (cur, p) = todo.pop()
+        if cur in parent:
+            continue
+        parent[cur] = p
+        order.append(cur)
+        for n in adj(cur):
+            if n not in parent:
+                todo.append((n, cur))
+    return (order, parent)
+
+
+def path_to(parent, dest):
+    """
+    Follows a parent map or array from dest back to the search source
+    and returns the path from the source to dest, or None if dest was
+    not reached.
+
+    >>> path_to({1: 1, 2: 1, 3: 2}, 3)
+    [1, 2, 3]
+    >>> path_to(array('l', [0, 0, -1]), 2) is None
+    True
+    """
+    if isinstance(parent, dict):
+        if dest not in parent:
+            return None
+    elif parent[dest] < 0:
+        return None
+    path = [dest]
+    while parent[path[-1]] != path[-1]:
+        path.append(parent[path[-1]])
+    path.reverse()
+    return path
+
+
+def _vertices(G):
+    """
+    Returns (vertices, successor function) for G, working in vertex
+    indexes for a CompactGraph.
+    """
+    if _is_compact(G):
+        out_start = G.out_start
+        target = G.target
+        return (range(G.num_vertices()),
+                lambda i: target[out_start[i]:out_start[i + 1]])
+    return (list(G.vertices()), G.adj_to)
+
+
+def topological_order(G):
+    """
+    Returns the vertices of G in an order where every edge goes forward,
+    or None if G has a cycle.  Uses Kahn's algorithm.
+    """
+    (vertices, adj) = _vertices(G)
+    if _is_compact(G):
+        indegree = array('l', [0]) * len(vertices)
+    else:
+        indegree = {v: 0 for v in vertices}
+    for v in vertices:
+        for n in adj(v):
+            indegree[n] += 1
+
+    ready = deque(v for v in vertices if indegree[v] == 0)
+    order = []
+    while ready:
+        v = ready.popleft()
+        order.append(v)
+        for n in adj(v):
+            indegree[n] -= 1
+            if indegree[n] == 0:
+                ready.append(n)
+
+    if len(order) != len(vertices):
+        return None
+    return order
+
+
+def scc(G):
+    """
+    Strongly connected components by Tarjan's algorithm, without
+    recursion.  Returns (count, label) where label maps each vertex to
+    its component number, 0 .. count-1.  Components are numbered in
+    reverse topological order: edges between components only ever go
+    from a higher number to a lower one.
+    """
+    (vertices, adj) = _vertices(G)
+    if _is_compact(G):
+        n = len(vertices)
+        index = array('l', [-1]) * n
+        low = array('l', [0]) * n
+        label = array('l', [-1]) * n
+        seen = lambda v: index[v] >= 0
+    else:
+        index = {}
+        low = {}
+        label = {}
+        seen = index.__contains__
+
+    counter = 0
+    count = 0
+    stack = []
+    on_stack = set()
+
+    for root in vertices:
+        if seen(root):
+            continue
+        # each frame is (vertex, iterator over its successors)
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+        frames = [(root, iter(adj(root)))]
+        while frames:
+            (v, it) = frames[-1]
+            descended = False
+            for w in it:
+                if not seen(w):
+                    index[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack.add(w)
+                    frames.append((w, iter(adj(w))))
+                    descended = True
+                    break
+                elif w in on_stack and index[w] < low[v]:
+                    low[v] = index[w]
+            if descended:
+                continue
+
+            frames.pop()
+            if frames:
+                u = frames[-1][0]
+                if low[v] < low[u]:
+                    low[u] = low[v]
+            if low[v] == index[v]:
+                while True:
+                    w = stack.pop()
+                    on_stack.discard(w)
+                    label[w] = count
+                    if w == v:
+                        break
+                count += 1
+
+    return (count, label)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,175 @@
+"""
+Turn aware routing.
+
+least_cost_path searches over vertices, so the cost of arriving at a
+vertex cannot depend on where you came from.  Here the search is over
+edges instead: the state is the edge just driven along, and moving on
+to the next edge costs that edge plus a turn cost.  This is Dijkstra's
+algorithm on the line graph of the road graph, but the line graph is
+never built; the successors of edge (a, b) are read straight out of the
+out edges of b in a compact.CompactGraph.
+
+A turn a -> b -> c costs
+    angle_cost * (deflection / pi)    deflection is 0 going straight on
+                                      and pi for a u-turn, using V_coord
+  + name_cost                         if E_name of (a, b) and (b, c) differ
+and is not allowed at all if it is a u-turn (c == a) and u_turns is
+False, or if (a, b, c) is in the banned set.
+
+>>> import compact
+>>> V_coord = {1: (0, 0), 2: (0, 10), 3: (0, 20), 4: (10, 10), 5: (10, 20)}
+>>> E = [(1, 2), (2, 3), (2, 4), (4, 5), (5, 3)]
+>>> E_name = {(1, 2): "A", (2, 3): "A", (2, 4): "B", (4, 5): "C", (5, 3): "D"}
+>>> C = compact.CompactGraph.from_edges(V_coord, E)
+>>> def length(e):
+...     (a, b) = (V_coord[e[0]], V_coord[e[1]])
+...     return ((a[0] - b[0])**2 + (a[1] - b[1])**2)**.5
+>>> turns = TurnCosts(C, V_coord, E_name)
+>>> least_cost_turn_path(C, 1, 3, length, turns)
+[1, 2, 3]
+>>> turns = TurnCosts(C, V_coord, E_name, banned={(1, 2, 3)})
+>>> least_cost_turn_path(C, 1, 3, length, turns)
+[1, 2, 4, 5, 3]
+>>> print(least_cost_turn_path(C, 3, 1, length, turns))
+None
+"""
+
+import heapq
+import math
+from array import array
+
+from directions import METRES_LAT, METRES_LON
+
+
+class TurnCosts:
+    """
+    Per turn costs and restrictions for a CompactGraph.
+
+    Street names and edge bearings are worked out once per edge and kept
+    in arrays indexed by edge number, so a turn costs two array lookups
+    and a little arithmetic.  Bearings are taken on the ground, so a
+    right angle costs the same whichever way the junction faces: here
+    north east then north west, with a turn costing its angle in degrees
+
+    >>> import compact
+    >>> V_coord = {1: (0, 0), 2: (900, 1511), 3: (1800, 0)}
+    >>> C = compact.CompactGraph.from_edges(V_coord, [(1, 2), (2, 3)])
+    >>> turns = TurnCosts(C, V_coord, {}, angle_cost=180, name_cost=0)
+    >>> round(turns.turn(C.edge_number(1, 2), C.edge_number(2, 3)))
+    90
+    """
+
+    def __init__(self, C, V_coord, E_name, angle_cost=10.0, name_cost=20.0,
+                 u_turns=False, banned=()):
+        self.C = C
+        self.angle_cost = angle_cost
+        self.name_cost = name_cost
+        self.u_turns = u_turns
+        self.banned = set(banned)
+
+        ids = C.ids
+        m = C.num_edges()
+        name_ids = {}
+        self.name = array('l', [0]) * m
+        self.bearing = array('d', [0.0]) * m
+        for e in range(m):
+            (u, v) = (ids[C.source[e]], ids[C.target[e]])
+            name = E_name.get((u, v), "")
+            self.name[e] = name_ids.setdefault(name, len(name_ids))
+            (a, b) = (V_coord[u], V_coord[v])
+            # in metres, as a degree of longitude is shorter than one of
+            # latitude, see directions.turn
+            self.bearing[e] = math.atan2((b[1] - a[1]) * METRES_LON,
+                                         (b[0] - a[0]) * METRES_LAT)
+
+    def turn(self, e, f):
+        """
+        Returns the cost of turning from edge number e onto edge number
+        f, which must leave the vertex e enters, or None if the turn is
+        not allowed.
+        """
+        C = self.C
+        a = C.source[e]
+        c = C.target[f]
+        if a == c and not self.u_turns:
+            return None
+        if self.banned:
+            ids = C.ids
+            if (ids[a], ids[C.source[f]], ids[c]) in self.banned:
+                return None
+
+        deflection = abs(self.bearing[f] - self.bearing[e])
+        if deflection > math.pi:
+            deflection = 2 * math.pi - deflection
+        cost = self.angle_cost * deflection / math.pi
+        if self.name[e] != self.name[f]:
+            cost += self.name_cost
+        return cost
+
+
+def least_cost_turn_path(C, start, dest, cost, turns):
+    """
+    Returns the least cost path from vertex id start to vertex id dest
+    in the CompactGraph C as a list of vertex ids, counting both the
+    edge costs given by cost((u, v)) and the turn costs of turns, a
+    TurnCosts.  Returns None if there is no allowed route.
+
+    The path from start to start is [start].
+    """
+    if start not in C.index or dest not in C.index:
+        return None
+    if start == dest:
+        return [start]
+
+    ids = C.ids
+    source = C.source
+    target = C.target
+    out_start = C.out_start
+    d = C.index[dest]
+
+    # dist and parent are keyed by edge number, and only hold the edges
+    # the search actually reaches
+    best = {}
+    parent = {}
+    heap = []
+    for e in C.out_edges(C.index[start]):
+        c = cost((start, ids[target[e]]))
+        if e not in best or c < best[e]:
+            best[e] = c
+            parent[e] = None
+            heapq.heappush(heap, (c, e))
+
+    settled = set()
+    while heap:
+        (c, e) = heapq.heappop(heap)
+        if e in settled:
+            continue
+        settled.add(e)
+
+        b = target[e]
+        if b == d:
+            path = [dest]
+            while e is not None:
+                path.append(ids[source[e]])
+                e = parent[e]
+            path.reverse()
+            return path
+
+        for f in range(out_start[b], out_start[b + 1]):
+            if f in settled:
+                continue
+            t = turns.turn(e, f)
+            if t is None:
+                continue
+            nc = c + t + cost((ids[b], ids[target[f]]))
+            if f not in best or nc < best[f]:
+                best[f] = nc
+                parent[f] = e
+                heapq.heappush(heap, (nc, f))
+
+    return None
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()